@@ -0,0 +1,203 @@
+import asyncio
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import parallel_tabs
+from booking_utils import (attempt_booking, close_booking_session, open_booking_session, send_error_email,
+                           setup_logger, stage_booking_session, stages_before_release)
+from booking_log import log
+from slot_claims import iter_claimed_slots
+
+DEFAULT_PHASE_TIMEOUTS = {"login": 120, "stage": 60, "submit": 60}  # seconds
+PREP_LEAD_SECONDS = 300  # Open sessions this long before the fire instant, like the threaded mode
+FIRE_SPIN_LEAD = 0.05  # Hand the last moments before the fire instant to the scheduler's precise wait
+
+
+class AsyncOrchestrator:
+    """
+    Runs user sessions as asyncio tasks, with at most max_concurrency users logging in at once.
+
+    Blocking WebDriver work goes through a dedicated thread pool; each phase (login, stage, submit) has
+    its own timeout. Results are streamed as they complete, and once every slot is won the remaining
+    tasks are cancelled. A phase abandoned by its timeout or a cancellation keeps running on its thread:
+    its session is closed, and its result reported, only once that thread is done with it.
+    """
+
+    def __init__(self, config, target_date, prio_days, scheduler, claim_board=None, browser_pool=None, max_concurrency=None):
+        self.config = config
+        self.target_date = target_date
+        self.prio_days = prio_days
+        self.scheduler = scheduler
+        self.claim_board = claim_board
+        self.browser_pool = browser_pool
+        self.max_concurrency = max_concurrency or max(len(config["users"]), 1)
+        self.timeouts = dict(DEFAULT_PHASE_TIMEOUTS, **config.get("phase_timeouts", {}))
+        # Two workers per session: one running a phase, one waiting on slot claims
+        self.executor = ThreadPoolExecutor(max_workers=max(len(config["users"]), 1) * 2, thread_name_prefix="webdriver")
+        self.won = {}  # slot -> username, for first-success cancellation
+        self.semaphore = None
+        self.tasks = []
+        self.late_tasks = []  # Abandoned phases still running on their threads
+
+    async def _blocking(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def _phase(self, phase, fn, *args, on_late=None):
+        """
+        Run a blocking phase with its timeout. If the wait is abandoned, the thread keeps running and
+        on_late(result, error) is awaited once it finishes.
+        """
+        future = asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeouts[phase])
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if on_late is not None:
+                self.late_tasks.append(asyncio.create_task(self._after(future, on_late)))
+            raise
+
+    async def _after(self, future, on_late):
+        try:
+            result, error = await future, None
+        except Exception as e:
+            result, error = None, e
+        await on_late(result, error)
+
+    async def _report(self, result, results):
+        await results.put(result)
+        if result["status"] == "Success":
+            self.won.setdefault(result["time"], result["username"])
+            if self._all_won(self.config["times"]):
+                self.cancel_pending()
+
+    async def _sleep_until(self, seconds_before_fire):
+        await self.scheduler.clock.async_sleep(max(0, self.scheduler.seconds_until_fire() - seconds_before_fire))
+
+    def _all_won(self, time_slots):
+        return all(slot in self.won for slot in time_slots)
+
+    async def run_user(self, user, time_slots, results):
+        username = user["username"]
+        logger = setup_logger(username, "multiple_slots")
+        amenity_name = self.config["primary_amenity_name"]
+        amenity_id = self.config["amenities"][amenity_name]
+        session = None
+        in_flight = False  # An abandoned phase still holds the session and will close it
+
+        async def late_login(late_session, error):
+            if late_session is not None:
+                await self._blocking(close_booking_session, late_session, logger)
+
+        async def late_session_phase(late, error):
+            if error is not None:
+                logger.error(f"Abandoned phase failed: {error}")
+            for result in late if isinstance(late, list) else [late] if late is not None else []:
+                logger.info(f"Late result of an abandoned phase: {result['time']} {result['status']}")
+                await self._report(result, results)
+            await self._blocking(close_booking_session, session, logger)
+
+        async def session_phase(phase, fn, *args):
+            nonlocal in_flight
+            try:
+                return await self._phase(phase, fn, *args, on_late=late_session_phase)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                in_flight = True
+                raise
+
+        await self._sleep_until(PREP_LEAD_SECONDS)
+        try:
+            # Only logins are limited: every session that logs in stays open through release
+            async with self.semaphore:
+                session = await self._phase(
+                    "login", open_booking_session, username, user["password"], self.target_date, self.prio_days,
+                    amenity_id, self.config["refresh_interval_seconds"], self.config, logger, self.browser_pool, self.scheduler.clock,
+                    on_late=late_login)
+
+            if stages_before_release(self.config):
+                await self._sleep_until(self.config.get("stage_lead_seconds", 20))
+                await session_phase("stage", stage_booking_session, session, self.target_date, time_slots,
+                                    amenity_name, self.config, logger, self.claim_board)
+
+            await self._sleep_until(FIRE_SPIN_LEAD)
+            await self._blocking(self.scheduler.wait_for_fire, username)
+
+            if session["tabs"]:
+                tab_results = await session_phase("submit", parallel_tabs.submit_tabs, session, self.target_date,
+                                                  self.config, self.scheduler, self.claim_board)
+                for result in tab_results:
+                    await self._report(result, results)
+                time_slots = parallel_tabs.remaining_slots(time_slots, tab_results, self.claim_board)
+
+            claims = iter_claimed_slots(self.claim_board, username, time_slots, amenity_name, session["first_claim"])
+            while True:
+                claim = await self._blocking(next, claims, None)
+                if claim is None:
+                    break
+                start_time, attempt_amenity_name = claim
+                if self.claim_board is None and start_time in self.won:
+                    continue  # Another user already won this slot
+                try:
+                    result = await session_phase("submit", attempt_booking, session, start_time, attempt_amenity_name,
+                                                 self.target_date, self.config, self.scheduler, self.claim_board)
+                except asyncio.TimeoutError:
+                    # The browser is still busy in the abandoned call; its result is reported when it finishes
+                    logger.error(f"Submit phase timed out after {self.timeouts['submit']}s for {start_time}; not reusing the browser.")
+                    break
+                await self._report(result, results)
+        except asyncio.TimeoutError:
+            error_message = f"Phase timed out for {username}."
+            logger.error(error_message)
+            send_error_email(self.config, username, error_message)
+        except asyncio.CancelledError:
+            logger.info("Cancelled: every slot has been won.")
+            raise
+        except Exception:
+            error_message = f"Exception in overall booking process: {traceback.format_exc()}"
+            logger.error(error_message)
+            send_error_email(self.config, username, error_message)
+        finally:
+            if session is not None and not in_flight:
+                await self._blocking(close_booking_session, session, logger)
+
+    def cancel_pending(self):
+        current = asyncio.current_task()
+        for task in self.tasks:
+            if task is not current and not task.done():
+                task.cancel()
+
+    async def stream(self, jobs):
+        """Run (user, time_slots) jobs and yield each result as soon as it completes."""
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self.run_user(user, time_slots, results)) for user, time_slots in jobs]
+
+        async def finish():
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            # Abandoned phases can add late results; tasks they cancel are already done
+            while self.late_tasks:
+                await asyncio.gather(self.late_tasks.pop(0), return_exceptions=True)
+            await results.put(None)
+
+        finisher = asyncio.create_task(finish())
+        try:
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                yield result
+        finally:
+            await finisher
+            self.executor.shutdown(wait=False)
+
+
+def run_async_bookings(config, jobs, target_date, prio_days, scheduler, claim_board=None, browser_pool=None):
+    """Run the jobs with the asyncio orchestrator, printing results as they arrive. Returns all results."""
+    orchestrator = AsyncOrchestrator(config, target_date, prio_days, scheduler, claim_board, browser_pool,
+                                     config.get("async_max_concurrency"))
+
+    async def collect():
+        collected = []
+        async for result in orchestrator.stream(jobs):
+            log(result["username"], f"{result['time']} at {result['amenity_name']}: {result['status']} - {result['message']}")
+            collected.append(result)
+        return collected
+
+    return asyncio.run(collect())
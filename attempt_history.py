@@ -0,0 +1,301 @@
+"""
+Attempt history: every booking attempt of every run in a local SQLite file, with the queries the
+adaptive slot order and the report are built on.
+
+    python attempt_history.py --days 30
+    python attempt_history.py --user alice
+"""
+import argparse
+import datetime
+import logging
+import queue
+import sqlite3
+import statistics
+import threading
+from contextlib import contextmanager
+from booking_log import log
+
+HISTORY_DB = "attempt_history.db"
+HISTORY_DAYS = 90  # Older runs are ignored when ordering users and slots
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    recorded_at TEXT NOT NULL,
+    target_date TEXT NOT NULL,
+    run_key TEXT,
+    mode TEXT
+);
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    username TEXT NOT NULL,
+    slot TEXT NOT NULL,
+    amenity TEXT,
+    status TEXT NOT NULL,
+    message TEXT,
+    t0_to_submit_ms REAL
+);
+CREATE TABLE IF NOT EXISTS phase_timings (
+    attempt_id INTEGER NOT NULL REFERENCES attempts (id),
+    phase TEXT NOT NULL,
+    duration_ms REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_recorded_at ON runs (recorded_at);
+CREATE INDEX IF NOT EXISTS attempts_run ON attempts (run_id);
+CREATE INDEX IF NOT EXISTS attempts_user_slot ON attempts (username, slot);
+CREATE INDEX IF NOT EXISTS attempts_slot ON attempts (slot);
+CREATE INDEX IF NOT EXISTS phase_timings_attempt ON phase_timings (attempt_id);
+"""
+
+# Attempts cancelled or skipped before submitting say nothing about a user or a slot
+_WINDOW_QUERY = """
+SELECT {columns}, a.status, a.t0_to_submit_ms
+FROM attempts a JOIN runs r ON r.id = a.run_id
+WHERE r.recorded_at >= ? AND a.status NOT IN ('Cancelled', 'Skipped') {condition}
+"""
+
+
+class AttemptHistory:
+    """Local store of booking attempts: outcome, error text, T0-to-submit latency and phase timings."""
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def start_run(self, target_date, run_key=None, mode=None, recorded_at=None):
+        """Add a run and return its id; its attempts are added with record_attempt."""
+        recorded_at = recorded_at or datetime.datetime.now()
+        with self._connect() as conn:
+            return conn.execute("INSERT INTO runs (recorded_at, target_date, run_key, mode) VALUES (?, ?, ?, ?)",
+                                (recorded_at.isoformat(timespec="seconds"), target_date, run_key, mode)).lastrowid
+
+    def record_attempt(self, run_id, result):
+        with self._connect() as conn:
+            _insert_attempt(conn, run_id, result)
+
+    def record_run(self, target_date, results, run_key=None, mode=None, recorded_at=None):
+        """Store one run's attempt results at once and return the run id."""
+        run_id = self.start_run(target_date, run_key, mode, recorded_at)
+        with self._connect() as conn:
+            for result in results:
+                _insert_attempt(conn, run_id, result)
+        return run_id
+
+    def _cutoff(self, days, now=None):
+        if days is None:
+            return ""
+        return ((now or datetime.datetime.now()) - datetime.timedelta(days=days)).isoformat(timespec="seconds")
+
+    def _outcomes(self, columns, days=None, username=None, now=None):
+        """{key: {attempts, wins, win_rate, smoothed_rate, p50_ms}} grouped by the given attempt columns."""
+        condition, params = "", [self._cutoff(days, now)]
+        if username is not None:
+            condition, params = "AND a.username = ?", params + [username]
+        stats = {}
+        with self._connect() as conn:
+            for row in conn.execute(_WINDOW_QUERY.format(columns=columns, condition=condition), params):
+                key = row[0] if len(row) == 3 else tuple(row[:-2])
+                entry = stats.setdefault(key, {"attempts": 0, "wins": 0, "latencies": []})
+                entry["attempts"] += 1
+                entry["wins"] += row[-2] == "Success"
+                if row[-1] is not None:
+                    entry["latencies"].append(row[-1])
+        for entry in stats.values():
+            entry["win_rate"] = entry["wins"] / entry["attempts"]
+            entry["smoothed_rate"] = (entry["wins"] + 1) / (entry["attempts"] + 2)  # Few attempts stay close to 50%
+            latencies = entry.pop("latencies")
+            entry["p50_ms"] = statistics.median(latencies) if latencies else None
+        return stats
+
+    def user_stats(self, days=None, now=None):
+        """Per user: attempts, wins, win rate and median T0-to-submit latency."""
+        return self._outcomes("a.username", days, now=now)
+
+    def slot_stats(self, days=None, now=None):
+        """Per slot: how often an attempt on it succeeded; low rates mark contested slots."""
+        return self._outcomes("a.slot", days, now=now)
+
+    def user_slot_stats(self, days=None, username=None, now=None):
+        return self._outcomes("a.username, a.slot", days, username, now)
+
+    def phase_stats(self, days=None, username=None):
+        """Per phase: count, p50 and p95 duration in ms."""
+        condition, params = "", [self._cutoff(days)]
+        if username is not None:
+            condition, params = "AND a.username = ?", params + [username]
+        durations = {}
+        with self._connect() as conn:
+            for phase, ms in conn.execute(
+                    "SELECT p.phase, p.duration_ms FROM phase_timings p JOIN attempts a ON a.id = p.attempt_id "
+                    f"JOIN runs r ON r.id = a.run_id WHERE r.recorded_at >= ? {condition}", params):
+                durations.setdefault(phase, []).append(ms)
+        summary = {}
+        for phase, values in durations.items():
+            values.sort()
+            summary[phase] = {"count": len(values), "p50_ms": values[int(0.5 * (len(values) - 1))],
+                              "p95_ms": values[int(0.95 * (len(values) - 1))]}
+        return summary
+
+    def recent_runs(self, limit=10):
+        """The latest runs: (id, recorded_at, target_date, mode, attempts, wins), newest first."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT r.id, r.recorded_at, r.target_date, r.mode, COUNT(a.id), COALESCE(SUM(a.status = 'Success'), 0) "
+                "FROM runs r LEFT JOIN attempts a ON a.run_id = r.id GROUP BY r.id ORDER BY r.id DESC LIMIT ?", (limit,)).fetchall()
+
+    def recent_errors(self, limit=10, username=None):
+        """The latest failed attempts' messages: (recorded_at, username, slot, message)."""
+        condition, params = "", [limit]
+        if username is not None:
+            condition, params = "AND a.username = ?", [username, limit]
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT r.recorded_at, a.username, a.slot, a.message FROM attempts a JOIN runs r ON r.id = a.run_id "
+                f"WHERE a.status = 'Failed' {condition} ORDER BY a.id DESC LIMIT ?", params).fetchall()
+
+    def order_jobs(self, users, times, days=HISTORY_DAYS, now=None):
+        """
+        (user, time_slots) jobs ordered by past results: users by smoothed win rate, then median
+        T0-to-submit latency; slots from most to least contested. The strongest user goes for the
+        most contested slot first, the next user for the next one, and so on, each continuing in
+        that rotation. Users and slots without history rank in the middle and keep their config order.
+        """
+        user_stats = self.user_stats(days, now)
+        slot_stats = self.slot_stats(days, now)
+
+        def user_key(user):
+            stats = user_stats.get(user["username"])
+            if stats is None:
+                return (-0.5, float("inf"))
+            return (-stats["smoothed_rate"], stats["p50_ms"] if stats["p50_ms"] is not None else float("inf"))
+
+        ranked_users = sorted(users, key=user_key)
+        ranked_slots = sorted(times, key=lambda slot: slot_stats[slot]["smoothed_rate"] if slot in slot_stats else 0.5)
+        jobs = []
+        for index, user in enumerate(ranked_users):
+            offset = index % len(ranked_slots) if ranked_slots else 0
+            jobs.append((user, ranked_slots[offset:] + ranked_slots[:offset]))
+        return jobs
+
+
+def _insert_attempt(conn, run_id, result):
+    attempt_id = conn.execute(
+        "INSERT INTO attempts (run_id, username, slot, amenity, status, message, t0_to_submit_ms) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (run_id, result["username"], result["time"], result.get("amenity_name"), result["status"],
+         result.get("message"), result.get("t0_to_submit_ms"))).lastrowid
+    conn.executemany("INSERT INTO phase_timings VALUES (?, ?, ?)",
+                     [(attempt_id, phase, ms) for phase, ms in result.get("phases_ms", {}).items()])
+
+
+class RunRecorder:
+    """
+    Records every attempt of the runs in progress in this process as soon as it finishes, so a crash
+    loses none of them. A background thread does the writing; booking threads never wait on SQLite.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs = {}  # run_key -> (history, run_id)
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def start(self, history, target_date, run_key, mode=None, recorded_at=None):
+        run_id = history.start_run(target_date, run_key, mode, recorded_at)
+        with self.lock:
+            self.runs[run_key] = (history, run_id)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._write, name="attempt-history", daemon=True)
+                self.thread.start()
+        return run_id
+
+    def record(self, run_key, result):
+        """Queue a finished attempt of the run, if the run is being recorded."""
+        with self.lock:
+            run = self.runs.get(run_key)
+        if run is not None:
+            self.queue.put((run, dict(result)))
+
+    def finish(self, run_key):
+        """Wait until the queued attempts are written and stop recording the run."""
+        self.queue.join()
+        with self.lock:
+            self.runs.pop(run_key, None)
+
+    def _write(self):
+        while True:
+            (history, run_id), result = self.queue.get()
+            try:
+                history.record_attempt(run_id, result)
+            except sqlite3.Error as e:
+                log(result["username"], f"Could not record attempt in {history.path}: {e}", logging.ERROR)
+            finally:
+                self.queue.task_done()
+
+
+RECORDER = RunRecorder()
+
+
+def run_key_for(config, target_date):
+    """Key of a run: its target date and primary amenity."""
+    return f"{target_date}:{config['amenities'][config['primary_amenity_name']]}"
+
+
+def _percent(value):
+    return f"{value:.0%}"
+
+
+def _ms(value):
+    return f"{value:.1f}ms" if value is not None else "-"
+
+
+def print_report(history, days=None, username=None):
+    window = f"last {days} days" if days is not None else "all runs"
+    print(f"Attempt history in {history.path} ({window})")
+
+    print(f"\n{'run':>5} {'recorded':<20} {'target date':<12} {'mode':<9} {'attempts':>8} {'wins':>5}")
+    for run_id, recorded_at, target_date, mode, attempts, wins in history.recent_runs():
+        print(f"{run_id:>5} {recorded_at:<20} {target_date:<12} {mode or '-':<9} {attempts:>8} {wins:>5}")
+
+    users = history.user_stats(days) if username is None else history.user_slot_stats(days, username)
+    label = "user" if username is None else f"{username} slot"
+    print(f"\n{label:<20} {'attempts':>8} {'wins':>5} {'win rate':>9} {'t0->submit p50':>15}")
+    for key, stats in sorted(users.items(), key=lambda item: -item[1]["smoothed_rate"]):
+        name = key if username is None else key[1]
+        print(f"{name:<20} {stats['attempts']:>8} {stats['wins']:>5} {_percent(stats['win_rate']):>9} {_ms(stats['p50_ms']):>15}")
+
+    if username is None:
+        print(f"\n{'slot':<8} {'attempts':>8} {'wins':>5} {'win rate':>9}")
+        for slot, stats in sorted(history.slot_stats(days).items(), key=lambda item: item[1]["smoothed_rate"]):
+            print(f"{slot:<8} {stats['attempts']:>8} {stats['wins']:>5} {_percent(stats['win_rate']):>9}")
+
+    print(f"\n{'phase':<28} {'count':>6} {'p50':>10} {'p95':>10}")
+    for phase, stats in sorted(history.phase_stats(days, username).items()):
+        print(f"{phase:<28} {stats['count']:>6} {_ms(stats['p50_ms']):>10} {_ms(stats['p95_ms']):>10}")
+
+    errors = history.recent_errors(username=username)
+    if errors:
+        print("\nRecent failures:")
+        for recorded_at, user, slot, message in errors:
+            last_line = (message or "").strip().splitlines()[-1:] or [""]  # Tracebacks end with the exception
+            print(f"  {recorded_at} [{user}] {slot}: {last_line[0]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report on past booking attempts.")
+    parser.add_argument("--db", default=HISTORY_DB, help="History file (attempt_history_db).")
+    parser.add_argument("--days", type=int, help="Only runs from the last N days.")
+    parser.add_argument("--user", help="Per-slot results and phase timings for one user.")
+    args = parser.parse_args()
+
+    print_report(AttemptHistory(args.db), args.days, args.user)
@@ -0,0 +1,168 @@
+"""
+Shared availability snapshot: which start times each amenity still offers on the target date.
+
+One scanner session reads the reservation page from the fire instant on, and again right after every
+submit; reservation pages the HTTP fast path fetches are published too. Workers look a slot up before
+spending round trips on it and skip it when a fresh snapshot no longer offers it in the start picker.
+"""
+import threading
+import time
+import booking_http
+import booking_utils
+from booking_log import log
+
+MAX_AGE_SECONDS = 5  # Older snapshots are not trusted to skip a slot
+SCAN_INTERVAL = 2  # seconds between scans while nobody submits
+CLOSED_RETRY_SECONDS = 0.05  # Rescan this soon while the date still reads as unavailable
+
+
+class _Watch:
+    """The targets of one run, with the scanner that keeps their snapshots fresh."""
+
+    def __init__(self, targets, scheduler, max_age, interval):
+        self.targets = list(targets)
+        self.scheduler = scheduler
+        self.max_age = max_age
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.refresh = threading.Event()
+        self.scanner = None
+        self.http_session = None
+
+
+class AvailabilityBoard:
+    """
+    Latest picker state per (amenity_id, target_date), shared by every worker in the process.
+    Each run watches its own targets; runs that overlap (e.g. in the campaign daemon) each get a scanner.
+
+    A page showing the "currently unavailable" panel is never used to skip a slot: before release
+    every date looks like that, so a date that stays closed is left to the normal check. Neither is a
+    page without the start picker (a login redirect, an error or a post-submit page): it says nothing
+    about which slots are left.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.watches = []
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.snapshots = {}  # (amenity_id, target_date) -> (monotonic time fetched, unavailable, offered HH:MM set)
+        self.hits = 0
+        self.skips = 0
+        self.misses = 0
+        self.stale = 0
+        self.scans = 0
+        self.ages = []  # Age in seconds of every snapshot a lookup was answered from
+
+    @property
+    def targets(self):
+        with self.lock:
+            return [target for watch in self.watches for target in watch.targets]
+
+    def start(self, targets, scheduler, max_age=MAX_AGE_SECONDS, interval=SCAN_INTERVAL):
+        """
+        Watch the (amenity_id, target_date) targets for a run and return the watch to stop afterwards.
+        Its scanner starts on the first session offered; the counters restart when no other run is watching.
+        """
+        watch = _Watch(targets, scheduler, max_age, interval)
+        with self.lock:
+            if not self.watches:
+                self._reset_stats()
+            self.watches.append(watch)
+        return watch
+
+    def stop(self, watch):
+        """Stop a run's scanner and forget its targets."""
+        if watch is None:
+            return
+        watch.stopped.set()
+        watch.refresh.set()
+        with self.lock:
+            if watch in self.watches:
+                self.watches.remove(watch)
+        if watch.scanner is not None and watch.scanner is not threading.current_thread():
+            watch.scanner.join(timeout=booking_http.HTTP_TIMEOUT)
+
+    def offer_session(self, driver):
+        """Start the scanner of every watch still without one, using a copy of a logged-in browser's cookies."""
+        with self.lock:
+            waiting = [watch for watch in self.watches if watch.scanner is None and not watch.stopped.is_set()]
+            for watch in waiting:
+                watch.scanner = threading.Thread(target=self._scan_loop, args=(watch,), name="availability", daemon=True)
+        for watch in waiting:
+            watch.http_session = booking_http.create_session(driver)
+            watch.scanner.start()
+
+    def publish(self, amenity_id, target_date, page):
+        """Record the picker state of a reservation page parsed by booking_http.parse_reservation_page."""
+        if not self.watches or page is None or not page["has_start_picker"]:
+            return
+        offered = {booking_utils.convert_to_24_hour_format(option) for option in page["start_options"]}
+        with self.lock:
+            self.snapshots[(amenity_id, target_date)] = (time.monotonic(), page["unavailable"], offered)
+
+    def request_refresh(self):
+        """Ask the scanners to read their pages again now, e.g. right after a submit."""
+        with self.lock:
+            for watch in self.watches:
+                watch.refresh.set()
+
+    def _max_age(self, target):
+        for watch in self.watches:
+            if target in watch.targets:
+                return watch.max_age
+        return None
+
+    def is_taken(self, amenity_id, target_date, slot):
+        """True if a fresh snapshot of an open date no longer offers the slot."""
+        target = (amenity_id, target_date)
+        with self.lock:
+            max_age = self._max_age(target)
+            if max_age is None:
+                return False  # Not watched by any run
+            snapshot = self.snapshots.get(target)
+            if snapshot is None or snapshot[1]:
+                self.misses += 1
+                return False
+            age = time.monotonic() - snapshot[0]
+            if age > max_age:
+                self.stale += 1
+                return False
+            self.hits += 1
+            self.ages.append(age)
+            taken = booking_utils.convert_to_24_hour_format(slot) not in snapshot[2]
+            self.skips += taken
+            return taken
+
+    def _scan_loop(self, watch):
+        watch.scheduler.clock.sleep_until(watch.scheduler.fire_monotonic)
+        while not watch.stopped.is_set():
+            watch.refresh.clear()
+            is_open = True
+            for amenity_id, target_date in watch.targets:
+                url = booking_utils.booking_page_url(amenity_id, target_date)
+                try:
+                    # A redirect means the scanner's session was logged out; its target is no reservation page
+                    response = watch.http_session.get(url, timeout=booking_http.HTTP_TIMEOUT, allow_redirects=False)
+                    response.raise_for_status()
+                    if response.status_code != 200:
+                        raise ValueError(f"HTTP {response.status_code} to {response.headers.get('Location')}")
+                    page = booking_http.parse_reservation_page(response.text)
+                except Exception as e:
+                    log("availability", f"Scan of amenity ID {amenity_id} on {target_date} failed: {e}")
+                    continue
+                self.publish(amenity_id, target_date, page)
+                self.scans += 1
+                is_open = is_open and not page["unavailable"]
+            watch.refresh.wait(watch.interval if is_open else CLOSED_RETRY_SECONDS)
+
+    def report(self):
+        lookups = self.hits + self.misses + self.stale
+        ages = sorted(self.ages)
+        age_text = f"; snapshot age p50={ages[len(ages) // 2] * 1000:.0f}ms max={ages[-1] * 1000:.0f}ms" if ages else ""
+        return (f"Availability snapshot: {lookups} lookups, {self.hits} hits ({self.skips} slots skipped), "
+                f"{self.misses} misses, {self.stale} stale, {self.scans} scans{age_text}")
+
+
+AVAILABILITY = AvailabilityBoard()
@@ -0,0 +1,431 @@
+"""
+Benchmarks for the booking hot path.
+
+    python benchmark.py cold-start --browsers 4
+    python benchmark.py snapshot --repeat 20
+    python benchmark.py release-night --users 4 --capacity 1 --latency 0.05 --set http_fast_path=true
+    python benchmark.py tabs --tabs 3 --times 10:00 11:00 12:00
+    python benchmark.py schedule-sim --days 500 --target-days 1 3 5
+    python benchmark.py profile --browsers 3 --url https://auth.buildinglink.com/Account/Login
+    python benchmark.py contexts --users 20
+    python benchmark.py notify --errors 20 --successes 5 --latency 0.1
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import smtplib
+import statistics
+import threading
+import time
+import urllib.request
+from selenium.webdriver.common.by import By
+import booking_utils
+from booking_auto import calculate_target_date, run_all_bookings
+from booking_utils import calculate_release_time, convert_to_24_hour_format, resolve_driver_path, setup_driver
+from browser_pool import BrowserContextPool, BrowserPool
+from browser_profile import browser_rss_bytes, page_load_ms
+from clock import SimulatedClock
+from email_utils import build_message
+from mock_buildinglink import MockBuildingLink
+from mock_smtp import MockSmtp
+from notifications import Notifier
+from page_snapshot import PageSnapshot
+from release_scheduler import ReleaseScheduler
+
+
+NOTIFY_BLOCK_LIMIT = 0.05  # seconds queuing every notice may take the callers, far below one SMTP round trip
+
+
+def bench_cold_start(args):
+    """Time driver resolution and the launch of N browsers, sequentially and through the pool."""
+    logger = logging.getLogger("benchmark")
+
+    if args.clear_cache and os.path.exists(booking_utils.DRIVER_CACHE_FILE):
+        os.remove(booking_utils.DRIVER_CACHE_FILE)
+    booking_utils._driver_path = None
+    start = time.monotonic()
+    resolve_driver_path()
+    print(f"Driver resolution (disk cache {'cleared' if args.clear_cache else 'as-is'}): {time.monotonic() - start:.3f}s")
+
+    booking_utils._driver_path = None
+    start = time.monotonic()
+    resolve_driver_path()
+    print(f"Driver resolution (cached): {time.monotonic() - start:.3f}s")
+
+    start = time.monotonic()
+    drivers = [setup_driver(logger) for _ in range(args.browsers)]
+    print(f"Sequential launch of {args.browsers} browsers: {time.monotonic() - start:.2f}s")
+    for driver in drivers:
+        driver.quit()
+
+    pool = BrowserPool(args.browsers, logger=logger)
+    elapsed = pool.warm()
+    print(f"Pool warm-up of {args.browsers} browsers (all ready): {elapsed:.2f}s")
+    pool.close()
+
+
+def bench_snapshot(args):
+    """Compare per-option WebDriver reads with the single-call page snapshot on the local fixture."""
+    mock = MockBuildingLink().start()
+    booking_utils.configure_urls({"base_url": mock.url, "auth_url": mock.url})
+    driver = setup_driver(logging.getLogger("benchmark"))
+    try:
+        driver.get(booking_utils.booking_page_url("1", "2030-01-01"))
+        driver.find_element(By.ID, "ctl00_ContentPlaceHolder1_StartTimePicker_dateInput").click()
+
+        start = time.monotonic()
+        for _ in range(args.repeat):
+            options = driver.find_elements(By.XPATH, "//div[@id='ctl00_ContentPlaceHolder1_StartTimePicker_timeView']//a")
+            legacy = {convert_to_24_hour_format(option.text.strip()): option for option in options}
+        legacy_ms = (time.monotonic() - start) * 1000 / args.repeat
+
+        start = time.monotonic()
+        for _ in range(args.repeat):
+            snapshot = PageSnapshot.take(driver)
+        snapshot_ms = (time.monotonic() - start) * 1000 / args.repeat
+
+        print(f"{len(legacy)} start options")
+        print(f"Per-option reads: {legacy_ms:.2f}ms ({len(options) + 1} round trips)")
+        print(f"Page snapshot:    {snapshot_ms:.2f}ms (1 round trip, {len(snapshot.start_options)} start options indexed)")
+    finally:
+        driver.quit()
+        mock.stop()
+
+
+def parse_override(option):
+    key, _, value = option.partition("=")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def stand_in_config(mock, release, users, times):
+    """A booking config for users user1..userN against the stand-in, releasing at the given datetime."""
+    return {
+        "users": [{"username": f"user{i + 1}", "password": "password"} for i in range(users)],
+        "target_date_offset_days": 1,
+        "booking_start_offset_days": 1,
+        "primary_amenity_name": "Court",
+        "alternate_amenity_name": "Pool",
+        "amenities": {"Court": "1", "Pool": "2"},
+        "times": times,
+        "refresh_interval_seconds": 60,
+        "check_interval_seconds": 0.5,
+        "target_days": list(range(7)),
+        "base_url": mock.url,
+        "auth_url": mock.auth_url,
+        "release_at": release.isoformat(),
+        "send_emails": False,
+        "attempt_history": False,
+    }
+
+
+def scrape_metrics(url, stop_event, timings, interval=1.0):
+    """Scrape the metrics endpoint every interval until stopped, recording (seconds, samples) per successful scrape."""
+    while not stop_event.wait(interval):
+        start = time.monotonic()
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                body = response.read().decode("utf-8")
+        except OSError:
+            continue  # Not serving yet, or already stopped
+        samples = sum(1 for line in body.splitlines() if line and not line.startswith("#"))
+        timings.append((time.monotonic() - start, samples))
+
+
+def bench_release_night(args):
+    """Run the full run_all_bookings flow against the stand-in and report time-to-submit and win rate per user."""
+    release = datetime.datetime.now().replace(microsecond=0) + datetime.timedelta(seconds=args.release_in)
+    mock = MockBuildingLink(clock_skew=args.clock_skew, release_at=release.timestamp(), capacity=args.capacity,
+                            latency=args.latency, jitter=args.jitter, require_login=True, error_rate=args.error_rate,
+                            lost_rate=args.lost_rate).start()
+    config = stand_in_config(mock, release, args.users, args.times)
+    config.update(parse_override(option) for option in args.set)
+    scrape_stop, scrapes = threading.Event(), []
+    if config.get("metrics_port") is not None:
+        url = f"http://127.0.0.1:{config['metrics_port']}/metrics"
+        threading.Thread(target=scrape_metrics, args=(url, scrape_stop, scrapes), daemon=True).start()
+    print(f"Stand-in at {mock.url}, dates open at {release:%H:%M:%S} (stand-in clock {args.clock_skew:+.3f}s), "
+          f"capacity {args.capacity} per slot, latency {args.latency * 1000:.0f}ms +{args.jitter * 1000:.0f}ms.")
+    try:
+        results = run_all_bookings(config, mode=args.mode) or []
+    finally:
+        scrape_stop.set()
+        mock.stop()
+
+    arrivals = {}
+    for username, _, _, _, since_release in mock.submits:
+        arrivals.setdefault(username, []).append(since_release * 1000)
+    print(f"\n{'user':<10} {'attempts':>8} {'wins':>5} {'win rate':>9} {'t0->submit p50':>15} {'first arrival':>14}")
+    for user in config["users"]:
+        username = user["username"]
+        attempts = [result for result in results if result["username"] == username]
+        wins = sum(1 for result in attempts if result["status"] == "Success")
+        latencies = [result["t0_to_submit_ms"] for result in attempts if "t0_to_submit_ms" in result]
+        rate = f"{wins / len(attempts):.0%}" if attempts else "-"
+        median = f"{statistics.median(latencies):.1f}ms" if latencies else "-"
+        first = f"{min(arrivals[username]):+.1f}ms" if username in arrivals else "-"
+        print(f"{username:<10} {len(attempts):>8} {wins:>5} {rate:>9} {median:>15} {first:>14}")
+    won = sum(len(sessions) for sessions in mock.bookings.values())
+    print(f"Slots booked on the stand-in: {won} of {len(args.times) * args.capacity}")
+    retried = [result for result in results if result.get("retries")]
+    if retried:
+        print(f"Attempts retried: {len(retried)}, {sum(result['retries'] for result in retried)} retries in total")
+    if scrapes:
+        seconds = sorted(duration for duration, _ in scrapes)
+        print(f"Metrics endpoint: {len(scrapes)} scrapes, p50 {statistics.median(seconds) * 1000:.1f}ms, "
+              f"max {seconds[-1] * 1000:.1f}ms, {scrapes[-1][1]} samples in the last one")
+
+
+def bench_tabs(args):
+    """Time from release to the last submit of one user's slots: the sequential loop vs one tab per slot."""
+    for tabs in (1, args.tabs):
+        release = datetime.datetime.now().replace(microsecond=0) + datetime.timedelta(seconds=args.release_in)
+        mock = MockBuildingLink(release_at=release.timestamp(), latency=args.latency, jitter=args.jitter, require_login=True).start()
+        config = stand_in_config(mock, release, 1, args.times)
+        config["parallel_tabs"] = tabs
+        try:
+            results = run_all_bookings(config) or []
+        finally:
+            mock.stop()
+        arrivals = sorted(since_release * 1000 for _, _, _, _, since_release in mock.submits)
+        wins = sum(1 for result in results if result["status"] == "Success")
+        label = "Sequential loop" if tabs == 1 else f"{tabs} parallel tabs"
+        if arrivals:
+            print(f"{label}: {len(arrivals)} submits, first {arrivals[0]:+.1f}ms, last {arrivals[-1]:+.1f}ms after release, "
+                  f"{wins} of {len(args.times)} slots won")
+        else:
+            print(f"{label}: no submits reached the stand-in")
+
+
+def bench_schedule_sim(args):
+    """
+    Simulate one run per day on a virtual clock and check target-day filtering, the prio-days release
+    date, the 5-minute prep window and the fire instant. Exits with status 1 if any day has a problem.
+    """
+    first_start = datetime.datetime.combine(datetime.date.today(), datetime.time(args.start_hour))
+    fire_offset = datetime.timedelta(milliseconds=args.fire_offset_ms)
+    runs = failures = 0
+    started = time.monotonic()
+    for day in range(args.days):
+        clock = SimulatedClock(first_start + datetime.timedelta(days=day))
+        run_date = clock.today()
+        target_date = calculate_target_date(args.offset_days, args.target_days, clock)
+        standby_date = run_date + datetime.timedelta(days=args.offset_days)
+        problems = []
+        if (target_date is not None) != (standby_date.weekday() in args.target_days):
+            problems.append(f"target date {target_date} for standby date {standby_date}")
+        if target_date is not None:
+            runs += 1
+            release = calculate_release_time(target_date.strftime("%Y-%m-%d"), args.prio_days)
+            if release.date() != target_date - datetime.timedelta(days=args.prio_days) or release.time() != datetime.time(0):
+                problems.append(f"release {release} for target {target_date}")
+            if release + fire_offset <= clock.now():
+                # The fire instant passed before the run started: it would fire at once, hours late
+                problems.append(f"release {release} for target {target_date} is before the run starts")
+                failures += 1
+                print(f"{run_date}: " + "; ".join(problems))
+                continue
+            scheduler = ReleaseScheduler(release, args.fire_offset_ms, clock=clock)
+            scheduler.wait_until(300, args.check_interval)
+            prep_at = clock.now()
+            scheduler.wait_for_fire("simulated")
+            fired_at = clock.now()
+            if abs((fired_at - (release + fire_offset)).total_seconds()) > 0.001:
+                problems.append(f"fired at {fired_at}, expected {release + fire_offset}")
+            if release + fire_offset > first_start + datetime.timedelta(days=day, seconds=300) and \
+                    abs((release + fire_offset - prep_at).total_seconds() - 300) > 0.001:
+                problems.append(f"prep window opened at {prep_at}")
+        if problems:
+            failures += 1
+            print(f"{run_date}: " + "; ".join(problems))
+    print(f"Simulated {args.days} days ({runs} release nights) in {time.monotonic() - started:.2f}s: {failures} with problems.")
+    if failures:
+        raise SystemExit(1)
+
+
+def bench_profile(args):
+    """Per-session RSS and page load time with the default and the slim browser profile."""
+    logger = logging.getLogger("benchmark")
+    mock = MockBuildingLink(latency=args.latency).start()
+    booking_utils.configure_urls({"base_url": mock.url, "auth_url": mock.auth_url})
+    url = args.url or booking_utils.booking_page_url("1", "2030-01-01")
+    if args.url:
+        booking_utils.configure_urls({"base_url": args.url, "auth_url": args.url})  # Let the slim profile reach it
+    print(f"Loading {url} in {args.browsers} browsers per profile.")
+    try:
+        for slim in (False, True):
+            label = "slim" if slim else "default"
+            drivers = [setup_driver(logger, slim) for _ in range(args.browsers)]
+            try:
+                total_rss = 0
+                for index, driver in enumerate(drivers):
+                    start = time.monotonic()
+                    driver.get(url)
+                    get_ms = (time.monotonic() - start) * 1000
+                    dom_ready_ms, loaded_ms = page_load_ms(driver) or (0, 0)
+                    rss = browser_rss_bytes(driver) or 0
+                    total_rss += rss
+                    print(f"{label:>7} session {index + 1}: get() {get_ms:.0f}ms, DOM ready {dom_ready_ms:.0f}ms, "
+                          f"loaded {loaded_ms:.0f}ms, RSS {rss / 2**20:.0f} MB")
+                print(f"{label:>7} total RSS for {args.browsers} sessions: {total_rss / 2**20:.0f} MB")
+            finally:
+                for driver in drivers:
+                    driver.quit()
+    finally:
+        mock.stop()
+
+
+def bench_contexts(args):
+    """Memory and time until N users are logged in: one Chrome per user vs one browser context per user."""
+    logger = logging.getLogger("benchmark")
+    mock = MockBuildingLink(latency=args.latency, require_login=True).start()
+    booking_utils.configure_urls({"base_url": mock.url, "auth_url": mock.auth_url})
+    users = [{"username": f"user{i + 1}", "password": "password"} for i in range(args.users)]
+    resolve_driver_path()
+    try:
+        for label, pool_class in (("One Chrome per user", BrowserPool), ("One context per user", BrowserContextPool)):
+            start = time.monotonic()
+            pool = pool_class(args.users, logger=logger, config={"slim_browser": args.slim})
+            try:
+                pool.warm()
+                pool.prepare_users(users, "2030-01-01")
+                ready = time.monotonic() - start
+                print(f"{label}: {len(pool.prepared)} of {args.users} users logged in after {ready:.2f}s, "
+                      f"RSS {pool.rss_bytes() / 2**20:.0f} MB")
+            finally:
+                pool.close()
+    finally:
+        mock.stop()
+
+
+def bench_notify(args):
+    """
+    Time booking threads spend on emails, and SMTP connections used: one connection per email vs the
+    notifier. Exits with status 1 if the notifier blocks its callers or delivers other than one error
+    digest plus one email per success over a single connection.
+    """
+    smtp = MockSmtp(latency=args.latency).start()
+    config = {
+        "smtp_server": "127.0.0.1",
+        "smtp_port": smtp.port,
+        "smtp_starttls": False,
+        "sender_email": "bench@example.com",
+        "sender_username": "bench",
+        "sender_password": "bench",
+        "recipient_emails": ["bookings@example.com"],
+        "error_digest_seconds": args.digest_seconds,
+    }
+    result = {"username": "user1", "time": "18:00", "amenity_name": "Court"}
+    try:
+        start = time.monotonic()
+        for i in range(args.errors + args.successes):
+            # The old way: a connection of its own for every email, in the caller's thread
+            server = smtplib.SMTP(config["smtp_server"], smtp.port)
+            server.login(config["sender_username"], config["sender_password"])
+            msg = build_message(config["sender_email"], config["recipient_emails"], f"Notice {i + 1}", "<p>notice</p>")
+            server.sendmail(config["sender_email"], config["recipient_emails"], msg.as_string())
+            server.quit()
+        blocked = time.monotonic() - start
+        print(f"One connection per email: callers blocked {blocked:.2f}s, {smtp.connections} connections, {len(smtp.messages)} emails")
+
+        connections, messages = smtp.connections, len(smtp.messages)
+        notifier = Notifier(config).start()
+        start = time.monotonic()
+        for i in range(args.errors):
+            notifier.error(f"user{i % 4 + 1}", f"Simulated error {i + 1}")
+        for _ in range(args.successes):
+            notifier.success(result, "2030-01-01")
+        blocked = time.monotonic() - start
+        notifier.stop()
+        total = time.monotonic() - start
+        connections, messages = smtp.connections - connections, len(smtp.messages) - messages
+        print(f"Background notifier: callers blocked {blocked * 1000:.1f}ms, all delivered after {total:.2f}s, "
+              f"{connections} connections, {messages} emails")
+    finally:
+        smtp.stop()
+
+    expected = args.successes + (1 if args.errors else 0)
+    problems = []
+    if messages != expected or notifier.sent != expected or notifier.failed:
+        problems.append(f"{messages} emails received and {notifier.sent} sent ({notifier.failed} failed), expected {expected}")
+    if connections != (1 if expected else 0):
+        problems.append(f"{connections} SMTP connections, expected {1 if expected else 0}")
+    if blocked > NOTIFY_BLOCK_LIMIT:
+        problems.append(f"callers blocked {blocked * 1000:.1f}ms, more than {NOTIFY_BLOCK_LIMIT * 1000:.0f}ms")
+    for problem in problems:
+        print(f"Notifier problem: {problem}")
+    if problems:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Booking hot path benchmarks.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    cold_start = subparsers.add_parser("cold-start", help="Time until all browsers are ready.")
+    cold_start.add_argument("--browsers", type=int, default=4)
+    cold_start.add_argument("--clear-cache", action="store_true", help="Delete the driver path cache first.")
+    cold_start.set_defaults(func=bench_cold_start)
+
+    snapshot = subparsers.add_parser("snapshot", help="Picker option reads: per-element vs one snapshot.")
+    snapshot.add_argument("--repeat", type=int, default=20)
+    snapshot.set_defaults(func=bench_snapshot)
+
+    release_night = subparsers.add_parser("release-night", help="Full booking run against the local stand-in.")
+    release_night.add_argument("--users", type=int, default=3)
+    release_night.add_argument("--times", nargs="+", default=["10:00", "11:00", "12:00"])
+    release_night.add_argument("--release-in", type=float, default=45, help="Seconds until the stand-in opens the date.")
+    release_night.add_argument("--capacity", type=int, default=1, help="Submits that succeed per slot.")
+    release_night.add_argument("--latency", type=float, default=0.05, help="Seconds added to every response.")
+    release_night.add_argument("--jitter", type=float, default=0.02, help="Up to this many extra seconds per response.")
+    release_night.add_argument("--clock-skew", type=float, default=0.0, help="Seconds the stand-in's clock runs ahead.")
+    release_night.add_argument("--error-rate", type=float, default=0.0, help="Share of submits failing with HTTP 500.")
+    release_night.add_argument("--lost-rate", type=float, default=0.0, help="Share of submits booked but answered with HTTP 500.")
+    release_night.add_argument("--mode", choices=["threaded", "async", "sharded"], default="threaded")
+    release_night.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                               help="Override a config key, e.g. --set staged_submit=true (JSON values).")
+    release_night.set_defaults(func=bench_release_night)
+
+    tabs = subparsers.add_parser("tabs", help="Time to last submit for one user: sequential slots vs parallel tabs.")
+    tabs.add_argument("--tabs", type=int, default=3, help="parallel_tabs for the second run.")
+    tabs.add_argument("--times", nargs="+", default=["10:00", "11:00", "12:00"])
+    tabs.add_argument("--release-in", type=float, default=45, help="Seconds until the stand-in opens the date.")
+    tabs.add_argument("--latency", type=float, default=0.05, help="Seconds added to every response.")
+    tabs.add_argument("--jitter", type=float, default=0.02, help="Up to this many extra seconds per response.")
+    tabs.set_defaults(func=bench_tabs)
+
+    schedule_sim = subparsers.add_parser("schedule-sim", help="Scheduling logic across many simulated dates.")
+    schedule_sim.add_argument("--days", type=int, default=365)
+    schedule_sim.add_argument("--offset-days", type=int, default=4, help="target_date_offset_days")
+    schedule_sim.add_argument("--prio-days", type=int, default=3, help="booking_start_offset_days")
+    schedule_sim.add_argument("--target-days", type=int, nargs="+", default=list(range(7)))
+    schedule_sim.add_argument("--start-hour", type=int, default=21, help="Hour of day each simulated run starts.")
+    schedule_sim.add_argument("--fire-offset-ms", type=int, default=-30)
+    schedule_sim.add_argument("--check-interval", type=float, default=60)
+    schedule_sim.set_defaults(func=bench_schedule_sim)
+
+    profile = subparsers.add_parser("profile", help="RSS and page load per session, default vs slim profile.")
+    profile.add_argument("--browsers", type=int, default=2)
+    profile.add_argument("--url", help="Page to load instead of the local stand-in's reservation page.")
+    profile.add_argument("--latency", type=float, default=0.0, help="Stand-in response latency in seconds.")
+    profile.set_defaults(func=bench_profile)
+
+    contexts = subparsers.add_parser("contexts", help="N users: one Chrome each vs browser contexts in one Chrome.")
+    contexts.add_argument("--users", type=int, default=10)
+    contexts.add_argument("--slim", action="store_true", help="Use the slim browser profile for both.")
+    contexts.add_argument("--latency", type=float, default=0.0, help="Stand-in response latency in seconds.")
+    contexts.set_defaults(func=bench_contexts)
+
+    notify = subparsers.add_parser("notify", help="Error and success emails: one connection each vs the background notifier.")
+    notify.add_argument("--errors", type=int, default=20)
+    notify.add_argument("--successes", type=int, default=5)
+    notify.add_argument("--latency", type=float, default=0.05, help="Seconds added to every SMTP command.")
+    notify.add_argument("--digest-seconds", type=float, default=1, help="error_digest_seconds for the notifier.")
+    notify.set_defaults(func=bench_notify)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -1,10 +1,25 @@
+import argparse
 import os
 import threading
-import time
 import datetime
 import json
-from booking_utils import run_booking_process
-from email_utils import generate_html_email, generate_ics_file, send_email
+import booking_utils
+from booking_utils import configure_urls, run_booking_process
+from booking_plan import compile_plan, dry_run, plan_jobs
+from browser_pool import BrowserContextPool, BrowserPool
+from release_scheduler import ReleaseScheduler
+from attempt_history import HISTORY_DB, RECORDER, AttemptHistory, run_key_for
+from availability import AVAILABILITY, MAX_AGE_SECONDS, SCAN_INTERVAL
+from clock import SYSTEM_CLOCK
+from slot_claims import create_claim_board
+from metrics import METRICS, METRICS_HOST
+from page_waits import WAIT_STATS
+from phase_trace import TRACE
+from booking_log import flush_logging, start_logging, stop_logging
+from async_orchestrator import run_async_bookings
+import sharding
+from email_utils import generate_html_email, generate_ics_file
+from notifications import flush_notifications, send_notification, stop_notifications
 
 CONFIG_FILE = 'booking_config.json'
 
@@ -16,103 +31,230 @@ def load_config():
     else:
         raise FileNotFoundError(f"{CONFIG_FILE} not found.")
 
-def calculate_target_date(offset_days, target_days):
+def calculate_target_date(offset_days, target_days, clock=SYSTEM_CLOCK):
     """
     Calculate the target date for booking based on the configuration.
     The target date is determined based on whether the standby date matches any of the configured target days.
     """
-    standby_date = datetime.date.today() + datetime.timedelta(days=offset_days)
+    standby_date = clock.today() + datetime.timedelta(days=offset_days)
     if standby_date.weekday() in target_days:
         return standby_date
     else:
         print(f"The standby date {standby_date} does not match any of the configured target days {target_days}. Exiting.")
         return None
 
-def run_all_bookings(config):
-    """Run booking processes for all users and summarize results."""
+def create_scheduler(config, plan, clock=SYSTEM_CLOCK):
+    """Create the shared release scheduler for the plan, synchronized to the server clock unless disabled."""
+    release_time = plan.release_time
+    scheduler = ReleaseScheduler(release_time, plan.fire_offset_ms, clock=clock)
+    if config.get("clock_sync", True) and clock is SYSTEM_CLOCK:
+        try:
+            scheduler.sync(f"{booking_utils.BASE_URL}/", config.get("clock_sync_samples", 16))
+        except Exception as e:
+            print(f"Server clock sync failed, using the local clock: {e}")
+    print(f"Workers will fire at {release_time} {scheduler.fire_offset_ms:+d}ms (server time).")
+    return scheduler
+
+def start_browser_pool(config, target_date_str, scheduler, browser_pool=None, check_url=None):
+    """
+    Wait until the warm-up lead time, then launch and log in one pooled browser per user, or one
+    browser context per user inside a single shared Chrome when browser_contexts is set.
+    An already running pool (the campaign daemon's) is reused: only the users are logged in.
+    """
     user_list = config["users"]
-    target_date_offset_days = config["target_date_offset_days"]
+    prio_days = config["booking_start_offset_days"]
+    warmup_seconds = config.get("browser_warmup_seconds", 900)
+    print(f"Browser pool will warm up {warmup_seconds} seconds before release.")
+    scheduler.wait_until(warmup_seconds, config["check_interval_seconds"])
+
+    check_url = check_url or booking_utils.booking_page_url(config["amenities"][config["primary_amenity_name"]], target_date_str)
+    login_date = (scheduler.clock.today() + datetime.timedelta(days=prio_days)).strftime("%Y-%m-%d")
+    if browser_pool is not None:
+        browser_pool.prepare_users(user_list, login_date, check_url)
+        return browser_pool
+    pool_class = BrowserContextPool if config.get("browser_contexts", False) else BrowserPool
+    browser_pool = pool_class(len(user_list) + config.get("browser_pool_spares", 1), config=config, check_url=check_url)
+    elapsed = browser_pool.warm()
+    print(f"Browser pool ready: {browser_pool.size} browsers in {elapsed:.2f}s.")
+    browser_pool.prepare_users(user_list, login_date)
+    browser_pool.start_monitor()
+    return browser_pool
+
+def start_availability_scan(config, target_date_str, scheduler):
+    """Watch the amenities this run books in this process's availability snapshot; returns the watch, if any."""
+    if not config.get("availability_scan", False):
+        return None
+    amenity_names = [config["primary_amenity_name"]]
+    if config.get("alternate_fallback", False) or config.get("hedged_alternate", False):
+        amenity_names.append(config["alternate_amenity_name"])
+    targets = [(config["amenities"][name], target_date_str) for name in dict.fromkeys(amenity_names)]
+    return AVAILABILITY.start(targets, scheduler, config.get("availability_max_age_seconds", MAX_AGE_SECONDS),
+                       config.get("availability_scan_interval", SCAN_INTERVAL))
+
+def report_submit_latency(results):
+    """Print the T0-to-submit latency of every attempt, grouped by user."""
+    print("\nT0-to-submit latency per user:")
+    for result in results:
+        if "t0_to_submit_ms" in result:
+            print(f"  [{result['username']}] {result['time']}: {result['t0_to_submit_ms']:.1f}ms ({result['status']})")
+
+def run_threaded_bookings(config, jobs, target_date_str, scheduler, claim_board=None, browser_pool=None):
+    """Run the (user, time_slots) jobs on one thread per user. Returns all results."""
     primary_amenity_name = config["primary_amenity_name"]
+    threads = []
+    first_round_results = []
+    lock = threading.Lock()  # To synchronize access to first_round_results
+
+    # Define the thread's target function with rotated time_slots
+    def thread_target(user, rotated_times, first_round_results, lock):
+        username = user['username']
+        password = user['password']
+        results = run_booking_process(
+            username=username,
+            password=password,
+            target_date=target_date_str,
+            time_slots=rotated_times,
+            prio_days=config["booking_start_offset_days"],
+            amenity_id=config["amenities"][primary_amenity_name],
+            amenity_name=primary_amenity_name,
+            refresh_interval=config["refresh_interval_seconds"],
+            check_interval=config["check_interval_seconds"],
+            config=config,
+            browser_pool=browser_pool,
+            scheduler=scheduler,
+            claim_board=claim_board
+        )
+        with lock:
+            first_round_results.extend(results)
+
+    for user, rotated_times in jobs:
+        # Create and start the thread
+        t = threading.Thread(target=thread_target, args=(user, rotated_times, first_round_results, lock))
+        threads.append(t)
+        t.start()
+        scheduler.clock.sleep(0.15)  # Optional: small delay to stagger thread starts
+
+    # Wait for all threads to complete
+    for t in threads:
+        t.join()
+    return first_round_results
+
+def run_jobs(config, jobs, target_date_str, scheduler, claim_board=None, browser_pool=None, mode="threaded"):
+    """Run the jobs in this process, threaded or with the asyncio orchestrator."""
+    if mode == "async":
+        return run_async_bookings(config, jobs, target_date_str, config["booking_start_offset_days"], scheduler, claim_board, browser_pool)
+    return run_threaded_bookings(config, jobs, target_date_str, scheduler, claim_board, browser_pool)
+
+def run_all_bookings(config, mode="threaded", clock=SYSTEM_CLOCK, target_date=None, browser_pool=None):
+    """
+    Run booking processes for all users, summarize results and email the summary.
+    Mode is "threaded", "async" or "sharded". Returns every attempt's result.
+    A given target_date skips the weekday check; a given browser_pool is reused and left open.
+    """
+    target_date_offset_days = config["target_date_offset_days"]
     alternate_amenity_name = config["alternate_amenity_name"]
     times = config["times"]  # List of time_slots
-    refresh_interval = config["refresh_interval_seconds"]
-    check_interval = config["check_interval_seconds"]
     target_days = config["target_days"]
-    prio_days = config["booking_start_offset_days"]
-
-    # Map amenity names to IDs
-    amenity_ids = config["amenities"]
 
-    primary_amenity_id = amenity_ids[primary_amenity_name]
-    alternate_amenity_id = amenity_ids[alternate_amenity_name]
+    configure_urls(config)
 
     # Calculate target date
-    target_date = calculate_target_date(target_date_offset_days, target_days)
+    target_date = target_date or calculate_target_date(target_date_offset_days, target_days, clock)
     if not target_date:
         return  # Exit if no valid target date
 
-    target_date_str = target_date.strftime("%Y-%m-%d")
+    # Validate the config and work out URLs, times and slot orders once, before any waiting
+    history = AttemptHistory(config.get("attempt_history_db", HISTORY_DB)) if config.get("attempt_history", False) else None
+    plan = compile_plan(config, target_date, clock, history)
+    target_date_str = plan.target_date
     print(f"Target date for booking is {target_date_str}")
 
+    # One shared fire instant for every worker
+    scheduler = create_scheduler(config, plan, clock)
+    scheduler.trace_release()
+
+    # Optional live metrics for the whole run, from the browser warm-up to the summary
+    metrics_served = config.get("metrics_port") is not None and METRICS.serve(config["metrics_port"], config.get("metrics_host", METRICS_HOST))
+
+    availability_watch = start_availability_scan(config, target_date_str, scheduler) if mode != "sharded" else None
+
+    # Optionally launch and log in all browsers well before the 5-minute window (sharded workers start their own)
+    owns_pool = browser_pool is None
+    if mode == "sharded" or not (config.get("browser_pool", False) or config.get("browser_contexts", False)):
+        browser_pool = None
+    else:
+        browser_pool = start_browser_pool(config, target_date_str, scheduler, browser_pool, plan.booking_urls[plan.primary_amenity])
+
     # Data structure to hold booking results per time slot
     summary_results = {time_slot: {} for time_slot in times}
 
     # First Round Booking: Attempt to book primary amenity
     print("\nStarting first round booking for primary amenity.")
-    threads = []
-    first_round_results = []
-    lock = threading.Lock()  # To synchronize access to first_round_results
+    if config.get("alternate_fallback", False):
+        claim_mode = "hedged" if config.get("hedged_alternate", False) else "fallback"
+        print(f"Alternate amenity {alternate_amenity_name} attempts run concurrently ({claim_mode} mode).")
+    # Optionally assign slots dynamically through a shared claim board instead of fixed rotation
+    # (sharded runs keep theirs in the coordinator)
+    run_key = run_key_for(config, target_date_str)
+    claim_board = create_claim_board(config, run_key, times, plan.release_time) if mode != "sharded" else None
 
-    # Determine rotation offset for time_slots to ensure different starting slots per thread
-    total_time_slots = len(times)
+    jobs = plan_jobs(plan, config)
+    if history is not None and config.get("adaptive_order", False):
+        print("Slot order from past attempts:")
+        for user, ordered_times in jobs:
+            print(f"  [{user['username']}] {', '.join(ordered_times)}")
 
-    for i, user in enumerate(user_list):
-        username = user['username']
-        password = user['password']
+    # Attempts are recorded as they finish; sharded workers' results only once their shards report
+    if history is not None and mode != "sharded":
+        RECORDER.start(history, target_date_str, run_key, mode, clock.now())
 
-        # Rotate time_slots list for each thread to ensure different starting slots
-        rotation_offset = i % total_time_slots if total_time_slots > 0 else 0
-        rotated_times = times[rotation_offset:] + times[:rotation_offset]
-
-        # Define the thread's target function with rotated time_slots
-        def thread_target(user, rotated_times, first_round_results, lock):
-            username = user['username']
-            password = user['password']
-            results = run_booking_process(
-                username=username,
-                password=password,
-                target_date=target_date_str,
-                time_slots=rotated_times,
-                prio_days=prio_days,
-                amenity_id=primary_amenity_id,
-                amenity_name=primary_amenity_name,
-                refresh_interval=refresh_interval,
-                check_interval=check_interval,
-                config=config
-            )
-            with lock:
-                first_round_results.extend(results)
+    if mode == "sharded":
+        first_round_results = sharding.run_sharded_bookings(config, jobs, target_date_str, scheduler, run_key)
+    else:
+        first_round_results = run_jobs(config, jobs, target_date_str, scheduler, claim_board, browser_pool, mode)
+    if claim_board is not None:
+        claim_board.close()
 
-        # Create and start the thread
-        t = threading.Thread(target=thread_target, args=(user, rotated_times, first_round_results, lock))
-        threads.append(t)
-        t.start()
-        time.sleep(0.15)  # Optional: small delay to stagger thread starts
+    if browser_pool is not None and owns_pool:
+        browser_pool.close()
+    AVAILABILITY.stop(availability_watch)
 
-    # Wait for all threads to complete
-    for t in threads:
-        t.join()
+    if history is not None:
+        if mode == "sharded":
+            history.record_run(target_date_str, first_round_results, run_key, mode, clock.now())
+        else:
+            RECORDER.finish(run_key)
+        print(f"Recorded {len(first_round_results)} attempts in {history.path}.")
+
+    flush_logging()  # Let the log writer catch up before printing the reports
+    report_submit_latency(first_round_results)
+    print(WAIT_STATS.report())
+    print(TRACE.report())
+    if availability_watch is not None:
+        print(AVAILABILITY.report())
+    trace_path = TRACE.export_chrome_trace(os.path.join(config.get("log_dir", "logs"), f"trace_{datetime.datetime.now():%Y%m%d_%H%M%S}.json"))
+    if trace_path:
+        print(f"Phase timeline written to {trace_path}")
+    if metrics_served:
+        METRICS.stop()
 
     # Process first round results
     for result in first_round_results:
         time_slot = result['time']
-        if result['status'] == 'Success' and time_slot in summary_results:
+        if result['status'] == 'Success' and time_slot in summary_results and not summary_results[time_slot]:
             summary_results[time_slot] = {
                 'status': 'Success',
                 'username': result['username'],
-                'amenity_name': primary_amenity_name
+                'amenity_name': result['amenity_name']
             }
 
+    # Hedged attempts that both submitted before either saw the other's win can book a slot twice
+    for result in first_round_results:
+        winner = summary_results.get(result['time'])
+        if result['status'] == 'Success' and winner and (result['username'], result['amenity_name']) != (winner['username'], winner['amenity_name']):
+            winner['status'] = f"Success (also booked by {result['username']} at {result['amenity_name']}; cancel one)"
+            print(f"Duplicate booking for {result['time']}: {winner['username']} at {winner['amenity_name']} and {result['username']} at {result['amenity_name']}.")
+
     # Update summary results for failed time slots
     for time_slot, res in summary_results.items():
         if res == {}:
@@ -122,26 +264,43 @@ def run_all_bookings(config):
                 'amenity_name': 'N/A'
             }
 
+    if not config.get("send_emails", True):
+        return first_round_results
+
     # Generate HTML content for the email
     html_content = generate_html_email(summary_results)
 
     # Generate .ics file with booking results
     ics_file_path = generate_ics_file(summary_results, target_date_str)
 
-    # Send email with booking results and attach the .ics file
-    send_email(
-        config["smtp_server"],
-        config["smtp_port"],
-        config["sender_email"],
-        config["sender_username"],
-        config["sender_password"],
-        config["recipient_emails"],
-        f"Booking Summary for {target_date_str}",
-        html_content,
-        attachment_path=ics_file_path
-    )
+    # Send email with booking results and attach the .ics file, after any live notices still queued
+    send_notification(config, f"Booking Summary for {target_date_str}", html_content, attachment_path=ics_file_path)
+    flush_notifications()
+    return first_round_results
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Book amenities for all configured users.")
+    parser.add_argument("--mode", choices=["threaded", "async", "sharded"], default="threaded",
+                        help="Run one thread per user, asyncio tasks with bounded concurrency, or shards of users in worker processes.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Print the booking plan and check it against a reservation page without opening a browser.")
+    parser.add_argument("--date", type=datetime.date.fromisoformat,
+                        help="Target date (YYYY-MM-DD) for --dry-run; defaults to the date a run today would book.")
+    parser.add_argument("--page", help="Saved NewReservation.aspx page for --dry-run to check; defaults to today's live page fetched with a "
+                             "user's saved session, or the stand-in's page without one.")
+    args = parser.parse_args()
+
     # Load configuration
     config = load_config()
-    run_all_bookings(config)
+    if args.dry_run:
+        configure_urls(config)
+        target_date = args.date or calculate_target_date(config["target_date_offset_days"], config["target_days"])
+        use_history = config.get("attempt_history", False) and config.get("adaptive_order", False)
+        history = AttemptHistory(config.get("attempt_history_db", HISTORY_DB)) if use_history else None
+        raise SystemExit(0 if target_date and dry_run(config, target_date, args.page, history=history) else 1)
+    print(f"Logging to {start_logging(config)}")
+    try:
+        run_all_bookings(config, mode=args.mode)
+    finally:
+        stop_notifications()
+        stop_logging()
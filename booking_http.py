@@ -0,0 +1,253 @@
+import datetime
+import json
+import re
+from html.parser import HTMLParser
+from urllib.parse import parse_qs, urlparse
+import requests
+from requests.adapters import HTTPAdapter
+import booking_utils
+from booking_log import log
+from phase_trace import traced
+
+# ASP.NET control names posted by the NewReservation.aspx form
+SAVE_BUTTON_TARGET = "ctl00$ContentPlaceHolder1$HeaderSaveButton"
+START_PICKER_FIELD = "ctl00$ContentPlaceHolder1$StartTimePicker"
+END_PICKER_FIELD = "ctl00$ContentPlaceHolder1$EndTimePicker"
+
+# Element ids whose text we need from the reservation page
+VALIDATION_CONTAINER_ID = "ValidationContainer"
+VALIDATION_SUMMARY_ID = "ctl00_ContentPlaceHolder1_ValidationSummary1"
+ALLOCATION_ERROR_ID = "ctl00_ContentPlaceHolder1_ctl00_ContentPlaceHolder1_pnlAllocationErrorPanel"
+PAGE_HEADER_ID = "ThePageHeaderWrap"
+START_TIME_VIEW_ID = "ctl00_ContentPlaceHolder1_StartTimePicker_timeView"
+END_TIME_VIEW_ID = "ctl00_ContentPlaceHolder1_EndTimePicker_timeView"
+UNAVAILABLE_TEXT = "This Amenity is currently unavailable on the selected date."
+
+HTTP_TIMEOUT = 10  # seconds
+LIST_TIME_PATTERN = re.compile(r"(?<![\d/])(\d{1,2}:\d{2}(?: ?[AP]M)?)", re.IGNORECASE)  # A row's first time is its start
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+WATCHED_IDS = {VALIDATION_CONTAINER_ID, VALIDATION_SUMMARY_ID, ALLOCATION_ERROR_ID, PAGE_HEADER_ID, START_TIME_VIEW_ID, END_TIME_VIEW_ID}
+
+
+class ReservationPageParser(HTMLParser):
+    """Collect the form fields, picker options and result panels of a reservation page."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.fields = {}
+        self.texts = {}
+        self.options = {START_TIME_VIEW_ID: [], END_TIME_VIEW_ID: []}
+        self.unavailable = False
+        self._stack = []  # (tag, id this tag opened or None)
+        self._open_ids = []
+        self._option_text = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "input" and attrs.get("name") and attrs.get("type", "text") not in ("submit", "button", "image"):
+            self.fields[attrs["name"]] = attrs.get("value") or ""
+        if tag == "a" and any(i in self.options for i in self._open_ids):
+            self._option_text = []
+        if tag in VOID_TAGS:
+            return
+        element_id = attrs.get("id") if attrs.get("id") in WATCHED_IDS else None
+        if element_id:
+            self.texts.setdefault(element_id, "")
+            self._open_ids.append(element_id)
+        self._stack.append((tag, element_id))
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self._option_text is not None:
+            text = "".join(self._option_text).strip()
+            for view_id in self.options:
+                if view_id in self._open_ids and text:
+                    self.options[view_id].append(text)
+            self._option_text = None
+        # Pop up to the matching tag to tolerate unclosed elements
+        for index in range(len(self._stack) - 1, -1, -1):
+            if self._stack[index][0] == tag:
+                for _, element_id in self._stack[index:]:
+                    if element_id:
+                        self._open_ids.remove(element_id)
+                del self._stack[index:]
+                break
+
+    def handle_data(self, data):
+        for element_id in self._open_ids:
+            self.texts[element_id] += data
+        if self._option_text is not None:
+            self._option_text.append(data)
+        if UNAVAILABLE_TEXT in data:
+            self.unavailable = True
+
+
+def parse_reservation_page(html):
+    """Parse a reservation page into a dict of form state and result markers."""
+    parser = ReservationPageParser()
+    parser.feed(html)
+    parser.close()
+    texts = {key: " ".join(value.split()) for key, value in parser.texts.items()}
+    errors = [texts[i] for i in (VALIDATION_SUMMARY_ID, ALLOCATION_ERROR_ID) if texts.get(i)]
+    if texts.get(VALIDATION_CONTAINER_ID) and not errors:
+        errors.append("Unknown error in ValidationContainer.")
+    return {
+        "fields": parser.fields,
+        "errors": errors,
+        "has_header": PAGE_HEADER_ID in texts,
+        "unavailable": parser.unavailable,
+        "has_start_picker": START_TIME_VIEW_ID in texts,
+        "start_options": parser.options[START_TIME_VIEW_ID],
+        "end_options": parser.options[END_TIME_VIEW_ID],
+    }
+
+
+class ReservationListParser(HTMLParser):
+    """Collect the text of each table row of the reservation list, with the amenity id its links carry."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self._row = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self._row = {"text": [], "amenity_id": None}
+        elif tag == "a" and self._row is not None:
+            amenity_ids = parse_qs(urlparse(dict(attrs).get("href") or "").query, keep_blank_values=True).get("amenityId")
+            if amenity_ids:
+                self._row["amenity_id"] = amenity_ids[0]
+
+    def handle_endtag(self, tag):
+        if tag == "tr" and self._row is not None:
+            self.rows.append({"text": " ".join(" ".join(self._row["text"]).split()), "amenity_id": self._row["amenity_id"]})
+            self._row = None
+
+    def handle_data(self, data):
+        if self._row is not None:
+            self._row["text"].append(data)
+
+
+def parse_reservation_list(html):
+    """Parse the reservation list into [{"text", "amenity_id"}] rows; amenity_id is None when a row has no link with one."""
+    parser = ReservationListParser()
+    parser.feed(html)
+    parser.close()
+    return [row for row in parser.rows if row["text"]]
+
+
+@traced()
+def fetch_reservations(session, username):
+    """GET the user's reservation list."""
+    response = session.get(booking_utils.reservation_list_url(), timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    rows = parse_reservation_list(response.text)
+    log(username, f"Reservation list has {len(rows)} rows.")
+    return rows
+
+
+def has_reservation(rows, amenity_id, target_date, start_time):
+    """
+    True if a reservation list row shows this date and, as its first time, this start time. Rows whose
+    links name another amenity don't count.
+    """
+    day = datetime.datetime.strptime(target_date, "%Y-%m-%d")
+    start_24 = booking_utils.convert_to_24_hour_format(start_time)
+    dates = [target_date, f"{day.month}/{day.day}/{day.year}", f"{day:%b} {day.day}, {day.year}", f"{day:%B} {day.day}, {day.year}"]
+    for row in rows:
+        if row["amenity_id"] is not None and row["amenity_id"] != str(amenity_id):
+            continue
+        first_time = LIST_TIME_PATTERN.search(row["text"])
+        if any(date in row["text"] for date in dates) and first_time and booking_utils.convert_to_24_hour_format(first_time.group(1)) == start_24:
+            return True
+    return False
+
+
+def create_session(driver=None, pool_size=4):
+    """Create a pooled HTTP session, reusing the cookies and user agent of a logged-in driver."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if driver is not None:
+        session.headers["User-Agent"] = driver.execute_script("return navigator.userAgent;")
+        for cookie in driver.get_cookies():
+            session.cookies.set(cookie["name"], cookie["value"], domain=cookie.get("domain"), path=cookie.get("path", "/"))
+    return session
+
+
+@traced()
+def fetch_form_state(session, amenity_id, target_date, username):
+    """GET the reservation page and capture __VIEWSTATE/__EVENTVALIDATION ahead of the submit."""
+    url = booking_utils.booking_page_url(amenity_id, target_date)
+    response = session.get(url, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    page = parse_reservation_page(response.text)
+    page["url"] = url
+    if "__VIEWSTATE" not in page["fields"]:
+        raise ValueError(f"[{username}] No __VIEWSTATE on reservation page {url}.")
+    log(username, f"Captured form state for amenity ID {amenity_id} on {target_date}.")
+    return page
+
+
+def picker_value(target_date, time_24):
+    """Format a date and HH:MM time the way RadTimePicker posts it."""
+    value = datetime.datetime.strptime(f"{target_date} {time_24}", "%Y-%m-%d %H:%M")
+    return value.strftime("%Y-%m-%d-%H-%M-%S")
+
+
+def picker_label(time_24):
+    """Format an HH:MM time as the 12-hour label shown in the picker input."""
+    return datetime.datetime.strptime(time_24, "%H:%M").strftime("%I:%M %p").lstrip("0")
+
+
+def end_time_for(start_time):
+    """
+    Return the HH:MM end time one hour after the given start time. Raises ValueError for a start
+    after 23:00, whose end would fall on the next day, before the start on the target date's picker.
+    """
+    hour, minute = booking_utils.convert_to_24_hour_format(start_time).split(":")
+    if int(hour) >= 23:
+        raise ValueError(f"A slot starting at {hour}:{minute} would end after midnight; only same-day slots can be booked.")
+    return f"{int(hour) + 1:02d}:{minute}"
+
+
+def build_postback(form_state, target_date, start_time):
+    """Build the postback body for submitting a reservation from a captured form state."""
+    start_24 = booking_utils.convert_to_24_hour_format(start_time)
+    end_24 = end_time_for(start_24)
+    data = dict(form_state["fields"])
+    data["__EVENTTARGET"] = SAVE_BUTTON_TARGET
+    data["__EVENTARGUMENT"] = ""
+    for field, time_24 in ((START_PICKER_FIELD, start_24), (END_PICKER_FIELD, end_24)):
+        value = picker_value(target_date, time_24)
+        data[field] = value
+        data[f"{field}$dateInput"] = picker_label(time_24)
+        data[f"{field.replace('$', '_')}_dateInput_ClientState"] = json.dumps({
+            "enabled": True,
+            "emptyMessage": "",
+            "validationText": value,
+            "valueAsString": value,
+            "lastSetTextBoxValue": picker_label(time_24),
+        })
+    return data
+
+
+@traced()
+def http_book_time_slot(session, form_state, target_date, start_time, username):
+    """
+    Submit a reservation with a single ASP.NET postback.
+    Returns (success, message, next_form_state); the returned page's form state can be reused for the next slot.
+    """
+    data = build_postback(form_state, target_date, start_time)
+    log(username, f"Posting reservation for {start_time} over HTTP.")
+    response = session.post(form_state["url"], data=data, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    page = parse_reservation_page(response.text)
+    page["url"] = form_state["url"]
+    if page["errors"]:
+        message = " | ".join(page["errors"])
+        log(username, f"Detected error: {message}")
+        return False, message, page
+    if page["has_header"]:
+        return True, "Reservation has been made successfully!", page
+    return False, "Booking was not successful.", page
@@ -0,0 +1,190 @@
+"""
+Queue-based logging for booking runs.
+
+Worker threads only enqueue records; one background writer emits them as JSON lines to a single
+rotating file per run and echoes console messages to stdout. View one user's records with:
+
+    python booking_log.py logs/run_20250101_000000_1234.jsonl --user alice
+"""
+import argparse
+import atexit
+import datetime
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+LOGGER_NAME = "booking"
+LOG_DIR = "logs"
+QUEUE_SIZE = 10000  # Records beyond this are dropped rather than blocking a worker
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per record: timestamp, level, user, slot, thread and message."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "user": getattr(record, "user", None),
+            "slot": getattr(record, "slot", None),
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """The familiar "[username] message" console format."""
+
+    def format(self, record):
+        user = getattr(record, "user", None)
+        return f"[{user}] {record.getMessage()}" if user else record.getMessage()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller: when the queue is full the record is dropped and counted."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only merge the message here; formatting happens on the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)  # Wait for room instead of failing on a full queue
+
+
+def _console_only(record):
+    return getattr(record, "console", False)
+
+
+class LogPipeline:
+    """A bounded record queue drained by one writer thread into a rotating JSON-lines file."""
+
+    def __init__(self, path, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT, queue_size=QUEUE_SIZE):
+        self.path = path
+        self.queue = queue.Queue(queue_size)
+        self.queue_handler = DroppingQueueHandler(self.queue)
+
+        file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        file_handler.setFormatter(JsonLinesFormatter())
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(ConsoleFormatter())
+        console_handler.addFilter(_console_only)
+        self.handlers = [file_handler, console_handler]
+        self.listener = _Listener(self.queue, *self.handlers)
+
+    def start(self):
+        logger = logging.getLogger(LOGGER_NAME)
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        logger.addHandler(self.queue_handler)
+        self.listener.start()
+
+    def flush(self):
+        """Block until every record enqueued so far has been written."""
+        self.queue.join()
+
+    def stop(self):
+        """Detach from the logger, drain the queue and close every handler."""
+        logging.getLogger(LOGGER_NAME).removeHandler(self.queue_handler)
+        self.listener.stop()
+        for handler in self.handlers:
+            handler.close()
+        if self.queue_handler.dropped:
+            print(f"Logging queue was full: {self.queue_handler.dropped} records dropped.")
+
+
+def start_logging(config=None):
+    """Start the run's logging pipeline (once) and return the path of its log file."""
+    global _pipeline
+    config = config or {}
+    with _pipeline_lock:
+        if _pipeline is None:
+            log_dir = config.get("log_dir", LOG_DIR)
+            os.makedirs(log_dir, exist_ok=True)
+            path = os.path.join(log_dir, f"run_{datetime.datetime.now():%Y%m%d_%H%M%S}_{os.getpid()}.jsonl")
+            _pipeline = LogPipeline(path, config.get("log_max_bytes", MAX_BYTES), config.get("log_backup_count", BACKUP_COUNT))
+            _pipeline.start()
+        return _pipeline.path
+
+
+def flush_logging():
+    """Wait for the writer to catch up, e.g. before printing a summary."""
+    if _pipeline is not None:
+        _pipeline.flush()
+
+
+def stop_logging():
+    """Flush and close the run's log file. Safe to call more than once."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is not None:
+            _pipeline.stop()
+            _pipeline = None
+
+
+atexit.register(stop_logging)
+
+
+def get_logger(username=None, slot=None):
+    """Logger for one user and slot; records go to the run file only."""
+    if _pipeline is None:
+        start_logging()
+    return logging.LoggerAdapter(logging.getLogger(LOGGER_NAME), {"user": username, "slot": slot})
+
+
+def log(username, message, level=logging.INFO):
+    """Record a message and echo it to the console as "[username] message", off the calling thread."""
+    if _pipeline is None:
+        start_logging()
+    logging.getLogger(LOGGER_NAME).log(level, message, extra={"user": username, "console": True})
+
+
+def read_user_records(path, username, slot=None):
+    """Yield one user's records from a run file and its rotated backups, oldest first."""
+    backups = sorted(glob.glob(f"{glob.escape(path)}.*"), key=lambda p: int(p.rsplit(".", 1)[1]), reverse=True)
+    for file_path in backups + [path]:
+        with open(file_path, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if record["user"] == username and (slot is None or record["slot"] == slot):
+                    yield record
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show one user's records from a run log.")
+    parser.add_argument("path", help="Run log file, e.g. logs/run_20250101_000000_1234.jsonl")
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--slot", help="Only records for this time slot.")
+    args = parser.parse_args()
+
+    for record in read_user_records(args.path, args.user, args.slot):
+        slot = f" {record['slot']}" if record["slot"] else ""
+        print(f"{record['ts']} {record['level']:<7} [{record['user']}{slot}] {record['message']}")
+        if "exc" in record:
+            print(record["exc"])
@@ -0,0 +1,257 @@
+"""
+Booking plan: the config validated and compiled once, before anything waits for release, into an
+immutable plan of what the run is set up from: the target date, the release and fire instants the
+scheduler is created with, the login and booking URLs, the amenities, each slot's 24h start and end
+with the picker labels that show them, and every user's slot order.
+
+    python booking_auto.py --dry-run
+    python booking_auto.py --dry-run --date 2030-01-01 --page saved_new_reservation.html
+
+A dry run prints the plan and checks its times against a reservation page without opening a browser:
+a page saved with --page, else the live page fetched over HTTP with a user's saved session, else the
+local stand-in's page (which only shows the times fit the picker).
+"""
+import datetime
+import types
+from collections import namedtuple
+import requests
+import booking_http
+import booking_utils
+import session_store
+from attempt_history import HISTORY_DAYS
+from clock import SYSTEM_CLOCK
+
+FIRE_OFFSET_MS = -30
+
+# One configured slot: the label as written in "times", its HH:MM start and end, and their picker labels
+TimeSlot = namedtuple("TimeSlot", "label start_24 end_24 start_label end_label")
+
+# Immutable: mappings are read-only views and sequences are tuples
+BookingPlan = namedtuple("BookingPlan", "target_date release_time fire_offset_ms fire_time login_url primary_amenity "
+                                        "alternate_amenity amenity_ids booking_urls slots jobs")
+
+
+class PlanError(ValueError):
+    """The config can't be compiled into a booking plan; lists every problem found."""
+
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__("Invalid booking config:\n  " + "\n  ".join(problems))
+
+
+def release_time_for(config, target_date_str):
+    """The local datetime bookings for the target date open: release_at if given, else midnight prio days before."""
+    if "release_at" in config:
+        # Explicit release instant, e.g. when running against the local stand-in
+        return datetime.datetime.fromisoformat(config["release_at"])
+    return booking_utils.calculate_release_time(target_date_str, config["booking_start_offset_days"])
+
+
+def _problems(config):
+    """Every reason the config can't be run, as messages; empty when it can."""
+    problems = []
+    for key in ("users", "amenities", "primary_amenity_name", "alternate_amenity_name", "times", "target_days",
+                "target_date_offset_days", "booking_start_offset_days", "refresh_interval_seconds", "check_interval_seconds"):
+        if key not in config:
+            problems.append(f"{key} is missing.")
+    if problems:
+        return problems
+
+    for key, kind in (("users", list), ("amenities", dict), ("times", list), ("target_days", list)):
+        if not isinstance(config[key], kind):
+            problems.append(f"{key} must be a {'list' if kind is list else 'mapping'}.")
+    if problems:
+        return problems
+
+    if not config["users"]:
+        problems.append("users is empty.")
+    usernames = []
+    for index, user in enumerate(config["users"]):
+        if not isinstance(user, dict) or not user.get("username") or not user.get("password"):
+            problems.append(f"users[{index}] needs a username and a password.")
+        else:
+            usernames.append(user["username"])
+    for username in sorted({name for name in usernames if usernames.count(name) > 1}):
+        problems.append(f"User {username} is listed more than once.")
+
+    for key in ("primary_amenity_name", "alternate_amenity_name"):
+        if config[key] not in config["amenities"]:
+            problems.append(f"{key} {config[key]!r} is not one of the amenities {sorted(config['amenities'])}.")
+
+    if not config["times"]:
+        problems.append("times is empty.")
+    starts = []
+    for label in config["times"]:
+        start = booking_utils.TIME_LABELS.get(label.strip()) if isinstance(label, str) else None
+        if start is None:
+            problems.append(f"Time {label!r} is neither HH:MM nor H:MM AM/PM.")
+        elif start >= "23:00":
+            problems.append(f"Time {label!r} would end after midnight; only same-day slots can be booked.")
+        starts.append(start)
+    for start in sorted({start for start in starts if start and starts.count(start) > 1}):
+        problems.append(f"Start time {start} is listed more than once in times.")
+
+    if not all(isinstance(day, int) and 0 <= day <= 6 for day in config["target_days"]):
+        problems.append("target_days must be weekdays 0 (Monday) to 6 (Sunday).")
+    for key in ("target_date_offset_days", "booking_start_offset_days"):
+        if not isinstance(config[key], int) or config[key] < 0:
+            problems.append(f"{key} must be a whole number of days, 0 or more.")
+    for key in ("refresh_interval_seconds", "check_interval_seconds"):
+        if not isinstance(config[key], (int, float)) or config[key] <= 0:
+            problems.append(f"{key} must be a positive number of seconds.")
+    if not isinstance(config.get("fire_offset_ms", FIRE_OFFSET_MS), int):
+        problems.append("fire_offset_ms must be a whole number of milliseconds.")
+    if "release_at" in config:
+        try:
+            datetime.datetime.fromisoformat(config["release_at"])
+        except (TypeError, ValueError):
+            problems.append(f"release_at {config['release_at']!r} is not an ISO date and time.")
+    if not isinstance(config.get("parallel_tabs", 1), int) or config.get("parallel_tabs", 1) < 1:
+        problems.append("parallel_tabs must be 1 or more.")
+    return problems
+
+
+def compile_plan(config, target_date, clock=SYSTEM_CLOCK, history=None):
+    """
+    Validate the config and compile the plan for a target date (date or YYYY-MM-DD); raises PlanError
+    listing every problem. With a history and adaptive_order the slot orders come from past attempts,
+    otherwise each user starts one slot further along the times.
+    """
+    problems = _problems(config)
+    if problems:
+        raise PlanError(problems)
+    target_date_str = target_date if isinstance(target_date, str) else target_date.strftime("%Y-%m-%d")
+
+    slots = []
+    for label in config["times"]:
+        start_24 = booking_utils.convert_to_24_hour_format(label)
+        end_24 = booking_http.end_time_for(start_24)
+        slots.append(TimeSlot(label, start_24, end_24, booking_http.picker_label(start_24), booking_http.picker_label(end_24)))
+
+    names = dict.fromkeys((config["primary_amenity_name"], config["alternate_amenity_name"]))
+    amenity_ids = {name: config["amenities"][name] for name in names}
+
+    times = config["times"]
+    if history is not None and config.get("adaptive_order", False):
+        # Strongest users first, each starting on a different slot, most contested slots first
+        ordered = history.order_jobs(config["users"], times, config.get("adaptive_history_days", HISTORY_DAYS), clock.now())
+    else:
+        # Rotate the times for each user so they start on different slots
+        ordered = [(user, times[index % len(times):] + times[:index % len(times)]) for index, user in enumerate(config["users"])]
+
+    release_time = release_time_for(config, target_date_str)
+    fire_offset_ms = config.get("fire_offset_ms", FIRE_OFFSET_MS)
+    login_date = clock.today() + datetime.timedelta(days=config["booking_start_offset_days"])
+    return BookingPlan(
+        target_date=target_date_str,
+        release_time=release_time,
+        fire_offset_ms=fire_offset_ms,
+        fire_time=release_time + datetime.timedelta(milliseconds=fire_offset_ms),
+        login_url=booking_utils.login_url(login_date.strftime("%Y-%m-%d")),
+        primary_amenity=config["primary_amenity_name"],
+        alternate_amenity=config["alternate_amenity_name"],
+        amenity_ids=types.MappingProxyType(amenity_ids),
+        # Also fills booking_page_url's cache, so the workers' lookups at release are dict hits
+        booking_urls=types.MappingProxyType({name: booking_utils.booking_page_url(amenity_id, target_date_str)
+                                             for name, amenity_id in amenity_ids.items()}),
+        slots=tuple(slots),
+        jobs=tuple((user["username"], tuple(slot_order)) for user, slot_order in ordered),
+    )
+
+
+def plan_jobs(plan, config):
+    """The plan's slot orders as the (user, time_slots) jobs the runners take."""
+    users = {user["username"]: user for user in config["users"]}
+    return [(users[username], list(slot_order)) for username, slot_order in plan.jobs]
+
+
+def describe(plan):
+    """The plan as printable lines."""
+    lines = [f"Booking plan for {plan.target_date}",
+             f"  Release {plan.release_time}, fire at {plan.fire_time.isoformat(sep=' ', timespec='milliseconds')} ({plan.fire_offset_ms:+d}ms; server clock sync adjusts it at run time)",
+             f"  Login: {plan.login_url}"]
+    for name, amenity_id in plan.amenity_ids.items():
+        role = "Primary" if name == plan.primary_amenity else "Alternate"
+        lines.append(f"  {role} {name} (id {amenity_id}): {plan.booking_urls[name]}")
+    lines.append("  Slots:")
+    for slot in plan.slots:
+        lines.append(f"    {slot.label}: {slot.start_24}-{slot.end_24}, picker \"{slot.start_label}\" to \"{slot.end_label}\"")
+    lines.append("  Slot order per user:")
+    for username, slot_order in plan.jobs:
+        lines.append(f"    [{username}] {', '.join(slot_order)}")
+    return lines
+
+
+def check_page(plan, html):
+    """Problems with the plan against a NewReservation.aspx page: missing form state or time options."""
+    page = booking_http.parse_reservation_page(html)
+    if page["unavailable"]:
+        return ["The page shows the amenity as unavailable on that date."]
+    problems = []
+    if "__VIEWSTATE" not in page["fields"]:
+        problems.append("The page has no __VIEWSTATE.")
+    starts = {booking_utils.convert_to_24_hour_format(label) for label in page["start_options"]}
+    ends = {booking_utils.convert_to_24_hour_format(label) for label in page["end_options"]}
+    for slot in plan.slots:
+        if slot.start_24 not in starts:
+            problems.append(f"Start time {slot.start_label} of slot {slot.label} is not offered.")
+        if slot.end_24 not in ends:
+            problems.append(f"End time {slot.end_label} of slot {slot.label} is not offered.")
+    return problems
+
+
+def live_page(plan, config, date):
+    """
+    (html, source) of the primary amenity's live page for a date, fetched over HTTP with the first
+    user's saved session that is still logged in; None if no saved session works.
+    """
+    url = plan.booking_urls[plan.primary_amenity] if date == plan.target_date else booking_utils.booking_page_url(plan.amenity_ids[plan.primary_amenity], date)
+    for user in config["users"]:
+        cookies = session_store.load_session(user["username"])
+        if not cookies:
+            continue
+        try:
+            response = session_store.cookie_session(cookies).get(url, timeout=booking_http.HTTP_TIMEOUT, allow_redirects=False)
+        except requests.RequestException as e:
+            print(f"Could not fetch {url}: {e}")
+            return None
+        if response.status_code == 200:
+            return response.text, f"the live page for {date} (as {user['username']})"
+    return None
+
+
+def stand_in_page(plan):
+    """(html, source) of the local stand-in's page, which only shows whether the times fit the picker."""
+    from mock_buildinglink import MockBuildingLink  # Test stand-in; only needed without a real page
+    stand_in = MockBuildingLink()  # Open from the start; its server is never started
+    try:
+        html = stand_in.render(plan.amenity_ids[plan.primary_amenity], plan.target_date)
+    finally:
+        stand_in.server.server_close()
+    return html, "the local stand-in's page (save a real page for --page, or keep a saved session, for a real check)"
+
+
+def dry_run(config, target_date, page_path=None, clock=SYSTEM_CLOCK, history=None):
+    """
+    Print the plan and check it against a saved page, else the live page of today (the target date
+    stays closed until release) with a saved session, else the stand-in's page. Returns True if it passes.
+    """
+    try:
+        plan = compile_plan(config, target_date, clock, history)
+    except PlanError as e:
+        print(e)
+        return False
+    print("\n".join(describe(plan)))
+    if page_path:
+        with open(page_path, "r", encoding="utf-8") as f:
+            html, source = f.read(), page_path
+    else:
+        html, source = live_page(plan, config, clock.today().strftime("%Y-%m-%d")) or stand_in_page(plan)
+    problems = check_page(plan, html)
+    if problems:
+        print(f"Checked against {source}:")
+        for problem in problems:
+            print(f"  {problem}")
+        return False
+    print(f"Checked against {source}: form state present and every slot's start and end time offered.")
+    return True
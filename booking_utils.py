@@ -1,6 +1,3 @@
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-import smtplib
 import sys
 import threading
 import time
@@ -12,41 +9,88 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.service import Service
-from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
 from webdriver_manager.chrome import ChromeDriverManager
+import json
 import logging
 import os
+import booking_http
+import availability
+import attempt_history
+import browser_profile
+from booking_log import get_logger, log
+from metrics import METRICS
+from notifications import notify_error, notify_success
+from clock import SYSTEM_CLOCK
+from release_scheduler import ReleaseScheduler
+from slot_claims import iter_claimed_slots
+import page_snapshot
+import page_waits
+import parallel_tabs
+from phase_trace import TRACE, traced
+import session_store
+import submit_retry
 
 
 MAX_RETRIES = 10
 RETRY_DELAY = 3  # seconds
+DRIVER_CACHE_FILE = ".driver_cache.json"
+SUBMIT_RESULT_TIMEOUT = 10  # seconds
+URL_WAIT_TIMEOUT = 2  # seconds
 
-def setup_logger(username, time_slot):
-    """Set up a logger for each booking process and time slot."""
-    thread_id = threading.get_ident()  # Get unique thread ID
-    # Ensure the logs directory exists
-    os.makedirs("logs", exist_ok=True)
-    log_filename = f"logs/{username}_{time_slot}_{thread_id}.log"
-    
-    logger = logging.getLogger(log_filename)  # Use filename as logger name to avoid conflicts
-    logger.setLevel(logging.DEBUG)
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+# Site endpoints; overridable through the config so a local stand-in can be used
+BASE_URL = "https://www.buildinglink.com"
+AUTH_URL = "https://auth.buildinglink.com"
+
+_booking_urls = {}  # (amenity_id, target_date) -> NewReservation.aspx URL under the current BASE_URL
 
-    # Create a file handler for logging
-    file_handler = logging.FileHandler(log_filename)
-    file_handler.setLevel(logging.DEBUG)
+def configure_urls(config):
+    """Point the booking helpers at the endpoints configured in the config, if any."""
+    global BASE_URL, AUTH_URL
+    BASE_URL = config.get("base_url", BASE_URL).rstrip("/")
+    AUTH_URL = config.get("auth_url", AUTH_URL).rstrip("/")
+    _booking_urls.clear()
 
-    # Create a logging format
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
+def booking_page_url(amenity_id, target_date):
+    """Build the NewReservation.aspx URL for an amenity and date, once per amenity and date."""
+    url = _booking_urls.get((amenity_id, target_date))
+    if url is None:
+        url = _booking_urls[(amenity_id, target_date)] = f"{BASE_URL}/V2/Tenant/Amenities/NewReservation.aspx?amenityId={amenity_id}&from=0&selectedDate={target_date}"
+    return url
 
-    # Add the handlers to the logger
-    if not logger.hasHandlers():  # Avoid adding multiple handlers in case of re-entry
-        logger.addHandler(file_handler)
+def login_url(login_date):
+    """The login page, opened on the given date."""
+    return f"{AUTH_URL}/Account/Login?selectedDate={login_date}"
 
-    return logger
+def reservation_list_url():
+    """The user's list of upcoming reservations."""
+    return f"{BASE_URL}/V2/Tenant/Amenities/MyReservations.aspx"
+
+def setup_logger(username, time_slot):
+    """Logger for one booking process and time slot; records go through the run's shared log queue."""
+    return get_logger(username, time_slot)
+
+def _time_labels():
+    """Every minute of the day under each label a picker or config uses for it: "6:05 PM", "06:05 PM", "18:05" -> "18:05"."""
+    labels = {}
+    for minutes in range(24 * 60):
+        hour, minute = divmod(minutes, 60)
+        time_24 = f"{hour:02d}:{minute:02d}"
+        hour_12, suffix = hour % 12 or 12, "AM" if hour < 12 else "PM"
+        for label in (time_24, f"{hour}:{minute:02d}", f"{hour_12}:{minute:02d} {suffix}", f"{hour_12:02d}:{minute:02d} {suffix}"):
+            labels[label] = labels[label.lower()] = time_24
+    return labels
+
+TIME_LABELS = _time_labels()
 
 def convert_to_24_hour_format(time_str):
     """Convert a time string to 24-hour format."""
+    time_24 = TIME_LABELS.get(time_str.strip())
+    if time_24 is not None:
+        return time_24
     try:
         # Handle 12-hour format with AM/PM
         in_time = datetime.datetime.strptime(time_str.strip(), "%I:%M %p")
@@ -59,11 +103,12 @@ def convert_to_24_hour_format(time_str):
         except ValueError:
             return time_str  # Return as is if conversion fails
 
+@traced()
 def login(driver, username, password, login_date):
     """Log in to the booking system."""
     try:
-        driver.get(f"https://auth.buildinglink.com/Account/Login?selectedDate={login_date}")
-        print(f"[{username}] Navigated to login page.")
+        driver.get(login_url(login_date))
+        log(username, "Navigated to login page.")
 
         # Login process
         username_field = driver.find_element(By.NAME, "Username")
@@ -71,59 +116,54 @@ def login(driver, username, password, login_date):
 
         username_field.send_keys(username)
         password_field.send_keys(password)
-        print(f"[{username}] Entered credentials.")
+        log(username, "Entered credentials.")
 
         login_button = driver.find_element(By.ID, "LoginButton")
         login_button.click()
-        print(f"[{username}] Clicked login button.")
+        log(username, "Clicked login button.")
     except Exception as e:
-        print(f"[{username}] Exception during login: {e}")
+        log(username, f"Exception during login: {e}", logging.ERROR)
         raise
 
+@traced()
 def navigate_to_booking_page(driver, amenity_id, target_date, username):
     """Navigate to the booking page after logging in."""
     try:
-        driver.get(f"https://www.buildinglink.com/V2/Tenant/Amenities/NewReservation.aspx?amenityId={amenity_id}&from=0&selectedDate={target_date}")
-        print(f"[{username}] Navigated to booking page for amenity ID {amenity_id} on {target_date}.")
+        driver.get(booking_page_url(amenity_id, target_date))
+        log(username, f"Navigated to booking page for amenity ID {amenity_id} on {target_date}.")
     except Exception as e:
-        print(f"[{username}] Exception during navigation to booking page: {e}")
+        log(username, f"Exception during navigation to booking page: {e}", logging.ERROR)
         raise
 
-def keep_session_alive(driver, refresh_interval, username):
-    """Keep the session alive by refreshing the page at regular intervals."""
-    try:
-        if int(time.time()) % refresh_interval == 0:
-            driver.refresh()
-            print(f"[{username}] Refreshed page to keep session alive.")
-    except Exception as e:
-        print(f"[{username}] Exception during session refresh: {e}")
+@traced()
+def authenticate(driver, username, password, login_date, config, check_url):
+    """Log in, or restore the saved session when the session cache is enabled and still valid."""
+    if config.get("session_cache", False):
+        session_store.ensure_logged_in(driver, username, password, login_date, check_url)
+    else:
+        login(driver, username, password, login_date)
 
-def check_for_errors_and_exit(driver, username):
-    """Check the ValidationContainer for errors and exit if found."""
-    try:
-        validation_container = driver.find_element(By.ID, "ValidationContainer")
-        if validation_container.text.strip():  # If ValidationContainer has any text
-            # Check specific labels for detailed error messages
-            errors = []
-            try:
-                error_label_1 = driver.find_element(By.ID, "ctl00_ContentPlaceHolder1_ValidationSummary1")
-                if error_label_1.text.strip():
-                    errors.append(error_label_1.text.strip())
-            except Exception as e:
-                print(f"[{username}] No error in ValidationSummary1: {e}")
+def start_keep_alive(driver, username, refresh_interval, ping_url):
+    """Keep the session alive from a background thread with HTTP pings instead of page refreshes."""
+    keep_alive = session_store.KeepAlive(username, driver.get_cookies(), ping_url, refresh_interval).start()
+    log(username, f"Keep-alive pinging every {refresh_interval}s.")
+    return keep_alive
 
-            try:
-                error_label_2 = driver.find_element(By.ID, "ctl00_ContentPlaceHolder1_ctl00_ContentPlaceHolder1_pnlAllocationErrorPanel")
-                if error_label_2.text.strip():
-                    errors.append(error_label_2.text.strip())
-            except Exception as e:
-                print(f"[{username}] No error in pnlAllocationErrorPanel: {e}")
+def apply_refreshed_cookies(session):
+    """Checkpoint on the thread driving the browser: set the cookies the keep-alive refreshed since the last one."""
+    if session["keep_alive"] is not None:
+        session["keep_alive"].apply_refreshed(session["driver"])
 
-            error_message = " | ".join(errors) if errors else "Unknown error in ValidationContainer."
-            print(f"[{username}] Detected error: {error_message}")
+def check_for_errors_and_exit(driver, username, snapshot=None):
+    """Check the ValidationContainer for errors and exit if found."""
+    try:
+        errors = (snapshot or page_snapshot.PageSnapshot.take(driver)).errors()
+        if errors:
+            error_message = " | ".join(errors)
+            log(username, f"Detected error: {error_message}")
             return True, error_message
     except Exception as e:
-        print(f"[{username}] Can't find Error section")
+        log(username, f"Can't read Error section: {e}", logging.ERROR)
     return False, ""
 
 def check_amenity_unavailable(driver, username):
@@ -132,59 +172,62 @@ def check_amenity_unavailable(driver, username):
         # Look for the specific element indicating unavailability
         error_element = driver.find_element(By.CSS_SELECTOR, "div.Div.PT")
         if "This Amenity is currently unavailable on the selected date." in error_element.text:
-            print(f"[{username}] Amenity is currently unavailable on the selected date.")
+            log(username, "Amenity is currently unavailable on the selected date.")
             return True
         return False
     except Exception as e:
-        print(f"[{username}] Amenity availability check exception: {e}")
+        log(username, f"Amenity availability check exception: {e}")
         return False
 
 def wait_for_start_time_options_to_load(driver, timeout=10):
-    """The text of the waiting time option is not empty"""
-    WebDriverWait(driver, timeout).until(
-        lambda d: all(option.text.strip() != '' for option in d.find_elements(By.XPATH, "//div[@id='ctl00_ContentPlaceHolder1_StartTimePicker_timeView']//a"))
-    )
-        
+    """Wait until the start time options have text and return the page snapshot."""
+    return wait_for_picker_snapshot(driver, "start", timeout)
+
 def wait_for_end_time_options_to_load(driver, timeout=10):
-    """The text of the waiting time option is not empty"""
-    WebDriverWait(driver, timeout).until(
-        lambda d: all(option.text.strip() != '' for option in d.find_elements(By.XPATH, "//div[@id='ctl00_ContentPlaceHolder1_EndTimePicker_timeView']//a"))
-    )
+    """Wait until the end time options have text and return the page snapshot."""
+    return wait_for_picker_snapshot(driver, "end", timeout)
+
+def wait_for_picker_snapshot(driver, picker, timeout=10):
+    """Wait in-page until the picker's options are all loaded, then take one page snapshot."""
+    view_id = page_snapshot.START_TIME_VIEW_ID if picker == "start" else page_snapshot.END_TIME_VIEW_ID
+    if page_waits.wait_for(driver, f"{picker}_time_options", [["loaded", "all_text", view_id]], timeout) is None:
+        raise TimeoutException(f"{picker} time options did not load within {timeout}s.")
+    return page_snapshot.PageSnapshot.take(driver)
+
+def select_time_option(snapshot, picker, time_24, username):
+    """Click the picker option for an HH:MM time using the snapshot's index."""
+    options = snapshot.start_options if picker == "start" else snapshot.end_options
+    match = options.get(time_24)
+    if match is None:
+        raise ValueError(f"[{username}] Could not find a matching {picker} time option for '{time_24}'.")
+    match[1].click()
+    log(username, f"Selected {picker} time: {time_24}")
 
 def book_time_slot(driver, start_time, username):
-    """Book a specific time slot and handle validation errors for end time."""
+    """Book a specific time slot and return the monotonic time the submit was clicked."""
+    fill_time_slot(driver, start_time, username)
+    return submit_booking(driver, username)
+
+@traced()
+def fill_time_slot(driver, start_time, username):
+    """Select the start and end times for a slot and handle validation errors for end time."""
     try:
-        print(f"[{username}] Attempting to book time slot: {start_time}")
+        log(username, f"Attempting to book time slot: {start_time}")
 
         # Convert input start_time to 24-hour format
         start_time_24 = convert_to_24_hour_format(start_time)
-        print(f"[{username}] Converted start time to 24-hour format: {start_time_24}")
+        log(username, f"Converted start time to 24-hour format: {start_time_24}")
 
         # Select start time
         start_time_input = WebDriverWait(driver, 20).until(
             EC.element_to_be_clickable((By.ID, 'ctl00_ContentPlaceHolder1_StartTimePicker_dateInput'))
         )
         start_time_input.click()  # Click to open the time options
-        print(f"[{username}] Clicked on start time input.")
-
-        # Find all time options available in the time picker
-        wait_for_start_time_options_to_load(driver)
-        time_options = driver.find_elements(By.XPATH, "//div[@id='ctl00_ContentPlaceHolder1_StartTimePicker_timeView']//a")
-        print(f"[{username}] Retrieved time options for start time.")
-
-        # Check both 12-hour and 24-hour formats
-        matched = False
-        for option in time_options:
-            option_text_raw = option.text.strip()
-            option_text = convert_to_24_hour_format(option_text_raw)  # Convert each option to 24-hour format
-            if option_text == start_time_24:
-                option.click()
-                matched = True
-                print(f"[{username}] Selected start time: {option_text}")
-                break
+        log(username, "Clicked on start time input.")
 
-        if not matched:
-            raise ValueError(f"[{username}] Could not find a matching start time option for '{start_time_24}'.")
+        # Read all options in one round trip and pick the match from the index
+        snapshot = wait_for_start_time_options_to_load(driver)
+        select_time_option(snapshot, "start", start_time_24, username)
 
         # Automatically set end time
         set_end_time(driver, start_time, username)
@@ -193,120 +236,166 @@ def book_time_slot(driver, start_time, username):
         has_error, error_message = check_for_errors_and_exit(driver, username)
         if has_error:
             if "End time must be greater than start time" in error_message:
-                print(f"[{username}] Error detected: End time is not valid. Retrying to select a new end time.")
+                log(username, "Error detected: End time is not valid. Retrying to select a new end time.")
                 # Retry selecting the end time
                 set_end_time(driver, start_time, username)
             else:
                 raise ValueError(f"[{username}] Booking error detected: {error_message}")
 
-        # Submit booking
+        # The submit's result wait only counts the document that replaces this one
+        page_waits.mark_document(driver)
+
+    except Exception as e:
+        # Log the exception and re-raise
+        log(username, f"Exception during booking time slot: {e}", logging.ERROR)
+        raise
+
+def submit_booking(driver, username):
+    """Click the save button on a filled form and return the monotonic time of the click."""
+    clicked_at = click_submit(driver, username)
+    check_submit_errors(driver, username)
+    return clicked_at
+
+@traced()
+def click_submit(driver, username):
+    """Click the save button and return the monotonic time of the click."""
+    try:
         submit_button = WebDriverWait(driver, 10).until(
             EC.element_to_be_clickable((By.ID, 'ctl00_ContentPlaceHolder1_HeaderSaveButton'))
         )
         submit_button.click()
-        print(f"[{username}] Clicked submit button to finalize booking.")
-        
-        time.sleep(2)
-        # After submitting, immediately check for errors
-        has_error, error_message = check_for_errors_and_exit(driver, username)
-        if has_error:
-            raise ValueError(f"[{username}] Booking error detected: {error_message}")
-
+        clicked_at = time.monotonic()
+        log(username, "Clicked submit button to finalize booking.")
+        return clicked_at
     except Exception as e:
-        # Log the exception and re-raise
-        print(f"[{username}] Exception during booking time slot: {e}")
+        log(username, f"Exception during booking submit: {e}", logging.ERROR)
         raise
 
+@traced()
+def check_submit_errors(driver, username):
+    """
+    Wait for the postback and raise if the page reports a booking error. The form was marked when it
+    was filled, so the conditions only match the page the postback returns, never the submitted form.
+    """
+    # Return as soon as the result header or a validation error appears, or an error page replaces the form
+    outcome = page_waits.wait_for(driver, "submit_result", [["success", "present", "ThePageHeaderWrap"], ["error", "text", "ValidationContainer"],
+                                                            ["error_page", "absent", "aspnetForm"]], SUBMIT_RESULT_TIMEOUT, new_document=True)
+    if outcome == "error_page":
+        raise ValueError(f"[{username}] Server error: the submit did not return the reservation page.")
+    has_error, error_message = check_for_errors_and_exit(driver, username)
+    if has_error:
+        raise ValueError(f"[{username}] Booking error detected: {error_message}")
+
+def stage_reservation(driver, amenity_id, target_date, start_time, username):
+    """
+    Load the target-date page and pre-select the start and end times before release.
+    Returns True if the form is staged and only needs its save button clicked at release.
+    """
+    try:
+        navigate_to_booking_page(driver, amenity_id, target_date, username)
+        if not verify_page_url(driver, target_date, username, amenity_id):
+            return False
+        if check_amenity_unavailable(driver, username):
+            # The server hasn't opened the date yet; the page must be reloaded at release
+            return False
+        fill_time_slot(driver, start_time, username)
+        log(username, f"Staged reservation form for {start_time}.")
+        return True
+    except Exception as e:
+        log(username, f"Could not stage reservation form for {start_time}: {e}")
+        return False
+
+@traced()
 def set_end_time(driver, start_time, username):
     """Set the end time to one hour later than the start time."""
     try:
-        print(f"[{username}] Setting end time.")
-        # Convert start time to a datetime object and add one hour
-        start_time_obj = datetime.datetime.strptime(start_time.strip(), "%I:%M")
-        end_time_obj = start_time_obj + datetime.timedelta(hours=1)
-        end_time_str = end_time_obj.strftime("%I:%M")  # Convert back to 12-hour format
-        # Convert input start_time to 24-hour format
-        end_time_24 = convert_to_24_hour_format(end_time_str)
-        print(f"[{username}] Calculated end time: {end_time_24}")
+        log(username, "Setting end time.")
+        # One hour after the start, whether the slot is configured as "18:00" or "6:00 PM"
+        end_time_24 = booking_http.end_time_for(start_time)
+        log(username, f"Calculated end time: {end_time_24}")
 
         # Click the end time input to open the time options
         end_time_input = WebDriverWait(driver, 20).until(
             EC.element_to_be_clickable((By.ID, 'ctl00_ContentPlaceHolder1_EndTimePicker_dateInput'))
         )
         end_time_input.click()  # Click to open the time options
-        print(f"[{username}] Clicked on end time input.")
-
-        # Find all time options available in the time picker
-        wait_for_end_time_options_to_load(driver)
-        time_options = driver.find_elements(By.XPATH, "//div[@id='ctl00_ContentPlaceHolder1_EndTimePicker_timeView']//a")
-        print(f"[{username}] Retrieved time options for end time.")
-
-        # Check both 12-hour and 24-hour formats
-        matched = False
-        for option in time_options:
-            option_text = convert_to_24_hour_format(option.text.strip())  # Convert each option to 24-hour format
-            if option_text == end_time_24:
-                option.click()
-                matched = True
-                print(f"[{username}] Selected end time: {option_text}")
-                break
+        log(username, "Clicked on end time input.")
 
-        if not matched:
-            raise ValueError(f"[{username}] Could not find a matching end time option for '{end_time_24}'.")
+        # Read all options in one round trip and pick the match from the index
+        snapshot = wait_for_end_time_options_to_load(driver)
+        select_time_option(snapshot, "end", end_time_24, username)
 
     except Exception as e:
-        print(f"[{username}] Exception during setting end time: {e}")
+        log(username, f"Exception during setting end time: {e}", logging.ERROR)
         raise
 
+@traced()
 def verify_page_url(driver, target_date, username, amenity_id):
     """Verify if the current URL matches the expected target date URL, ignoring case."""
-    expected_url = f"https://www.buildinglink.com/V2/Tenant/Amenities/NewReservation.aspx?amenityId={amenity_id}&from=0&selectedDate={target_date}".lower()
+    expected_url = booking_page_url(amenity_id, target_date).lower()
     max_attempts = 10
     attempts = 0
 
     while attempts < max_attempts:
         current_url = driver.current_url.lower()  # Convert current URL to lowercase for case-insensitive comparison
         if current_url == expected_url:
-            print(f"[{username}] URL verification successful. Current URL matches target (ignoring case): {current_url}")
+            log(username, f"URL verification successful. Current URL matches target (ignoring case): {current_url}")
             return True
         else:
-            print(f"[{username}] URL mismatch (ignoring case). Current URL: {current_url}, expected: {expected_url}. Reloading...")
+            log(username, f"URL mismatch (ignoring case). Current URL: {current_url}, expected: {expected_url}. Reloading...")
             driver.get(expected_url)
-            time.sleep(0.1)  # Wait for the page to load before checking again
+            # Continue as soon as the target URL is current or the page finished loading
+            page_waits.wait_for(driver, "verify_page_url", [["target", "url", expected_url], ["loaded", "ready", None]], URL_WAIT_TIMEOUT)
             attempts += 1
 
-    print(f"[{username}] URL verification failed after {max_attempts} attempts.")
+    log(username, f"URL verification failed after {max_attempts} attempts.")
     return False
 
 def send_error_email(config, username, error_message):
-    subject = f"Error in booking process for {username}"
-    body = f"An error occurred while setting up the browser for {username}. Error details: {error_message}"
-    
-    msg = MIMEMultipart()
-    msg['From'] = config["sender_email"]
-    msg['To'] = ', '.join(config["recipient_emails"])
-    msg['Subject'] = subject
-    msg.attach(MIMEText(body, 'plain'))
-
-    try:
-        with smtplib.SMTP(config["smtp_server"], config["smtp_port"]) as server:
-            server.starttls()
-            server.login(config["sender_username"], config["sender_password"])
-            server.send_message(msg)
-        print(f"Error email sent for {username}")
-    except Exception as e:
-        print(f"Failed to send error email for {username}: {str(e)}")
-
-def setup_driver(logger):
+    """Queue an error notice; notices arriving close together go out as one digest email."""
+    notify_error(config, username, error_message)
+
+def resolve_driver_path():
+    """
+    Resolve the chromedriver binary once and cache its path on disk.
+    Later runs reuse the cached binary without any network check.
+    """
+    global _driver_path
+    with _driver_path_lock:
+        if _driver_path and os.path.exists(_driver_path):
+            return _driver_path
+        try:
+            with open(DRIVER_CACHE_FILE, "r") as f:
+                cached = json.load(f).get("driver_path")
+            if cached and os.path.exists(cached):
+                _driver_path = cached
+                return _driver_path
+        except (OSError, ValueError):
+            pass
+        _driver_path = ChromeDriverManager().install()
+        with open(DRIVER_CACHE_FILE, "w") as f:
+            json.dump({"driver_path": _driver_path}, f)
+        return _driver_path
+
+def setup_driver(logger, slim=False):
+    """Start Chrome; with slim, use the resource-light profile that only loads what booking needs."""
     chrome_options = Options()
     if sys.platform in ["linux", "darwin"]:
         chrome_options.add_argument('--headless')
         chrome_options.add_argument('--no-sandbox')
         chrome_options.add_argument('--disable-dev-shm-usage')
+    if slim:
+        browser_profile.apply_slim_options(chrome_options, [BASE_URL, AUTH_URL])
 
     for attempt in range(MAX_RETRIES):
         try:
-            driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
+            driver = webdriver.Chrome(service=Service(resolve_driver_path()), options=chrome_options)
+            if slim:
+                try:
+                    browser_profile.apply_slim_network(driver)
+                except Exception:
+                    driver.quit()
+                    raise
             logger.info("Browser successfully initialized.")
             return driver
         except Exception as e:
@@ -318,96 +407,284 @@ def setup_driver(logger):
                 logger.error("Max retries reached. Unable to initialize browser.")
                 raise
 
-def run_booking_process(username, password, target_date, time_slots, prio_days, amenity_id, amenity_name, refresh_interval, check_interval, config):
-    logger = setup_logger(username, "multiple_slots")
-    logger.info(f"Starting booking process for {username} for date {target_date} with time slots {time_slots}")
-
+def calculate_release_time(target_date, prio_days):
+    """Return the local datetime at which bookings for target_date (YYYY-MM-DD) open."""
     target_datetime = datetime.datetime.strptime(target_date, "%Y-%m-%d")
-    target_time = datetime.datetime.combine(target_datetime - datetime.timedelta(days=prio_days), datetime.time(0, 0))
-    logger.info(f"Waiting for booking time: {target_time.strftime('%Y-%m-%d %H:%M:%S')}")
+    return datetime.datetime.combine(target_datetime - datetime.timedelta(days=prio_days), datetime.time(0, 0))
 
-    while True:
-        now = datetime.datetime.now()
-        time_to_booking = (target_time - now).total_seconds()
+def cancel_if_won(claim_board, start_time, result, slot_logger):
+    """Mark the attempt cancelled if another attempt already won this slot. Returns True if cancelled."""
+    winner = claim_board.winner(start_time) if claim_board is not None else None
+    if winner is None:
+        return False
+    result["status"] = "Cancelled"
+    result["message"] = f"Slot already won by {winner[0]} at {winner[1]}."
+    slot_logger.info(result["message"])
+    return True
 
-        if time_to_booking <= 300:
-            logger.info("Booking time is less than 5 minutes away. Getting ready...")
-            break
+def record_booking_outcome(driver, result, slot_logger):
+    """Mark the result as successful if the confirmation header is on the page."""
+    try:
+        driver.find_element(By.ID, "ThePageHeaderWrap")
+        result["status"] = "Success"
+        result["message"] = "Reservation has been made successfully!"
+        slot_logger.info("Booking successful.")
+    except NoSuchElementException:
+        result["message"] = "Booking was not successful."
+        slot_logger.error("Booking failed.")
+
+def open_booking_session(username, password, target_date, prio_days, amenity_id, refresh_interval, config, logger, browser_pool=None, clock=SYSTEM_CLOCK):
+    """
+    Login phase: get a logged-in browser for the user and prepare the keep-alive and HTTP fast path.
+    Returns the per-user session state used by the later phases.
+    """
+    session = {"username": username, "driver": None, "keep_alive": None, "http_session": None, "form_state": None,
+               "staged_claim": None, "first_claim": None, "tabs": None, "browser_pool": browser_pool,
+               "slim_browser": config.get("slim_browser", False)}
+    try:
+        login_date = (clock.today() + datetime.timedelta(days=prio_days)).strftime("%Y-%m-%d")
+        check_url = booking_page_url(amenity_id, target_date)
+        if browser_pool is not None:
+            # Take the pre-warmed, already logged-in browser for this user
+            session["driver"] = browser_pool.checkout(username, password, login_date, check_url)
+            logger.info("Logged-in browser taken from pool.")
+        else:
+            session["driver"] = setup_driver(logger, config.get("slim_browser", False))
+            logger.info("Browser ready.")
 
-        time.sleep(check_interval)
-        
-    driver = None
-    all_results = []
+            # Login, or restore the cached session
+            authenticate(session["driver"], username, password, login_date, config, check_url)
+            logger.info("Logged in.")
+        availability.AVAILABILITY.offer_session(session["driver"])
 
-    try:
-        driver = setup_driver(logger)
-        logger.info("Browser ready.")
+        if config.get("session_cache", False):
+            session["keep_alive"] = start_keep_alive(session["driver"], username, refresh_interval, check_url)
 
-        # Login
-        login_date = (datetime.date.today() + datetime.timedelta(days=prio_days)).strftime("%Y-%m-%d")
-        login(driver, username, password, login_date)
-        logger.info("Logged in.")
+        # Optional HTTP fast path: reuse the login cookies and capture the form state before release
+        if config.get("http_fast_path", False):
+            try:
+                session["http_session"] = booking_http.create_session(session["driver"])
+                session["form_state"] = booking_http.fetch_form_state(session["http_session"], amenity_id, target_date, username)
+                logger.info("HTTP fast path ready.")
+            except Exception as e:
+                session["http_session"] = None
+                logger.error(f"HTTP fast path unavailable, using Selenium: {e}")
+    except Exception:
+        close_booking_session(session, logger)
+        raise
+    return session
+
+def stages_before_release(config):
+    """Whether forms are filled before release, for staged_submit or parallel_tabs."""
+    return config.get("staged_submit", False) or config.get("parallel_tabs", 1) > 1
+
+def stage_booking_session(session, target_date, time_slots, amenity_name, config, logger, claim_board=None):
+    """
+    Stage phase: fill the first slot's form before release so only the submit remains at T0, or with
+    parallel_tabs one form per tab.
+    """
+    if session["http_session"] is not None or not time_slots:
+        return
+    apply_refreshed_cookies(session)
+    if parallel_tabs.tab_count(config, time_slots) > 1:
+        parallel_tabs.stage_tabs(session, target_date, time_slots, amenity_name, config, logger, claim_board)
+        return
+    if not config.get("staged_submit", False):
+        return
+    username = session["username"]
+    first_claim = claim_board.claim_next(username, time_slots, wait=False) if claim_board else (time_slots[0], amenity_name)
+    session["first_claim"] = first_claim
+    if first_claim and stage_reservation(session["driver"], config["amenities"][first_claim[1]], target_date, first_claim[0], username):
+        session["staged_claim"] = first_claim
+        logger.info(f"Staged form for {first_claim[0]} at {first_claim[1]}.")
+
+def new_attempt_result(username, start_time, amenity_name, config):
+    """The result dict of one (slot, amenity) attempt, failed until proven otherwise."""
+    return {"username": username, "time": start_time, "amenity_id": config["amenities"][amenity_name],
+            "amenity_name": amenity_name, "status": "Failed", "message": ""}
+
+def finish_attempt(result, target_date, config, started, slot_logger, claim_board=None):
+    """Settle an attempt: complete its claim, record it with its phase timings and announce a win."""
+    username = result["username"]
+    if claim_board is not None:
+        claim_board.complete(result["time"], result["amenity_name"], username, result["status"] == "Success")
+    METRICS.count_outcome(result)
+    result["phases_ms"] = TRACE.phase_durations(username, started)
+    attempt_history.RECORDER.record(attempt_history.run_key_for(config, target_date), result)
+    if "t0_to_submit_ms" in result:
+        availability.AVAILABILITY.request_refresh()  # Every submit may have taken a slot
+    if result["status"] == "Success":
+        notify_success(config, result, target_date)
+    slot_logger.info(f"Finished booking attempt for time slot {result['time']}.")
+
+def attempt_booking(session, start_time, attempt_amenity_name, target_date, config, scheduler, claim_board=None):
+    """Submit phase: attempt one (slot, amenity), retrying transient failures, and return its result dict."""
+    username = session["username"]
+    result = new_attempt_result(username, start_time, attempt_amenity_name, config)
+    slot_logger = setup_logger(username, start_time)
+    slot_logger.info(f"Starting booking for time slot {start_time} at {attempt_amenity_name}")
+    started = time.monotonic()
+    retry = submit_retry.SubmitRetry(session, config, scheduler, target_date)
 
-        # Wait until target time
+    try:
         while True:
-            now = datetime.datetime.now()
-            time_to_booking = (target_time - now).total_seconds()
-            if time_to_booking <= 0:
-                break
-            elif time_to_booking <= 5:  # If less than 5 seconds, wait precisely
-                time.sleep(time_to_booking)
+            error = None
+            try:
+                try_booking(session, result, target_date, config, scheduler, claim_board, slot_logger)
+            except Exception as e:
+                error = e
+                result["message"] = f"An error occurred: {str(e)}"
+                slot_logger.error(f"Exception in booking process: {traceback.format_exc()}")
+            if result["status"] != "Failed" or not retry.next_try(result, error, slot_logger):
                 break
-            else:
-                time.sleep(check_interval)  # Wait in small intervals
+    finally:
+        finish_attempt(result, target_date, config, started, slot_logger, claim_board)
+    return result
+
+def try_booking(session, result, target_date, config, scheduler, claim_board, slot_logger):
+    """One try at the attempt's slot: the HTTP fast path, the staged form, or navigate, fill and submit."""
+    username = session["username"]
+    driver = session["driver"]
+    start_time = result["time"]
+    attempt_amenity_name = result["amenity_name"]
+    attempt_amenity_id = result["amenity_id"]
+
+    if availability.AVAILABILITY.is_taken(attempt_amenity_id, target_date, start_time):
+        result["status"] = "Skipped"
+        result["message"] = "Slot is no longer offered according to the availability snapshot."
+        slot_logger.info(result["message"])
+        return
+
+    if session["http_session"] is not None:
+        try:
+            form_state = session["form_state"]
+            if form_state is None or form_state["unavailable"] or form_state["url"] != booking_page_url(attempt_amenity_id, target_date):
+                form_state = booking_http.fetch_form_state(session["http_session"], attempt_amenity_id, target_date, username)
+                availability.AVAILABILITY.publish(attempt_amenity_id, target_date, form_state)
+                if form_state["unavailable"]:
+                    # Still closed: posting the form now would only get the "currently unavailable" page back
+                    session["form_state"] = form_state
+                    result["message"] = "Amenity is currently unavailable on the selected date."
+                    slot_logger.error(result["message"])
+                    return
+            if cancel_if_won(claim_board, start_time, result, slot_logger):
+                return
+            result["t0_to_submit_ms"] = round((time.monotonic() - scheduler.fire_monotonic) * 1000, 1)
+            success, message, session["form_state"] = booking_http.http_book_time_slot(session["http_session"], form_state, target_date, start_time, username)
+            result["status"] = "Success" if success else "Failed"
+            result["message"] = message
+            slot_logger.info(f"HTTP fast path result: {message}")
+            return
+        except Exception as e:
+            session["form_state"] = None
+            if "t0_to_submit_ms" in result:
+                raise  # The post may have gone through; only the retry engine may submit again
+            slot_logger.error(f"HTTP fast path failed, falling back to Selenium: {e}")
+
+    if (start_time, attempt_amenity_name) == session["staged_claim"]:
+        # The form was filled before release; only the submit is left on the critical path
+        session["staged_claim"] = None
+        if cancel_if_won(claim_board, start_time, result, slot_logger):
+            return
+        slot_logger.info(f"Submitting staged form for {start_time}.")
+        clicked_at = click_submit(driver, username)
+        result["t0_to_submit_ms"] = round((clicked_at - scheduler.fire_monotonic) * 1000, 1)
+        check_submit_errors(driver, username)
+        record_booking_outcome(driver, result, slot_logger)
+        return
+
+    # Navigate to the booking page for the target date
+    apply_refreshed_cookies(session)
+    navigate_to_booking_page(driver, attempt_amenity_id, target_date, username)
+    slot_logger.info(f"Navigated to reserve page for amenity {attempt_amenity_name} on {target_date}.")
+
+    # Verify if the page is for the correct date
+    if verify_page_url(driver, target_date, username, attempt_amenity_id):
+        slot_logger.info("Correct date page loaded.")
+    else:
+        msg = "Incorrect date page loaded. Skipping this time slot."
+        slot_logger.error(msg)
+        result["message"] = msg
+        return
+
+    # Check if amenity is unavailable
+    if check_amenity_unavailable(driver, username):
+        msg = "Amenity is currently unavailable on the selected date."
+        slot_logger.error(msg)
+        result["message"] = msg
+        return
+
+    # Attempt to book the time slot
+    slot_logger.info(f"Attempting to book at {start_time}.")
+    fill_time_slot(driver, start_time, username)
+    if cancel_if_won(claim_board, start_time, result, slot_logger):
+        return
+    clicked_at = click_submit(driver, username)
+    result["t0_to_submit_ms"] = round((clicked_at - scheduler.fire_monotonic) * 1000, 1)
+    check_submit_errors(driver, username)
+    record_booking_outcome(driver, result, slot_logger)
+
+
+def close_booking_session(session, logger):
+    """Stop the keep-alive and close (or hand back) the user's browser."""
+    if session["keep_alive"] is not None:
+        session["keep_alive"].stop()
+    driver = session["driver"]
+    if driver and session["tabs"]:
+        try:
+            parallel_tabs.close_tabs(session)
+        except Exception as e:
+            logger.error(f"Could not close the extra tabs: {e}")
+    if driver and session["slim_browser"]:
+        # Scans /proc for the browser's processes; only worth it when tuning the slim profile
+        try:
+            logger.info(f"Browser resources: {browser_profile.session_resources(driver)}")
+        except Exception as e:
+            logger.error(f"Could not measure browser resources: {e}")
+    if driver and session["browser_pool"] is not None:
+        if session["browser_pool"].checkin(session["username"], driver):
+            logger.info("Browser returned to pool, still logged in.")
+        else:
+            logger.info("Browser returned to pool and closed.")
+    elif driver:
+        driver.quit()
+        logger.info("Browser closed.")
 
-        for start_time in time_slots:
-            result = {"username": username, "time": start_time, "amenity_id": amenity_id, "amenity_name": amenity_name, "status": "Failed", "message": ""}
-            slot_logger = setup_logger(username, start_time)
-            slot_logger.info(f"Starting booking for time slot {start_time}")
+def run_booking_process(username, password, target_date, time_slots, prio_days, amenity_id, amenity_name, refresh_interval, check_interval, config, browser_pool=None, scheduler=None, claim_board=None, clock=SYSTEM_CLOCK):
+    logger = setup_logger(username, "multiple_slots")
+    logger.info(f"Starting booking process for {username} for date {target_date} with time slots {time_slots}")
 
-            try:
-                # Navigate to the booking page for the target date
-                navigate_to_booking_page(driver, amenity_id, target_date, username)
-                slot_logger.info(f"Navigated to reserve page for amenity {amenity_name} on {target_date}.")
-
-                # Verify if the page is for the correct date
-                if verify_page_url(driver, target_date, username, amenity_id):
-                    slot_logger.info("Correct date page loaded.")
-                else:
-                    msg = "Incorrect date page loaded. Skipping this time slot."
-                    slot_logger.error(msg)
-                    result["message"] = msg
-                    all_results.append(result)
-                    continue  # Skip to the next time slot
-
-                # Check if amenity is unavailable
-                if check_amenity_unavailable(driver, username):
-                    msg = "Amenity is currently unavailable on the selected date."
-                    slot_logger.error(msg)
-                    result["message"] = msg
-                    all_results.append(result)
-                    continue  # Skip to the next time slot
-
-                # Attempt to book the time slot
-                slot_logger.info(f"Attempting to book at {start_time}.")
-                book_time_slot(driver, start_time, username)
+    target_time = calculate_release_time(target_date, prio_days)
+    logger.info(f"Waiting for booking time: {target_time.strftime('%Y-%m-%d %H:%M:%S')}")
 
-                try:
-                    driver.find_element(By.ID, "ThePageHeaderWrap")
-                    result["status"] = "Success"
-                    result["message"] = "Reservation has been made successfully!"
-                    slot_logger.info("Booking successful.")
-                except NoSuchElementException:
-                    result["message"] = "Booking was not successful."
-                    slot_logger.error("Booking failed.")
+    if scheduler is None:
+        scheduler = ReleaseScheduler(target_time, config.get("fire_offset_ms", -30), clock=clock)
+    scheduler.wait_until(300, check_interval)
+    logger.info("Booking time is less than 5 minutes away. Getting ready...")
 
-            except Exception as e:
-                result["message"] = f"An error occurred: {str(e)}"
-                slot_logger.error(f"Exception in booking process: {traceback.format_exc()}")
+    session = None
+    all_results = []
+
+    try:
+        session = open_booking_session(username, password, target_date, prio_days, amenity_id, refresh_interval, config, logger, browser_pool, scheduler.clock)
+
+        # Optionally stage the first slot's form (or one form per tab) shortly before release
+        if stages_before_release(config):
+            scheduler.wait_until(config.get("stage_lead_seconds", 20), check_interval)
+            stage_booking_session(session, target_date, time_slots, amenity_name, config, logger, claim_board)
+
+        # Wait until the shared, server-synchronized fire instant
+        apply_refreshed_cookies(session)
+        jitter = scheduler.wait_for_fire(username)
+        logger.info(f"Fire instant reached (wake jitter {jitter * 1000:.3f}ms).")
 
-            finally:
-                all_results.append(result)
-                slot_logger.info(f"Finished booking attempt for time slot {start_time}.")
+        if session["tabs"]:
+            tab_results = parallel_tabs.submit_tabs(session, target_date, config, scheduler, claim_board)
+            all_results.extend(tab_results)
+            time_slots = parallel_tabs.remaining_slots(time_slots, tab_results, claim_board)
+
+        for start_time, attempt_amenity_name in iter_claimed_slots(claim_board, username, time_slots, amenity_name, session["first_claim"]):
+            all_results.append(attempt_booking(session, start_time, attempt_amenity_name, target_date, config, scheduler, claim_board))
 
         # After all bookings, optionally logout or perform any cleanup if necessary
 
@@ -416,9 +693,8 @@ def run_booking_process(username, password, target_date, time_slots, prio_days,
         logger.error(error_message)
         send_error_email(config, username, error_message)
     finally:
-        if driver:
-            driver.quit()
-            logger.info("Browser closed.")
-    
+        if session is not None:
+            close_booking_session(session, logger)
+
     logger.info(f"All booking attempts completed. Results: {all_results}")
-    return all_results
\ No newline at end of file
+    return all_results
@@ -0,0 +1,300 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from booking_log import get_logger
+from booking_utils import authenticate, resolve_driver_path, setup_driver
+from browser_profile import apply_slim_network, browser_rss_bytes
+from metrics import METRICS
+
+HEALTH_CHECK_INTERVAL = 15  # seconds
+
+
+def is_driver_healthy(driver):
+    """Return True if the browser still answers a trivial script."""
+    try:
+        return driver.execute_script("return 1;") == 1
+    except Exception:
+        return False
+
+
+class BrowserPool:
+    """
+    A set of browsers launched and health-checked in parallel well before release.
+    Browsers can be logged in ahead of time for each user; crashed ones are replaced in the background.
+    With keep_sessions, a browser handed back after a run stays logged in for the user's next run.
+    """
+
+    def __init__(self, size, logger=None, health_check_interval=HEALTH_CHECK_INTERVAL, config=None, check_url=None,
+                 keep_sessions=False):
+        self.size = size
+        self.keep_sessions = keep_sessions
+        self.config = config or {}
+        self.check_url = check_url
+        self.logger = logger or get_logger()
+        self.health_check_interval = health_check_interval
+        self.idle = queue.Queue()
+        self.prepared = {}  # username -> (driver, password, login_date, check_url)
+        self.checked_out = {}  # username -> (password, login_date, check_url) of browsers in use
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.monitor_thread = None
+        METRICS.track_pool(self)
+
+    def _launch(self):
+        driver = setup_driver(self.logger, self.config.get("slim_browser", False))
+        if not is_driver_healthy(driver):
+            driver.quit()
+            raise RuntimeError("Browser failed its health check after launch.")
+        return driver
+
+    def warm(self):
+        """Launch all browsers in parallel. Returns the seconds until every browser was ready."""
+        start = time.monotonic()
+        resolve_driver_path()  # Resolve once up front so the launches don't race on it
+        with ThreadPoolExecutor(max_workers=max(self.size, 1)) as executor:
+            for driver in executor.map(lambda _: self._launch(), range(self.size)):
+                self.idle.put(driver)
+        elapsed = time.monotonic() - start
+        self.logger.info(f"Browser pool warmed: {self.size} browsers ready in {elapsed:.2f}s.")
+        return elapsed
+
+    def acquire(self, timeout=None):
+        """Take a healthy idle browser, launching a new one if the pool has none ready."""
+        while True:
+            try:
+                driver = self.idle.get(timeout=timeout) if timeout else self.idle.get_nowait()
+            except queue.Empty:
+                return self._launch()
+            if is_driver_healthy(driver):
+                return driver
+            self.logger.error("Discarding crashed browser from pool.")
+            self._quit(driver)
+
+    def _login(self, username, password, login_date, check_url):
+        driver = self.acquire()
+        try:
+            authenticate(driver, username, password, login_date, self.config, check_url)
+        except Exception:
+            self._quit(driver)
+            raise
+        return driver
+
+    def prepare_users(self, users, login_date, check_url=None):
+        """
+        Log every user in on its own pooled browser, in parallel, reusing a browser the user kept from a
+        previous run. check_url (default: the pool's) is the page a restored session is checked against.
+        """
+        check_url = check_url or self.check_url
+
+        def prepare(user):
+            with self.lock:
+                kept = self.prepared.pop(user["username"], None)
+            if kept and is_driver_healthy(kept[0]):
+                driver = kept[0]
+                try:
+                    # Restores the saved session, or logs in again if it expired
+                    authenticate(driver, user["username"], user["password"], login_date, self.config, check_url)
+                except Exception:
+                    self._quit(driver)
+                    raise
+            else:
+                if kept:
+                    self._quit(kept[0])
+                driver = self._login(user["username"], user["password"], login_date, check_url)
+            with self.lock:
+                self.prepared[user["username"]] = (driver, user["password"], login_date, check_url)
+            self.logger.info(f"[{user['username']}] Logged-in browser ready in pool.")
+
+        with ThreadPoolExecutor(max_workers=max(len(users), 1)) as executor:
+            for future in [executor.submit(prepare, user) for user in users]:
+                try:
+                    future.result()
+                except Exception as e:
+                    self.logger.error(f"Failed to prepare pooled browser: {e}")
+
+    def checkout(self, username, password, login_date, check_url=None):
+        """Hand over the logged-in browser for a user, logging in on demand if none was prepared."""
+        check_url = check_url or self.check_url
+        with self.lock:
+            entry = self.prepared.pop(username, None)
+            self.checked_out[username] = (password, login_date, check_url)
+        if entry and is_driver_healthy(entry[0]):
+            return entry[0]
+        if entry:
+            self._quit(entry[0])
+        return self._login(username, password, login_date, check_url)
+
+    def checkin(self, username, driver):
+        """
+        Take back a user's browser after its run: keep it logged in for the user's next run if the pool
+        keeps sessions and it is still healthy, otherwise close it.
+        """
+        healthy = is_driver_healthy(driver)
+        with self.lock:
+            credentials = self.checked_out.pop(username, None)
+            keep = healthy and self.keep_sessions and credentials is not None and username not in self.prepared
+            if keep:
+                self.prepared[username] = (driver, *credentials)
+        if not keep:
+            self._quit(driver)
+        return keep
+
+    def discard(self, driver):
+        """Close a browser that was checked out of the pool."""
+        self._quit(driver)
+
+    def _quit(self, driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def _replace_crashed(self):
+        with self.lock:
+            prepared = list(self.prepared.items())
+        for username, (driver, password, login_date, check_url) in prepared:
+            if is_driver_healthy(driver):
+                continue
+            self.logger.error(f"[{username}] Pooled browser crashed, replacing it.")
+            self._quit(driver)
+            try:
+                replacement = self._login(username, password, login_date, check_url)
+            except Exception as e:
+                self.logger.error(f"[{username}] Failed to replace pooled browser: {e}")
+                continue
+            with self.lock:
+                if username in self.prepared:
+                    self.prepared[username] = (replacement, password, login_date, check_url)
+                else:
+                    # Checked out while we were replacing it; keep it as a spare
+                    self.idle.put(replacement)
+
+        spares = []
+        while True:
+            try:
+                spares.append(self.idle.get_nowait())
+            except queue.Empty:
+                break
+        for driver in spares:
+            if is_driver_healthy(driver):
+                self.idle.put(driver)
+            else:
+                self.logger.error("Idle pooled browser crashed, replacing it.")
+                self._quit(driver)
+                try:
+                    self.idle.put(self._launch())
+                except Exception as e:
+                    self.logger.error(f"Failed to replace idle browser: {e}")
+
+    def _monitor(self):
+        while not self.stop_event.wait(self.health_check_interval):
+            self._replace_crashed()
+
+    def start_monitor(self):
+        """Start the background thread that replaces crashed browsers."""
+        self.monitor_thread = threading.Thread(target=self._monitor, daemon=True)
+        self.monitor_thread.start()
+
+    def rss_bytes(self):
+        """Resident memory of every browser the pool holds."""
+        with self.lock, self.idle.mutex:
+            drivers = [entry[0] for entry in self.prepared.values()] + list(self.idle.queue)
+        return sum(browser_rss_bytes(driver) or 0 for driver in drivers)
+
+    def close(self):
+        """Stop the monitor and quit every browser still held by the pool."""
+        self.stop_event.set()
+        if self.monitor_thread:
+            self.monitor_thread.join()
+        with self.lock:
+            prepared = [entry[0] for entry in self.prepared.values()]
+            self.prepared.clear()
+        for driver in prepared:
+            self._quit(driver)
+        while True:
+            try:
+                self._quit(self.idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+class BrowserContextPool(BrowserPool):
+    """
+    A BrowserPool whose browsers are isolated browser contexts (separate cookie jars) inside one shared
+    Chrome process. Each context is driven by its own WebDriver session attached to that Chrome, so users
+    still run in parallel while sharing a single browser process.
+    """
+
+    def __init__(self, size, logger=None, health_check_interval=HEALTH_CHECK_INTERVAL, config=None, check_url=None,
+                 keep_sessions=False):
+        super().__init__(size, logger, health_check_interval, config, check_url, keep_sessions)
+        self.host = None
+        self.debugger_address = None
+        self.host_lock = threading.Lock()
+        self.contexts = {}  # WebDriver session id -> browserContextId
+
+    def _ensure_host(self):
+        """Launch the shared Chrome (again, if it crashed); must be called with host_lock held."""
+        if self.host is not None and is_driver_healthy(self.host):
+            return
+        if self.host is not None:
+            self.logger.error("Shared browser crashed, relaunching it.")
+            super()._quit(self.host)
+        self.host = setup_driver(self.logger, self.config.get("slim_browser", False))
+        self.debugger_address = self.host.capabilities["goog:chromeOptions"]["debuggerAddress"]
+
+    def _attach(self):
+        options = Options()
+        options.debugger_address = self.debugger_address
+        if self.config.get("slim_browser", False):
+            options.page_load_strategy = "eager"
+        return webdriver.Chrome(service=Service(resolve_driver_path()), options=options)
+
+    def _launch(self):
+        with self.host_lock:
+            self._ensure_host()
+            context_id = self.host.execute_cdp_cmd("Target.createBrowserContext", {})["browserContextId"]
+            target_id = self.host.execute_cdp_cmd("Target.createTarget", {"url": "about:blank", "browserContextId": context_id})["targetId"]
+        driver = self._attach()
+        try:
+            driver.switch_to.window(target_id)  # ChromeDriver window handles are DevTools target ids
+            if self.config.get("slim_browser", False):
+                apply_slim_network(driver)
+        except Exception:
+            super()._quit(driver)
+            self._dispose(context_id)
+            raise
+        with self.lock:
+            self.contexts[driver.session_id] = context_id
+        return driver
+
+    def _dispose(self, context_id):
+        with self.host_lock:
+            try:
+                self.host.execute_cdp_cmd("Target.disposeBrowserContext", {"browserContextId": context_id})
+            except Exception:
+                pass
+
+    def _quit(self, driver):
+        with self.lock:
+            context_id = self.contexts.pop(driver.session_id, None)
+        super()._quit(driver)  # Detaches the attached session; the shared browser keeps running
+        if context_id is not None:
+            self._dispose(context_id)
+
+    def rss_bytes(self):
+        """Resident memory of the shared browser plus every attached WebDriver session."""
+        with self.host_lock:
+            host_rss = (browser_rss_bytes(self.host) or 0) if self.host is not None else 0
+        return host_rss + super().rss_bytes()
+
+    def close(self):
+        super().close()
+        with self.host_lock:
+            if self.host is not None:
+                super()._quit(self.host)
+                self.host = None
@@ -0,0 +1,125 @@
+import os
+from urllib.parse import urlparse
+
+try:
+    import psutil
+except ImportError:  # Optional: /proc is read directly on Linux
+    psutil = None
+
+# Resource types the booking flow never needs
+BLOCKED_URL_PATTERNS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico", "*.bmp",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.mp3", "*.ogg", "*.wav",
+]
+SLIM_ARGUMENTS = [
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--disable-translate",
+    "--no-first-run",
+    "--mute-audio",
+    "--blink-settings=imagesEnabled=false",
+    "--disable-features=Translate,OptimizationHints,MediaRouter,InterestFeedContentSuggestions",
+]
+PAGE_LOAD_SCRIPT = """
+var nav = performance.getEntriesByType('navigation')[0];
+return nav ? [nav.domContentLoadedEventEnd, nav.loadEventEnd] : null;
+"""
+
+
+def allowed_hosts(urls):
+    """Hosts the slim profile may reach: the site's own domains, and always the local machine."""
+    hosts = {"localhost", "127.0.0.1"}
+    for url in urls:
+        host = urlparse(url).hostname
+        if not host:
+            continue
+        if host.replace(".", "").isdigit() or "." not in host:
+            hosts.add(host)  # IP address or single-label name
+            continue
+        domain = ".".join(host.split(".")[-2:])  # www.buildinglink.com -> buildinglink.com
+        hosts.update({domain, f"*.{domain}"})
+    return sorted(hosts)
+
+
+def apply_slim_options(chrome_options, urls):
+    """Eager page loads, no extensions or background networking, and DNS only for the site's own hosts."""
+    chrome_options.page_load_strategy = "eager"
+    for argument in SLIM_ARGUMENTS:
+        chrome_options.add_argument(argument)
+    exclusions = ", ".join(f"EXCLUDE {host}" for host in allowed_hosts(urls))
+    chrome_options.add_argument(f"--host-resolver-rules=MAP * ~NOTFOUND, {exclusions}")
+    chrome_options.add_experimental_option("prefs", {
+        "profile.managed_default_content_settings.images": 2,
+        "profile.default_content_setting_values.notifications": 2,
+    })
+
+
+def apply_slim_network(driver):
+    """Block images, fonts and media at the network layer through CDP."""
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+
+
+def _children(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; the parent pid follows the closing parenthesis
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return children
+
+
+def _rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def browser_rss_bytes(driver):
+    """Resident memory of the chromedriver process and every Chrome process below it, or None if unknown."""
+    pid = driver.service.process.pid
+    if psutil is not None:
+        try:
+            root = psutil.Process(pid)
+            return sum(p.memory_info().rss for p in [root] + root.children(recursive=True))
+        except psutil.Error:
+            return None
+    if not os.path.isdir("/proc"):
+        return None
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        total += _rss_bytes(current)
+        pending.extend(_children(current))
+    return total
+
+
+def page_load_ms(driver):
+    """(DOMContentLoaded, load) of the current page in ms since navigation start; load is 0 if still loading."""
+    timings = driver.execute_script(PAGE_LOAD_SCRIPT)
+    return tuple(timings) if timings else None
+
+
+def session_resources(driver):
+    """One-line RSS and page load summary for a browser session."""
+    rss = browser_rss_bytes(driver)
+    timings = page_load_ms(driver)
+    rss_text = f"{rss / 2**20:.0f} MB RSS" if rss is not None else "RSS unknown"
+    load_text = f"last page DOM ready {timings[0]:.0f}ms, loaded {timings[1]:.0f}ms" if timings else "no page timing"
+    return f"{rss_text}; {load_text}"
@@ -0,0 +1,198 @@
+"""
+Campaign daemon: one long-running process for many booking campaigns instead of a cron job per day.
+
+    python campaign_daemon.py --config booking_config.json --mode threaded
+
+Each entry of "campaigns" in the config overrides the top-level settings for one campaign (amenities,
+times, target_days, booking_start_offset_days, users given by username, ...). The next release instant
+of every campaign is kept in a priority queue. A campaign run starts campaign_lead_seconds before its
+release on its own thread, so overlapping releases run side by side. With browser_pool or
+browser_contexts the browsers stay open and logged in between runs. The config file is reloaded
+whenever it changes.
+"""
+import argparse
+import datetime
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import traceback
+from booking_auto import CONFIG_FILE, run_all_bookings
+from booking_log import log, start_logging, stop_logging
+from booking_plan import release_time_for
+from booking_utils import calculate_release_time, configure_urls
+from browser_pool import BrowserContextPool, BrowserPool
+from clock import SYSTEM_CLOCK
+from notifications import notify_error, stop_notifications
+from page_waits import WAIT_STATS
+from phase_trace import TRACE
+
+LEAD_SECONDS = 1200  # Start a run this long before its release; covers the default 900s browser warm-up
+RELOAD_CHECK_SECONDS = 30
+HORIZON_DAYS = 14  # How far ahead to look for a campaign's next target day
+
+
+def load_campaigns(config):
+    """Return {name: campaign config}: the top-level config with each campaign's overrides applied."""
+    base = {key: value for key, value in config.items() if key != "campaigns"}
+    users = {user["username"]: user for user in base.get("users", [])}
+    campaigns = {}
+    for index, overrides in enumerate(config.get("campaigns") or [{}]):
+        campaign = dict(base, **overrides)
+        campaign["users"] = [users[user] if isinstance(user, str) else user for user in campaign["users"]]
+        campaign.setdefault("name", f"campaign-{index + 1}")
+        campaigns[campaign["name"]] = campaign
+    return campaigns
+
+
+def next_release(campaign, after):
+    """(release_time, target_date) of the campaign's first release after the given datetime, or None."""
+    prio_days = campaign["booking_start_offset_days"]
+    if "target_date" in campaign:
+        # A one-off campaign for a single date
+        release_time = release_time_for(campaign, campaign["target_date"])
+        return (release_time, datetime.date.fromisoformat(campaign["target_date"])) if release_time > after else None
+    for days in range(HORIZON_DAYS + prio_days + 1):
+        target_date = after.date() + datetime.timedelta(days=days)
+        if target_date.weekday() not in campaign["target_days"]:
+            continue
+        release_time = calculate_release_time(target_date.strftime("%Y-%m-%d"), prio_days)
+        if release_time > after:
+            return release_time, target_date
+    return None
+
+
+class CampaignDaemon:
+    """Runs every campaign of a config file at its release instants, reloading the file when it changes."""
+
+    def __init__(self, config_path=CONFIG_FILE, mode="threaded", clock=SYSTEM_CLOCK):
+        self.config_path = config_path
+        self.mode = mode
+        self.clock = clock
+        self.config = None
+        self.config_mtime = None
+        self.campaigns = {}
+        self.queue = []  # Heap of (release_time, sequence, campaign name, target_date)
+        self.sequence = itertools.count()
+        self.running = {}  # (campaign name, target_date) -> run thread
+        self.lock = threading.Lock()
+        self.browser_pool = None
+
+    def reload_if_changed(self):
+        """Load the config file if it changed since the last load; a broken file keeps the previous config."""
+        mtime = os.path.getmtime(self.config_path)
+        if mtime == self.config_mtime:
+            return False
+        self.config_mtime = mtime
+        try:
+            with open(self.config_path, "r") as f:
+                config = json.load(f)
+            campaigns = load_campaigns(config)
+        except (OSError, ValueError, KeyError) as e:
+            if self.config is None:
+                raise
+            log(None, f"Could not reload {self.config_path}, keeping the previous campaigns: {e}", logging.ERROR)
+            return False
+        with self.lock:
+            self.config = config
+            self.campaigns = campaigns
+            configure_urls(config)
+            self._schedule_all()
+        log(None, f"Loaded {len(campaigns)} campaigns from {self.config_path}.")
+        for release_time, _, name, target_date in sorted(self.queue):
+            log(name, f"Next release {release_time} for {target_date}")
+        return True
+
+    def _schedule_all(self):
+        self.queue = []
+        now = self.clock.now()
+        for name in self.campaigns:
+            self._schedule(name, now)
+
+    def _schedule(self, name, after):
+        """Queue the campaign's next release after the given time that isn't already running."""
+        upcoming = next_release(self.campaigns[name], after)
+        while upcoming is not None and (name, upcoming[1]) in self.running:
+            upcoming = next_release(self.campaigns[name], upcoming[0])
+        if upcoming is not None:
+            heapq.heappush(self.queue, (upcoming[0], next(self.sequence), name, upcoming[1]))
+
+    def _lead(self, name):
+        return datetime.timedelta(seconds=self.campaigns[name].get("campaign_lead_seconds", LEAD_SECONDS))
+
+    def _pool(self):
+        """The daemon's browser pool, kept open between runs, if browser_pool or browser_contexts is set."""
+        if not (self.config.get("browser_pool", False) or self.config.get("browser_contexts", False)):
+            return None
+        with self.lock:
+            if self.browser_pool is None:
+                pool_class = BrowserContextPool if self.config.get("browser_contexts", False) else BrowserPool
+                self.browser_pool = pool_class(self.config.get("browser_pool_spares", 1), config=self.config, keep_sessions=True)
+                self.browser_pool.start_monitor()
+            return self.browser_pool
+
+    def _launch(self, name, target_date):
+        """Start a campaign run on its own thread; must be called with the lock held."""
+        if not self.running:
+            # Per-process timing reports start afresh once no other run is in progress
+            TRACE.clear()
+            WAIT_STATS.clear()
+        thread = threading.Thread(target=self._run, args=(name, self.campaigns[name], target_date), name=f"campaign-{name}", daemon=True)
+        self.running[(name, target_date)] = thread
+        thread.start()
+
+    def _run(self, name, campaign, target_date):
+        log(name, f"Run for {target_date} started.")
+        try:
+            results = run_all_bookings(campaign, self.mode, self.clock, target_date, self._pool()) or []
+            wins = sum(1 for result in results if result["status"] == "Success")
+            log(name, f"Run for {target_date} finished: {wins} of {len(results)} attempts won.")
+        except Exception:
+            error_message = traceback.format_exc()
+            log(name, f"Run for {target_date} failed: {error_message}", logging.ERROR)
+            notify_error(campaign, name, error_message)
+        finally:
+            with self.lock:
+                self.running.pop((name, target_date), None)
+
+    def run_forever(self):
+        """Start runs as their lead time arrives, checking the config file for changes in between."""
+        while True:
+            self.reload_if_changed()
+            now = self.clock.now()
+            with self.lock:
+                while self.queue and self.queue[0][0] - self._lead(self.queue[0][2]) <= now:
+                    release_time, _, name, target_date = heapq.heappop(self.queue)
+                    self._launch(name, target_date)
+                    self._schedule(name, release_time)
+                wait = RELOAD_CHECK_SECONDS
+                if self.queue:
+                    next_start = self.queue[0][0] - self._lead(self.queue[0][2])
+                    wait = min(wait, max((next_start - now).total_seconds(), 0))
+            self.clock.sleep(wait)
+
+    def close(self):
+        if self.browser_pool is not None:
+            self.browser_pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run booking campaigns at every release instant.")
+    parser.add_argument("--config", default=CONFIG_FILE)
+    parser.add_argument("--mode", choices=["threaded", "async", "sharded"], default="threaded")
+    args = parser.parse_args()
+
+    daemon = CampaignDaemon(args.config, args.mode)
+    with open(args.config, "r") as f:
+        print(f"Logging to {start_logging(json.load(f))}")  # Before the first reload logs anything
+    daemon.reload_if_changed()
+    try:
+        daemon.run_forever()
+    except KeyboardInterrupt:
+        log(None, "Stopping; runs in progress are abandoned.")
+    finally:
+        daemon.close()
+        stop_notifications()
+        stop_logging()
@@ -0,0 +1,86 @@
+import asyncio
+import datetime
+import threading
+import time
+
+SPIN_SECONDS = 0.002  # Busy-wait this long before a precise deadline instead of trusting sleep()
+COARSE_SLEEP_MARGIN = 0.02  # Wake this long before the spin window to absorb sleep() overshoot
+MAX_SLEEP_CHUNK = 60  # seconds
+
+
+class SystemClock:
+    """The real wall and monotonic clocks."""
+
+    def now(self):
+        return datetime.datetime.now()
+
+    def today(self):
+        return datetime.date.today()
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    async def async_sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+    def sleep_until(self, deadline):
+        """Sleep until the monotonic deadline, coarse first and then spinning for the last moments."""
+        while True:
+            remaining = deadline - time.monotonic() - SPIN_SECONDS - COARSE_SLEEP_MARGIN
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, MAX_SLEEP_CHUNK))
+        while time.monotonic() < deadline:
+            if deadline - time.monotonic() > SPIN_SECONDS:
+                time.sleep(0.0005)
+
+
+class SimulatedClock:
+    """
+    Virtual clock for exercising the scheduling logic: sleeping advances time instantly, so a wait for
+    release night returns at once. Monotonic time starts at 0 when the clock is created.
+    """
+
+    def __init__(self, start):
+        self.lock = threading.Lock()
+        self.start = start
+        self.elapsed = 0.0
+
+    def advance(self, seconds):
+        with self.lock:
+            self.elapsed += max(seconds, 0)
+
+    def set(self, moment):
+        """Jump to a datetime; never moves backwards."""
+        self.advance((moment - self.now()).total_seconds())
+
+    def now(self):
+        return self.start + datetime.timedelta(seconds=self.elapsed)
+
+    def today(self):
+        return self.now().date()
+
+    def time(self):
+        return self.now().timestamp()
+
+    def monotonic(self):
+        return self.elapsed
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    async def async_sleep(self, seconds):
+        self.advance(seconds)
+        await asyncio.sleep(0)
+
+    def sleep_until(self, deadline):
+        self.advance(deadline - self.elapsed)
+
+
+SYSTEM_CLOCK = SystemClock()
@@ -1,44 +1,30 @@
 import datetime
 import os
-import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
 
-def send_email(smtp_server, smtp_port, sender_email, sender_username, sender_password, recipient_emails, subject, html_content, attachment_path=None):
-    """Send an email with the booking summary using SendGrid SMTP."""
-    try:
-        # Set up the SMTP server
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(sender_username, sender_password)
+def build_message(sender_email, recipient_emails, subject, content, subtype="html", attachment_path=None):
+    """Build an email with an HTML (or plain text) body and an optional attachment."""
+    msg = MIMEMultipart()
+    msg['From'] = sender_email
+    msg['To'] = ", ".join(recipient_emails)
+    msg['Subject'] = subject
+    msg.attach(MIMEText(content, subtype))
 
-        # Create the email
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = ", ".join(recipient_emails)
-        msg['Subject'] = subject
-        msg.attach(MIMEText(html_content, 'html'))
-
-        # Attach the .ics file if provided
-        if attachment_path:
-            with open(attachment_path, "rb") as attachment:
-                part = MIMEBase("application", "octet-stream")
-                part.set_payload(attachment.read())
-                encoders.encode_base64(part)
-                part.add_header(
-                    "Content-Disposition",
-                    f"attachment; filename={os.path.basename(attachment_path)}",
-                )
-                msg.attach(part)
-
-        # Send the email
-        server.sendmail(sender_email, recipient_emails, msg.as_string())
-        server.quit()
-        print("Email sent successfully!")
-    except Exception as e:
-        print(f"Failed to send email: {e}")
+    # Attach the .ics file if provided
+    if attachment_path:
+        with open(attachment_path, "rb") as attachment:
+            part = MIMEBase("application", "octet-stream")
+            part.set_payload(attachment.read())
+            encoders.encode_base64(part)
+            part.add_header(
+                "Content-Disposition",
+                f"attachment; filename={os.path.basename(attachment_path)}",
+            )
+            msg.attach(part)
+    return msg
 
 def generate_html_email(summary_results):
     """Generate a HTML email template for the booking summary."""
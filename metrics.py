@@ -0,0 +1,191 @@
+"""
+Live metrics in the Prometheus text format, served on a local port while a booking run is in progress:
+
+    curl http://127.0.0.1:9108/metrics
+
+Gauges are read when the endpoint is scraped: current phases from the phase tracer, browsers from the
+live browser pools, clock skew and wake jitter from the release schedulers. Counters and histograms
+(logins, phase durations, attempt outcomes) are kept here as spans and attempts finish, so they keep
+counting across the daemon's runs while the per-run reports start afresh.
+"""
+import os
+import threading
+import time
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from booking_log import log
+from phase_trace import TRACE
+
+METRICS_HOST = "127.0.0.1"
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # seconds
+LOGIN_PHASE = "authenticate"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    """Render a label set, escaping values as the text format requires."""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def process_rss_bytes():
+    """Resident memory of this process, or None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MetricsRegistry:
+    """Process-wide metrics: attempt outcome counters plus the live pools and schedulers read on every scrape."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.outcomes = {}  # (slot, amenity_name, status) -> attempts
+        self.logins = {"ok": 0, "error": 0}
+        self.durations = {}  # phase -> [count per bucket of DURATION_BUCKETS, sum, count]
+        self.pools = weakref.WeakSet()
+        self.schedulers = weakref.WeakSet()
+        self.server = None
+        self.serving = 0  # Runs currently using the endpoint
+
+    def track_pool(self, pool):
+        self.pools.add(pool)
+
+    def track_scheduler(self, scheduler):
+        self.schedulers.add(scheduler)
+
+    def record_span(self, span):
+        """Phase tracer listener: count a finished span in its phase's histogram (and logins)."""
+        phase, _, _, start, end, ok = span
+        duration = end - start
+        with self.lock:
+            buckets, total, count = self.durations.get(phase) or ([0] * len(DURATION_BUCKETS), 0.0, 0)
+            buckets = [bucket + (duration <= bound) for bucket, bound in zip(buckets, DURATION_BUCKETS)]
+            self.durations[phase] = (buckets, total + duration, count + 1)
+            if phase == LOGIN_PHASE:
+                self.logins["ok" if ok else "error"] += 1
+
+    def count_outcome(self, result):
+        key = (result["time"], result["amenity_name"], result["status"])
+        with self.lock:
+            self.outcomes[key] = self.outcomes.get(key, 0) + 1
+
+    def serve(self, port, host=METRICS_HOST):
+        """
+        Start the endpoint, or join the one an overlapping run already started. Returns False if the port
+        can't be bound (the run goes on without metrics); otherwise pair it with stop().
+        """
+        with self.lock:
+            if self.server is not None:
+                self.serving += 1
+                return True
+            try:
+                self.server = ThreadingHTTPServer((host, port), self._handler_class())
+            except OSError as e:
+                log(None, f"Metrics endpoint unavailable on {host}:{port}: {e}")
+                return False
+            self.serving += 1
+            self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+        log(None, f"Serving metrics on http://{host}:{self.server.server_address[1]}/metrics")
+        return True
+
+    def stop(self):
+        """Stop the endpoint once the last run using it is done."""
+        with self.lock:
+            self.serving -= 1
+            if self.serving > 0 or self.server is None:
+                return
+            server, self.server = self.server, None
+        server.shutdown()
+        server.server_close()
+
+    def render(self):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{_labels(**labels)} {value}")
+
+        with TRACE.lock:
+            active = list(TRACE.active)
+        now = time.monotonic()
+
+        pools = sorted(self.pools, key=id)
+        metric("booking_browsers_idle", "gauge", "Launched browsers waiting in a pool for a user.",
+               [("", {"pool": index}, pool.idle.qsize()) for index, pool in enumerate(pools)])
+        metric("booking_browsers_logged_in", "gauge", "Pooled browsers logged in and ready for their user.",
+               [("", {"pool": index}, len(pool.prepared)) for index, pool in enumerate(pools)])
+
+        with self.lock:
+            logins = dict(self.logins)
+            durations = sorted(self.durations.items())
+            outcomes = sorted(self.outcomes.items())
+        metric("booking_logins_total", "counter", "Completed logins (including restored sessions).",
+               [("", {"outcome": outcome}, count) for outcome, count in logins.items()])
+
+        current = {}
+        for phase, username, _, start in active:
+            if username is not None and (username not in current or start >= current[username][1]):
+                current[username] = (phase, start)  # The innermost span is the latest to start
+        metric("booking_worker_phase_seconds", "gauge", "Seconds each worker has spent in the phase it is in now.",
+               [("", {"user": username, "phase": phase}, round(now - start, 3)) for username, (phase, start) in sorted(current.items())])
+
+        histogram = []
+        for phase, (buckets, total, count) in durations:
+            for bound, bucket in zip(DURATION_BUCKETS, buckets):
+                histogram.append(("_bucket", {"phase": phase, "le": bound}, bucket))
+            histogram.append(("_bucket", {"phase": phase, "le": "+Inf"}, count))
+            histogram.append(("_sum", {"phase": phase}, round(total, 6)))
+            histogram.append(("_count", {"phase": phase}, count))
+        metric("booking_phase_duration_seconds", "histogram", "Duration of finished booking phases.", histogram)
+
+        metric("booking_attempts_total", "counter", "Finished attempts by slot, amenity and outcome.",
+               [("", {"slot": slot, "amenity": amenity, "status": status}, count) for (slot, amenity, status), count in outcomes])
+
+        schedulers = sorted(self.schedulers, key=lambda scheduler: scheduler.release_time)
+        metric("booking_clock_skew_seconds", "gauge", "Measured server clock minus local clock.",
+               [("", {"release": scheduler.release_time.isoformat()}, round(scheduler.offset, 6)) for scheduler in schedulers])
+        metric("booking_seconds_until_fire", "gauge", "Seconds until the fire instant (negative once fired).",
+               [("", {"release": scheduler.release_time.isoformat()}, round(scheduler.seconds_until_fire(), 3)) for scheduler in schedulers])
+        metric("booking_wake_jitter_seconds", "gauge", "How late each worker woke after the fire instant.",
+               [("", {"release": scheduler.release_time.isoformat(), "worker": worker}, round(jitter, 6))
+                for scheduler in schedulers for worker, jitter in sorted(scheduler.jitters.items())])
+
+        rss = process_rss_bytes()
+        if rss is not None:
+            metric("process_resident_memory_bytes", "gauge", "Resident memory of the booking process.", [("", {}, rss)])
+        return "\n".join(lines) + "\n"
+
+    def _handler_class(self):
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                payload = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+
+METRICS = MetricsRegistry()
+TRACE.add_listener(METRICS.record_span)
@@ -0,0 +1,353 @@
+"""
+Local stand-in for BuildingLink's login and reservation pages, used to exercise the booking code offline.
+
+    python mock_buildinglink.py --port 8080 --require-login --capacity 1 --latency 0.05
+    python mock_buildinglink.py --port 8080 --error-rate 0.2 --lost-rate 0.2
+
+Then set "base_url" to http://127.0.0.1:8080 and "auth_url" to http://localhost:8080 in booking_config.json.
+"""
+import argparse
+import datetime
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from string import Template
+from urllib.parse import parse_qs, urlparse
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+RESERVATION_PATH = "/V2/Tenant/Amenities/NewReservation.aspx"
+LOGIN_PATH = "/Account/Login"
+HOME_PATH = "/V2/Tenant/Home/DefaultNew.aspx"
+RESERVATIONS_PATH = "/V2/Tenant/Amenities/MyReservations.aspx"
+SUCCESS_HEADER = '<div id="ThePageHeaderWrap"><h1>Reservation has been made successfully!</h1></div>'
+HOME_PAGE = "<!DOCTYPE html><html><head><title>Home</title></head><body><h1>Welcome</h1></body></html>"
+SERVER_ERROR_PAGE = "<!DOCTYPE html><html><head><title>Runtime Error</title></head><body><h1>Server Error in '/' Application.</h1></body></html>"
+ALLOCATION_ERROR = "The time slot you selected is no longer available."
+END_BEFORE_START_ERROR = "End time must be greater than start time"
+INVALID_STATE_ERROR = "The state information is invalid for this page and might be corrupted."
+UNAVAILABLE_MESSAGE = "This Amenity is currently unavailable on the selected date."
+LOGIN_ERROR = "Please enter your username and password."
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURE_DIR, name), "r") as f:
+        return Template(f.read())
+
+
+def picker_options(target_date, start_hour=6, end_hour=24, taken=()):
+    """Render the half-hourly RadTimePicker option anchors, leaving out the taken values."""
+    rows = []
+    day = datetime.datetime.strptime(target_date, "%Y-%m-%d")
+    for minutes in range(start_hour * 60, end_hour * 60, 30):
+        slot = day + datetime.timedelta(minutes=minutes)
+        if slot.strftime("%Y-%m-%d-%H-%M-%S") in taken:
+            continue
+        label = slot.strftime("%I:%M %p").lstrip("0")
+        rows.append(f'<tr><td><a href="#" data-value="{slot.strftime("%Y-%m-%d-%H-%M-%S")}">{label}</a></td></tr>')
+    return "\n".join(rows)
+
+
+class _StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that only read headers (clock probes, keep-alive pings) drop the connection early
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+class MockBuildingLink:
+    """
+    In-process HTTP stand-in for the login page and NewReservation.aspx.
+
+    Dates open at release_at (epoch seconds on the stand-in's clock); before that the page shows the
+    "currently unavailable" panel. Only the first `capacity` submits per slot succeed; fully booked
+    start times are left out of the start picker. Every response is
+    delayed by `latency` seconds plus up to `jitter` seconds. With require_login, the reservation page
+    redirects to the login page unless the request carries a logged-in session cookie.
+
+    A share `error_rate` of reservation postbacks fails with HTTP 500 before it is applied, and a
+    share `lost_rate` is applied (the slot is booked) but answered with HTTP 500 all the same.
+    MyReservations.aspx lists the slots the logged-in user has won.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, clock_skew=0.0, release_at=None, capacity=1, latency=0.0, jitter=0.0,
+                 require_login=False, error_rate=0.0, lost_rate=0.0):
+        self.clock_skew = clock_skew  # Seconds the stand-in's clock runs ahead of ours
+        self.release_at = release_at
+        self.capacity = capacity
+        self.latency = latency
+        self.jitter = jitter
+        self.require_login = require_login
+        self.error_rate = error_rate
+        self.lost_rate = lost_rate
+        self.template = load_fixture("new_reservation.html")
+        self.login_template = load_fixture("login.html")
+        self.reservations_template = load_fixture("my_reservations.html")
+        self.lock = threading.Lock()
+        self.tokens = set()  # Issued (viewstate, eventvalidation) pairs
+        self.tickets = {}  # One-time login ticket -> username
+        self.sessions = {}  # Logged-in session id -> username
+        self.bookings = {}  # (amenity_id, date, start) -> session ids that won it, in order
+        self.submits = []  # (username, amenity_id, start, outcome, seconds after release) per reservation postback
+        self.server = _StandInServer((host, port), self._handler_class())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def auth_url(self):
+        # Served by the same server under another host name, so auth and site cookies stay apart as they do live
+        return f"http://localhost:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def server_time(self):
+        return time.time() + self.clock_skew
+
+    def is_open(self):
+        return self.release_at is None or self.server_time() >= self.release_at
+
+    def render(self, amenity_id, target_date, validation_summary="", allocation_error="", success=False):
+        viewstate, eventvalidation = secrets.token_urlsafe(48), secrets.token_urlsafe(24)
+        with self.lock:
+            self.tokens.add((viewstate, eventvalidation))
+            taken = {key[2] for key, winners in self.bookings.items()
+                     if key[:2] == (amenity_id, target_date) and len(winners) >= self.capacity}
+        is_open = self.is_open()
+        return self.template.safe_substitute(
+            amenity_id=amenity_id,
+            target_date=target_date,
+            viewstate=viewstate,
+            eventvalidation=eventvalidation,
+            page_header=SUCCESS_HEADER if success else "",
+            validation_summary=validation_summary,
+            allocation_error=allocation_error,
+            unavailable_message="" if is_open else UNAVAILABLE_MESSAGE,
+            start_options=picker_options(target_date, taken=taken) if is_open else "",
+            end_options=picker_options(target_date, start_hour=7, end_hour=25) if is_open else "",
+        )
+
+    def render_reservations(self, session_id):
+        """The reservation list of the user behind a session: every slot any of the user's sessions won."""
+        with self.lock:
+            username = self.sessions.get(session_id)
+            won = sorted(key for key, winners in self.bookings.items()
+                         if any(winner == session_id or (username and self.sessions.get(winner) == username) for winner in winners))
+        rows = []
+        for amenity_id, target_date, start in won:
+            slot = datetime.datetime.strptime(start, "%Y-%m-%d-%H-%M-%S")
+            start_label = slot.strftime("%I:%M %p").lstrip("0")
+            end_label = (slot + datetime.timedelta(hours=1)).strftime("%I:%M %p").lstrip("0")
+            rows.append(f'<tr><td><a href="NewReservation.aspx?amenityId={amenity_id}&amp;from=0&amp;selectedDate={target_date}">'
+                        f'Amenity {amenity_id}</a></td><td>{slot.month}/{slot.day}/{slot.year}</td><td>{start_label} - {end_label}</td></tr>')
+        return self.reservations_template.safe_substitute(rows="\n".join(rows))
+
+    def fault(self):
+        """Pick the injected fault for a reservation postback: "error", "lost" or None."""
+        draw = random.random()
+        if draw < self.error_rate:
+            return "error"
+        if draw < self.error_rate + self.lost_rate:
+            return "lost"
+        return None
+
+    def render_login(self, login_date, error=""):
+        return self.login_template.safe_substitute(login_date=login_date, login_error=error)
+
+    def submit(self, amenity_id, target_date, form, session_id):
+        """Apply a reservation postback and return the rendered response page."""
+        token = (form.get("__VIEWSTATE", ""), form.get("__EVENTVALIDATION", ""))
+        start = form.get("ctl00$ContentPlaceHolder1$StartTimePicker", "")
+        end = form.get("ctl00$ContentPlaceHolder1$EndTimePicker", "")
+        with self.lock:
+            outcome = self._apply_submit(token, (amenity_id, target_date, start), end, session_id)
+        if outcome == "success":
+            return self.render(amenity_id, target_date, success=True)
+        if outcome == "taken":
+            return self.render(amenity_id, target_date, allocation_error=ALLOCATION_ERROR)
+        return self.render(amenity_id, target_date, validation_summary=outcome)
+
+    def _apply_submit(self, token, key, end, session_id):
+        """Decide a submit's outcome and record it; must be called with the lock held."""
+        outcome = self._decide_submit(token, key, end, session_id)
+        since_release = self.server_time() - self.release_at if self.release_at is not None else None
+        self.submits.append((self.sessions.get(session_id), key[0], key[2], outcome, since_release))
+        return outcome
+
+    def _decide_submit(self, token, key, end, session_id):
+        if token not in self.tokens:
+            return INVALID_STATE_ERROR
+        self.tokens.discard(token)
+        if not self.is_open():
+            return UNAVAILABLE_MESSAGE
+        start = key[2]
+        if not start or not end or end <= start:
+            return END_BEFORE_START_ERROR
+        winners = self.bookings.setdefault(key, [])
+        if len(winners) >= self.capacity or session_id in winners:
+            return "taken"
+        winners.append(session_id)
+        return "success"
+
+    def login(self, username, password):
+        """Check credentials and return a one-time ticket for the site, or None."""
+        if not username or not password:
+            return None
+        ticket = secrets.token_urlsafe(16)
+        with self.lock:
+            self.tickets[ticket] = username
+        return ticket
+
+    def redeem_ticket(self, ticket):
+        """Turn a login ticket into a logged-in session id."""
+        with self.lock:
+            username = self.tickets.pop(ticket, None)
+            if username is None:
+                return None
+            session_id = secrets.token_hex(8)
+            self.sessions[session_id] = username
+        return session_id
+
+    def wins(self):
+        """Return {username: number of slots won}."""
+        with self.lock:
+            winners = [session_id for sessions in self.bookings.values() for session_id in sessions]
+            return {self.sessions.get(session_id): winners.count(session_id) for session_id in set(winners)}
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def date_time_string(self, timestamp=None):
+                return super().date_time_string(mock.server_time() if timestamp is None else timestamp)
+
+            def _session_id(self):
+                cookie = self.headers.get("Cookie", "")
+                for part in cookie.split(";"):
+                    name, _, value = part.strip().partition("=")
+                    if name == "MockSession":
+                        return value
+                return None
+
+            def _delay(self):
+                if mock.latency or mock.jitter:
+                    time.sleep(mock.latency + random.uniform(0, mock.jitter))
+
+            def _send_html(self, body, status=200, session_id=None):
+                payload = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                if session_id:
+                    self.send_header("Set-Cookie", f"MockSession={session_id}; Path=/")
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _redirect(self, location):
+                self.send_response(302)
+                self.send_header("Location", location)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def _logged_in(self):
+                return not mock.require_login or self._session_id() in mock.sessions
+
+            def _read_form(self):
+                length = int(self.headers.get("Content-Length", 0))
+                return {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode("utf-8"), keep_blank_values=True).items()}
+
+            def do_GET(self):
+                self._delay()
+                parsed = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                if parsed.path == LOGIN_PATH:
+                    self._send_html(mock.render_login(query.get("selectedDate", "")))
+                elif parsed.path == HOME_PATH:
+                    session_id = mock.redeem_ticket(query.get("ticket", ""))
+                    if session_id is None and not self._logged_in():
+                        self._redirect(f"{mock.auth_url}{LOGIN_PATH}")
+                        return
+                    self._send_html(HOME_PAGE, session_id=session_id)
+                elif parsed.path == RESERVATION_PATH:
+                    if not self._logged_in():
+                        self._redirect(f"{mock.auth_url}{LOGIN_PATH}")
+                        return
+                    session_id = self._session_id() or secrets.token_hex(8)
+                    self._send_html(mock.render(query.get("amenityId", ""), query.get("selectedDate", "")), session_id=session_id)
+                elif parsed.path == RESERVATIONS_PATH:
+                    if not self._logged_in():
+                        self._redirect(f"{mock.auth_url}{LOGIN_PATH}")
+                        return
+                    self._send_html(mock.render_reservations(self._session_id()))
+                else:
+                    self._send_html("<html><body>Not found</body></html>", status=404)
+
+            def do_POST(self):
+                self._delay()
+                parsed = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                form = self._read_form()
+                if parsed.path == LOGIN_PATH:
+                    ticket = mock.login(form.get("Username", ""), form.get("Password", ""))
+                    if ticket is None:
+                        self._send_html(mock.render_login(query.get("selectedDate", ""), LOGIN_ERROR))
+                    else:
+                        self._redirect(f"{mock.url}{HOME_PATH}?ticket={ticket}")
+                elif parsed.path == RESERVATION_PATH:
+                    if not self._logged_in():
+                        self._redirect(f"{mock.auth_url}{LOGIN_PATH}")
+                        return
+                    fault = mock.fault()
+                    if fault == "error":
+                        self._send_html(SERVER_ERROR_PAGE, status=500)
+                        return
+                    page = mock.submit(query.get("amenityId", ""), query.get("selectedDate", ""), form, self._session_id())
+                    self._send_html(SERVER_ERROR_PAGE if fault == "lost" else page, status=500 if fault == "lost" else 200)
+                else:
+                    self._send_html("<html><body>Not found</body></html>", status=404)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local BuildingLink stand-in.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--clock-skew", type=float, default=0.0, help="Seconds the stand-in's Date header runs ahead.")
+    parser.add_argument("--release-in", type=float, help="Open dates this many seconds after startup.")
+    parser.add_argument("--capacity", type=int, default=1, help="Submits that succeed per slot.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra seconds per response.")
+    parser.add_argument("--require-login", action="store_true", help="Redirect to the login page without a session.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of reservation postbacks failing with HTTP 500.")
+    parser.add_argument("--lost-rate", type=float, default=0.0, help="Share of reservation postbacks applied but answered with HTTP 500.")
+    args = parser.parse_args()
+    release_at = time.time() + args.clock_skew + args.release_in if args.release_in is not None else None
+    mock = MockBuildingLink(args.host, args.port, clock_skew=args.clock_skew, release_at=release_at, capacity=args.capacity,
+                            latency=args.latency, jitter=args.jitter, require_login=args.require_login,
+                            error_rate=args.error_rate, lost_rate=args.lost_rate)
+    print(f"Serving BuildingLink stand-in on {mock.url} (auth_url {mock.auth_url})")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        mock.stop()
@@ -0,0 +1,153 @@
+"""
+Local SMTP stand-in for trying the notifications without a real mail server.
+
+    python mock_smtp.py --port 2525 --latency 0.2
+
+It accepts any login, keeps every message in memory and prints one line per message. STARTTLS is
+only offered when --tls-cert and --tls-key are given; otherwise set "smtp_starttls": false.
+"""
+import argparse
+import email
+import socketserver
+import ssl
+import threading
+import time
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    """Just enough of SMTP for smtplib: EHLO, STARTTLS, AUTH PLAIN/LOGIN, MAIL, RCPT, DATA, RSET, NOOP, QUIT."""
+
+    def reply(self, code, *lines):
+        lines = lines or ("OK",)
+        text = "".join(f"{code}{'-' if index < len(lines) - 1 else ' '}{line}\r\n" for index, line in enumerate(lines))
+        self.wfile.write(text.encode())
+
+    def read_line(self):
+        return self.rfile.readline().decode("utf-8", "replace").rstrip("\r\n")
+
+    def handle(self):
+        mock = self.server.mock
+        mock.count_connection()
+        tls_active = False
+        mail_from, recipients = None, []
+        self.reply(220, "mock-smtp ready")
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return  # Client went away
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            command, _, argument = line.partition(" ")
+            command = command.upper()
+            time.sleep(mock.latency)
+            if command in ("EHLO", "HELO"):
+                features = ["mock-smtp", "AUTH PLAIN LOGIN"]
+                if mock.tls_context is not None and not tls_active:
+                    features.append("STARTTLS")
+                self.reply(250, *features)
+            elif command == "STARTTLS" and mock.tls_context is not None and not tls_active:
+                self.reply(220, "Ready to start TLS")
+                self.connection = mock.tls_context.wrap_socket(self.connection, server_side=True)
+                self.rfile = self.connection.makefile("rb")
+                self.wfile = self.connection.makefile("wb", buffering=0)
+                tls_active = True
+            elif command == "AUTH":
+                mechanism, _, initial = argument.partition(" ")
+                if mechanism.upper() == "LOGIN":
+                    self.reply(334, "VXNlcm5hbWU6")
+                    self.read_line()
+                    self.reply(334, "UGFzc3dvcmQ6")
+                    self.read_line()
+                elif not initial:
+                    self.reply(334, "")
+                    self.read_line()
+                self.reply(235, "Authentication successful")
+            elif command == "MAIL":
+                mail_from, recipients = argument.partition(":")[2].strip(), []
+                self.reply(250)
+            elif command == "RCPT":
+                recipients.append(argument.partition(":")[2].strip())
+                self.reply(250)
+            elif command == "DATA":
+                self.reply(354, "End data with <CR><LF>.<CR><LF>")
+                data = []
+                while True:
+                    raw = self.rfile.readline()
+                    if not raw or raw in (b".\r\n", b".\n"):
+                        break
+                    data.append(raw[1:] if raw.startswith(b"..") else raw)
+                mock.store(mail_from, recipients, email.message_from_bytes(b"".join(data)))
+                mail_from, recipients = None, []
+                self.reply(250, "Message accepted")
+            elif command == "RSET":
+                mail_from, recipients = None, []
+                self.reply(250)
+            elif command == "NOOP":
+                self.reply(250)
+            elif command == "QUIT":
+                self.reply(221, "Bye")
+                return
+            else:
+                self.reply(502, "Command not implemented")
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MockSmtp:
+    """Threaded SMTP stand-in that records every message; each command is delayed by latency seconds."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, tls_cert=None, tls_key=None):
+        self.latency = latency
+        self.tls_context = None
+        if tls_cert:
+            self.tls_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            self.tls_context.load_cert_chain(tls_cert, tls_key)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []  # (mail_from, recipients, email.message.Message)
+        self.server = _Server((host, port), _SmtpHandler)
+        self.server.mock = self
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def count_connection(self):
+        with self.lock:
+            self.connections += 1
+
+    def store(self, mail_from, recipients, message):
+        with self.lock:
+            self.messages.append((mail_from, recipients, message))
+        print(f"[mock-smtp] {mail_from} -> {', '.join(recipients)}: {message['Subject']}")
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock-smtp", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local SMTP stand-in for the booking notifications.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every SMTP command.")
+    parser.add_argument("--tls-cert", help="Certificate (PEM) to offer STARTTLS with.")
+    parser.add_argument("--tls-key", help="Private key (PEM) for --tls-cert.")
+    args = parser.parse_args()
+
+    mock = MockSmtp(args.host, args.port, args.latency, args.tls_cert, args.tls_key)
+    print(f"SMTP stand-in on {args.host}:{mock.port}{' with STARTTLS' if mock.tls_context else ''}. Ctrl+C to stop.")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock.server.server_close()
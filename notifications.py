@@ -0,0 +1,225 @@
+"""
+Background email notifications for booking runs.
+
+Booking threads only enqueue; one sender thread delivers everything over a single reused SMTP
+connection. Error notices are held for error_digest_seconds and sent as one digest, and every won
+slot is announced as soon as it is booked.
+"""
+import atexit
+import datetime
+import logging
+import queue
+import smtplib
+import threading
+import time
+from booking_log import log
+from email_utils import build_message
+
+ERROR_DIGEST_SECONDS = 30
+SMTP_IDLE_SECONDS = 60  # Close the connection after this long unused; servers drop idle clients anyway
+SMTP_TIMEOUT = 30
+SEND_ATTEMPTS = 2  # A stale connection is replaced once before a message counts as failed
+FLUSH_TIMEOUT = 120  # seconds flush waits for the sender before giving up on it
+
+# Config keys a notifier is built from; configs that differ in any of them get notifiers of their own
+NOTIFIER_KEYS = ("smtp_server", "smtp_port", "smtp_timeout", "smtp_starttls", "sender_username", "sender_password",
+                 "sender_email", "recipient_emails", "error_digest_seconds", "smtp_idle_seconds")
+
+_notifiers = {}
+_notifiers_lock = threading.Lock()
+
+
+class Notifier:
+    """A queue of outgoing emails drained by one sender thread over a reused SMTP connection."""
+
+    def __init__(self, config):
+        self.config = config
+        self.queue = queue.Queue()
+        self.digest_seconds = config.get("error_digest_seconds", ERROR_DIGEST_SECONDS)
+        self.errors = []  # (timestamp, username, message) waiting for the next digest
+        self.digest_due = None
+        self.server = None
+        self.last_used = 0.0
+        self.connections = 0
+        self.sent = 0
+        self.failed = 0
+        self.thread = threading.Thread(target=self._run, name="notifier", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def send(self, subject, content, subtype="html", attachment_path=None):
+        """Queue an email to the recipients; the attachment is read now, not at delivery."""
+        msg = build_message(self.config["sender_email"], self.config["recipient_emails"], subject, content, subtype, attachment_path)
+        self.queue.put(("message", msg))
+
+    def error(self, username, message):
+        """Queue an error notice for the next digest."""
+        self.queue.put(("error", (datetime.datetime.now(), username, message)))
+
+    def success(self, result, target_date):
+        """Queue a notice for one won slot."""
+        subject = f"Booked {result['amenity_name']} on {target_date} at {result['time']}"
+        self.send(subject, f"{result['username']} booked {result['amenity_name']} on {target_date} at {result['time']}.", "plain")
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """
+        Send any pending error digest and block until everything queued so far is delivered. Returns
+        False, without waiting further, once the sender thread has died or the timeout has passed.
+        """
+        done = threading.Event()
+        self.queue.put(("flush", done))
+        deadline = time.monotonic() + timeout
+        while not done.wait(min(1, max(deadline - time.monotonic(), 0))):
+            if not self.thread.is_alive() or time.monotonic() >= deadline:
+                log(None, f"Emails still queued after flush: {self.queue.qsize()} (sender thread {'running' if self.thread.is_alive() else 'dead'}).", logging.ERROR)
+                return False
+        return True
+
+    def stop(self):
+        """Deliver everything still queued, close the connection and end the sender thread."""
+        self.queue.put(("stop", None))
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                kind, item = self.queue.get(timeout=self._next_timeout())
+            except queue.Empty:
+                kind, item = None, None
+            if kind == "message":
+                self._deliver(item)
+            elif kind == "error":
+                self.errors.append(item)
+                if self.digest_due is None:
+                    self.digest_due = time.monotonic() + self.digest_seconds
+            elif kind in ("flush", "stop"):
+                self._send_digest()
+                if kind == "stop":
+                    self._close()
+                    return
+                item.set()
+            if self.digest_due is not None and time.monotonic() >= self.digest_due:
+                self._send_digest()
+            if self.server is not None and time.monotonic() - self.last_used > self.config.get("smtp_idle_seconds", SMTP_IDLE_SECONDS):
+                self._close()
+
+    def _next_timeout(self):
+        now = time.monotonic()
+        deadlines = []
+        if self.digest_due is not None:
+            deadlines.append(self.digest_due)
+        if self.server is not None:
+            deadlines.append(self.last_used + self.config.get("smtp_idle_seconds", SMTP_IDLE_SECONDS))
+        return max(min(deadlines) - now, 0) if deadlines else None
+
+    def _connection(self):
+        if self.server is None:
+            server = smtplib.SMTP(self.config["smtp_server"], self.config["smtp_port"], timeout=self.config.get("smtp_timeout", SMTP_TIMEOUT))
+            if self.config.get("smtp_starttls", True):
+                server.starttls()
+            if self.config.get("sender_username"):
+                server.login(self.config["sender_username"], self.config["sender_password"])
+            self.server = server
+            self.connections += 1
+        return self.server
+
+    def _close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except Exception:
+            self.server.close()
+        self.server = None
+
+    def _deliver(self, msg):
+        error = None
+        for _ in range(SEND_ATTEMPTS):
+            try:
+                self._connection().send_message(msg)
+                self.last_used = time.monotonic()
+                self.sent += 1
+                return True
+            except Exception as e:
+                error = e
+                self._close()
+        self.failed += 1
+        log(None, f"Failed to send email '{msg['Subject']}': {error}", logging.ERROR)
+        return False
+
+    def _send_digest(self):
+        if not self.errors:
+            return
+        errors, self.errors, self.digest_due = self.errors, [], None
+        users = sorted({username for _, username, _ in errors})
+        if len(errors) == 1:
+            subject = f"Error in booking process for {users[0]}"
+        else:
+            subject = f"{len(errors)} errors in booking process for {', '.join(users)}"
+        body = "\n\n".join(f"[{timestamp:%H:%M:%S}] An error occurred in the booking process for {username}. Error details: {message}"
+                           for timestamp, username, message in errors)
+        msg = build_message(self.config["sender_email"], self.config["recipient_emails"], subject, body, "plain")
+        if self._deliver(msg):
+            for username in users:
+                log(username, "Error email sent.")
+
+
+def _notifier_key(config):
+    """The config's SMTP and sender settings, hashable."""
+    return tuple(tuple(value) if isinstance(value, list) else value for value in (config.get(key) for key in NOTIFIER_KEYS))
+
+
+def get_notifier(config):
+    """
+    The notifier for the config's SMTP settings, started on first use; None when emails are turned off.
+    A reloaded config with other settings gets a new notifier, and the old one keeps delivering what it has queued.
+    """
+    if not config.get("send_emails", True):
+        return None
+    key = _notifier_key(config)
+    with _notifiers_lock:
+        if key not in _notifiers:
+            _notifiers[key] = Notifier(config).start()
+        return _notifiers[key]
+
+
+def notify_error(config, username, message):
+    notifier = get_notifier(config)
+    if notifier is not None:
+        notifier.error(username, message)
+
+
+def notify_success(config, result, target_date):
+    notifier = get_notifier(config) if config.get("success_emails", True) else None
+    if notifier is not None:
+        notifier.success(result, target_date)
+
+
+def send_notification(config, subject, content, subtype="html", attachment_path=None):
+    notifier = get_notifier(config)
+    if notifier is not None:
+        notifier.send(subject, content, subtype, attachment_path)
+
+
+def flush_notifications():
+    """Wait until every queued email, including a pending error digest, has been delivered."""
+    with _notifiers_lock:
+        notifiers = list(_notifiers.values())
+    for notifier in notifiers:
+        notifier.flush()
+
+
+def stop_notifications():
+    """Deliver what is queued and close the SMTP connections. Safe to call more than once."""
+    with _notifiers_lock:
+        notifiers = list(_notifiers.values())
+        _notifiers.clear()
+    for notifier in notifiers:
+        notifier.stop()
+        if notifier.failed:
+            print(f"{notifier.failed} of {notifier.sent + notifier.failed} emails could not be sent.")
+
+
+atexit.register(stop_notifications)
@@ -0,0 +1,70 @@
+import booking_utils
+
+START_TIME_VIEW_ID = "ctl00_ContentPlaceHolder1_StartTimePicker_timeView"
+END_TIME_VIEW_ID = "ctl00_ContentPlaceHolder1_EndTimePicker_timeView"
+
+# Reads every picker option, the validation panels and the result markers in one round trip.
+# Element handles come back as WebElements so a matched option can be clicked without another lookup.
+SNAPSHOT_SCRIPT = """
+function byId(id) { return document.getElementById(id); }
+// Like WebElement.text: only rendered text counts, so hidden panels and closed pickers read as empty
+function text(el) {
+    if (!el) { return null; }
+    return el.getClientRects().length ? (el.innerText || '').replace(/\\s+/g, ' ').trim() : '';
+}
+function options(id) {
+    var view = byId(id);
+    return view ? Array.prototype.slice.call(view.getElementsByTagName('a')) : [];
+}
+var start = options(arguments[0]), end = options(arguments[1]);
+var unavailable = document.querySelector('div.Div.PT');
+return {
+    start_elements: start,
+    start_texts: start.map(text),
+    end_elements: end,
+    end_texts: end.map(text),
+    validation: text(byId('ValidationContainer')),
+    validation_summary: text(byId('ctl00_ContentPlaceHolder1_ValidationSummary1')),
+    allocation_error: text(byId('ctl00_ContentPlaceHolder1_ctl00_ContentPlaceHolder1_pnlAllocationErrorPanel')),
+    has_header: !!byId('ThePageHeaderWrap'),
+    unavailable: text(unavailable),
+    url: window.location.href
+};
+"""
+
+
+class PageSnapshot:
+    """The reservation page state from a single execute_script call, with picker options indexed by 24h time."""
+
+    def __init__(self, data):
+        self.data = data
+        self.start_texts = data["start_texts"]
+        self.end_texts = data["end_texts"]
+        self.start_options = self._index(data["start_elements"], data["start_texts"])
+        self.end_options = self._index(data["end_elements"], data["end_texts"])
+        self.has_header = data["has_header"]
+        self.unavailable_text = data["unavailable"] or ""
+        self.url = data["url"]
+
+    @staticmethod
+    def _index(elements, texts):
+        """Map normalized HH:MM -> (option index, element handle); the first occurrence wins."""
+        index = {}
+        for position, (element, option_text) in enumerate(zip(elements, texts)):
+            index.setdefault(booking_utils.convert_to_24_hour_format(option_text), (position, element))
+        return index
+
+    @classmethod
+    def take(cls, driver):
+        return cls(driver.execute_script(SNAPSHOT_SCRIPT, START_TIME_VIEW_ID, END_TIME_VIEW_ID))
+
+    def options_loaded(self, picker):
+        texts = self.start_texts if picker == "start" else self.end_texts
+        return all(texts)
+
+    def errors(self):
+        """Return the validation error messages in the order check_for_errors_and_exit reports them."""
+        if not self.data["validation"]:
+            return []
+        errors = [message for message in (self.data["validation_summary"], self.data["allocation_error"]) if message]
+        return errors or ["Unknown error in ValidationContainer."]
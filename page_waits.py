@@ -0,0 +1,128 @@
+import threading
+import time
+from selenium.common.exceptions import JavascriptException, StaleElementReferenceException
+
+# Resolves as soon as any condition holds, re-checking on every DOM mutation instead of polling.
+# Conditions are [name, kind, value]:
+#   present  - an element with id `value` exists
+#   text     - the element with id `value` is rendered and has text
+#   all_text - every <a> under the element with id `value` is rendered and has text
+#   url      - location.href equals `value`, ignoring case
+#   ready    - document.readyState is 'complete'
+#   absent   - the loaded document has no element with id `value`
+# With new_document, no condition holds in a document marked by mark_document: the wait only
+# resolves once a navigation (e.g. the postback of a submit) has replaced it.
+MARKER = "__pageWaitsMarked"
+MARK_SCRIPT = f"window.{MARKER} = true;"
+WAIT_SCRIPT = """
+var conditions = arguments[0], timeoutMs = arguments[1], newDocument = arguments[2], done = arguments[arguments.length - 1];
+function rendered(el) { return el && el.getClientRects().length && (el.innerText || '').trim() !== ''; }
+function holds(kind, value) {
+    var el = value ? document.getElementById(value) : null;
+    if (kind === 'present') { return !!el; }
+    if (kind === 'text') { return !!rendered(el); }
+    if (kind === 'all_text') {
+        if (!el) { return false; }
+        var links = el.getElementsByTagName('a');
+        for (var i = 0; i < links.length; i++) { if (!rendered(links[i])) { return false; } }
+        return true;
+    }
+    if (kind === 'url') { return window.location.href.toLowerCase() === value.toLowerCase(); }
+    if (kind === 'ready') { return document.readyState === 'complete'; }
+    if (kind === 'absent') { return document.readyState === 'complete' && !el; }
+    return false;
+}
+function check() {
+    if (newDocument && window.%s) { return null; }
+    for (var i = 0; i < conditions.length; i++) {
+        if (holds(conditions[i][1], conditions[i][2])) { return conditions[i][0]; }
+    }
+    return null;
+}
+var hit = check();
+if (hit) { done(hit); return; }
+var observer = new MutationObserver(function () { var h = check(); if (h) { finish(h); } });
+observer.observe(document.documentElement, {childList: true, subtree: true, characterData: true, attributes: true});
+document.addEventListener('readystatechange', function () { var h = check(); if (h) { finish(h); } });
+var timer = setTimeout(function () { finish(null); }, timeoutMs);
+var finished = false;
+function finish(result) {
+    if (finished) { return; }
+    finished = true;
+    observer.disconnect();
+    clearTimeout(timer);
+    done(result);
+}
+""" % MARKER
+
+
+class WaitStats:
+    """Per-wait timings, so timeouts can be tuned from data."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}  # wait name -> list of (seconds, outcome)
+
+    def clear(self):
+        with self.lock:
+            self.samples = {}
+
+    def record(self, name, seconds, outcome):
+        with self.lock:
+            self.samples.setdefault(name, []).append((seconds, outcome))
+
+    def summary(self):
+        """Return {name: {count, timeouts, p50_ms, p95_ms, max_ms}}."""
+        with self.lock:
+            samples = {name: list(values) for name, values in self.samples.items()}
+        summary = {}
+        for name, values in samples.items():
+            durations = sorted(seconds * 1000 for seconds, _ in values)
+            summary[name] = {
+                "count": len(durations),
+                "timeouts": sum(1 for _, outcome in values if outcome is None),
+                "p50_ms": durations[int(0.5 * (len(durations) - 1))],
+                "p95_ms": durations[int(0.95 * (len(durations) - 1))],
+                "max_ms": durations[-1],
+            }
+        return summary
+
+    def report(self):
+        lines = ["Page wait timings:"]
+        for name, stats in sorted(self.summary().items()):
+            lines.append(f"  {name}: n={stats['count']} timeouts={stats['timeouts']} p50={stats['p50_ms']:.0f}ms p95={stats['p95_ms']:.0f}ms max={stats['max_ms']:.0f}ms")
+        return "\n".join(lines)
+
+
+WAIT_STATS = WaitStats()
+
+
+def mark_document(driver):
+    """Mark the loaded document, e.g. a filled form, so a wait_for with new_document ignores it."""
+    driver.execute_script(MARK_SCRIPT)
+
+
+def wait_for(driver, name, conditions, timeout=10, new_document=False):
+    """
+    Block until one of the conditions holds in the page and return its name, or None on timeout.
+    Survives navigations (e.g. an ASP.NET postback) by re-arming the wait on the new document; with
+    new_document, only a document that replaced the one mark_document marked counts.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    outcome = None
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            driver.set_script_timeout(remaining + 1)
+            outcome = driver.execute_async_script(WAIT_SCRIPT, conditions, int(remaining * 1000), new_document)
+            break
+        except (JavascriptException, StaleElementReferenceException):
+            # The document was replaced while waiting; wait again on the new one. Anything else,
+            # e.g. a closed window or a dead session, won't clear up by waiting and is raised.
+            time.sleep(0.01)
+    WAIT_STATS.record(name, time.monotonic() - start, outcome)
+    return outcome
+
@@ -0,0 +1,173 @@
+"""
+Parallel tabs: one logged-in browser attempts several slots at once, one tab per slot.
+
+Before release every tab loads NewReservation.aspx for its own slot and pre-selects the start and end
+times. Tabs whose date was still closed start reloading together at release. At the fire instant each
+ready tab's save button is clicked without waiting for its postback, so the submits of all tabs reach
+the server within milliseconds of each other; the outcomes are read once every tab has fired.
+"""
+import time
+import traceback
+import availability
+import booking_utils
+
+MAX_TABS = 6  # Hard limit on tabs per user, whatever parallel_tabs asks for
+
+# Click from a timer so the script returns at once and WebDriver doesn't wait for the postback
+FIRE_SCRIPT = """
+var button = document.getElementById(arguments[0]);
+if (!button) { return false; }
+setTimeout(function () { button.click(); }, 0);
+return true;
+"""
+SUBMIT_BUTTON_ID = "ctl00_ContentPlaceHolder1_HeaderSaveButton"
+
+
+def tab_count(config, time_slots):
+    """How many tabs a user with these slots gets: parallel_tabs, capped by MAX_TABS and the slot count."""
+    return max(min(int(config.get("parallel_tabs", 1)), MAX_TABS, len(time_slots)), 1)
+
+
+def stage_tabs(session, target_date, time_slots, amenity_name, config, logger, claim_board=None):
+    """
+    Stage phase with parallel_tabs: open a tab per slot (the first in the current window), claim a
+    slot for each and fill its form. The tabs are kept in session["tabs"] for submit_tabs.
+    """
+    driver = session["driver"]
+    username = session["username"]
+    main_handle = driver.current_window_handle
+    handles = [main_handle]
+    try:
+        while len(handles) < tab_count(config, time_slots):
+            driver.switch_to.new_window("tab")
+            handles.append(driver.current_window_handle)
+    except Exception as e:
+        logger.error(f"Could only open {len(handles)} tabs: {e}")
+
+    session["tabs"] = []
+    slots = iter(time_slots)
+    for handle in handles:
+        claim = claim_board.claim_next(username, time_slots, wait=False) if claim_board else (next(slots), amenity_name)
+        if claim is None:
+            break
+        driver.switch_to.window(handle)
+        staged = booking_utils.stage_reservation(driver, config["amenities"][claim[1]], target_date, claim[0], username)
+        session["tabs"].append({"handle": handle, "claim": claim, "staged": staged})
+    driver.switch_to.window(main_handle)
+    staged_count = sum(1 for tab in session["tabs"] if tab["staged"])
+    logger.info(f"Opened {len(session['tabs'])} tabs, {staged_count} staged: {[tab['claim'] for tab in session['tabs']]}")
+
+
+def submit_tabs(session, target_date, config, scheduler, claim_board=None):
+    """Submit phase with parallel_tabs: fire every tab's form within milliseconds and return their result dicts."""
+    driver = session["driver"]
+    username = session["username"]
+    attempts = []
+    for tab in session["tabs"]:
+        start_time, amenity_name = tab["claim"]
+        attempt = dict(tab, result=booking_utils.new_attempt_result(username, start_time, amenity_name, config),
+                       logger=booking_utils.setup_logger(username, start_time), started=time.monotonic(), done=False)
+        attempt["logger"].info(f"Starting booking for time slot {start_time} at {amenity_name} in its own tab")
+        attempts.append(attempt)
+
+    try:
+        # Closed tabs start reloading side by side while the staged ones fire
+        for attempt in attempts:
+            if not attempt["staged"]:
+                _step(driver, attempt, _reload, target_date, config)
+        for attempt in attempts:
+            if attempt["staged"]:
+                _step(driver, attempt, _fire, target_date, config, scheduler, claim_board)
+        for attempt in attempts:
+            if not attempt["staged"]:
+                _step(driver, attempt, _fill, target_date, config)
+                _step(driver, attempt, _fire, target_date, config, scheduler, claim_board)
+        for attempt in attempts:
+            _step(driver, attempt, _collect)
+    finally:
+        for attempt in attempts:
+            booking_utils.finish_attempt(attempt["result"], target_date, config, attempt["started"], attempt["logger"], claim_board)
+        close_tabs(session)
+    return [attempt["result"] for attempt in attempts]
+
+
+def _step(driver, attempt, step, *args):
+    """Run one step in the attempt's tab; an exception ends the attempt as failed."""
+    if attempt["done"]:
+        return
+    try:
+        driver.switch_to.window(attempt["handle"])
+        step(driver, attempt, *args)
+    except Exception as e:
+        attempt["done"] = True
+        attempt["result"]["message"] = f"An error occurred: {str(e)}"
+        attempt["logger"].error(f"Exception in booking process: {traceback.format_exc()}")
+
+
+def _reload(driver, attempt, target_date, config):
+    url = booking_utils.booking_page_url(config["amenities"][attempt["claim"][1]], target_date)
+    driver.execute_script("window.location.href = arguments[0];", url)  # Returns before the page has loaded
+
+
+def _fill(driver, attempt, target_date, config):
+    username = attempt["result"]["username"]
+    start_time, amenity_name = attempt["claim"]
+    amenity_id = config["amenities"][amenity_name]
+    if not booking_utils.verify_page_url(driver, target_date, username, amenity_id):
+        _end(attempt, "Incorrect date page loaded. Skipping this time slot.")
+        return
+    if booking_utils.check_amenity_unavailable(driver, username):
+        _end(attempt, "Amenity is currently unavailable on the selected date.")
+        return
+    booking_utils.fill_time_slot(driver, start_time, username)
+
+
+def _fire(driver, attempt, target_date, config, scheduler, claim_board):
+    result = attempt["result"]
+    if availability.AVAILABILITY.is_taken(result["amenity_id"], target_date, result["time"]):
+        result["status"] = "Skipped"
+        _end(attempt, "Slot is no longer offered according to the availability snapshot.")
+        return
+    if booking_utils.cancel_if_won(claim_board, result["time"], result, attempt["logger"]):
+        attempt["done"] = True
+        return
+    if not driver.execute_script(FIRE_SCRIPT, SUBMIT_BUTTON_ID):
+        _end(attempt, "Save button not found.")
+        return
+    result["t0_to_submit_ms"] = round((time.monotonic() - scheduler.fire_monotonic) * 1000, 1)
+    attempt["logger"].info(f"Fired submit for {result['time']} ({result['t0_to_submit_ms']}ms after T0).")
+
+
+def _collect(driver, attempt):
+    booking_utils.check_submit_errors(driver, attempt["result"]["username"])
+    booking_utils.record_booking_outcome(driver, attempt["result"], attempt["logger"])
+
+
+def _end(attempt, message):
+    attempt["done"] = True
+    attempt["result"]["message"] = message
+    attempt["logger"].error(message)
+
+
+def close_tabs(session):
+    """Close every tab but the session's original window and switch back to it."""
+    tabs = session.get("tabs") or []
+    session["tabs"] = None
+    if len(tabs) < 2:
+        return
+    driver = session["driver"]
+    for tab in tabs[1:]:
+        try:
+            driver.switch_to.window(tab["handle"])
+            driver.close()
+        except Exception:
+            pass
+    driver.switch_to.window(tabs[0]["handle"])
+
+
+def remaining_slots(time_slots, results, claim_board=None):
+    """The slots left for the sequential loop: a claim board tracks attempts itself, a fixed order drops the tabs' slots."""
+    if claim_board is not None:
+        return time_slots
+    attempted = {result["time"] for result in results}
+    return [slot for slot in time_slots if slot not in attempted]
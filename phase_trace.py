@@ -0,0 +1,143 @@
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PhaseTracer:
+    """
+    Spans for each booking phase, timed on the monotonic clock and reported relative to the release instant.
+    Exports a Chrome trace (chrome://tracing or ui.perfetto.dev) with one track per user.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = []  # (phase, username, slot, start, end, ok)
+        self.active = []  # (phase, username, slot, start) of spans still running
+        self.listeners = []  # Called with every finished span; they outlive clear()
+        self.release_monotonic = None
+
+    def set_release(self, release_monotonic, clock=None):
+        """
+        Set the release instant, given on the monotonic time of the run's clock. Spans are timed on the
+        real monotonic clock, so an instant on another (simulated) clock is converted as of this call.
+        """
+        if clock is not None:
+            release_monotonic += time.monotonic() - clock.monotonic()
+        self.release_monotonic = release_monotonic
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def clear(self):
+        with self.lock:
+            self.spans = []
+            self.active = []
+            self.release_monotonic = None
+
+    @contextmanager
+    def span(self, phase, username=None, slot=None):
+        start = time.monotonic()
+        entry = (phase, username, slot, start)
+        with self.lock:
+            self.active.append(entry)
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            end = time.monotonic()
+            span = (phase, username, slot, start, end, ok)
+            with self.lock:
+                if entry in self.active:  # Gone if clear() ran meanwhile
+                    self.active.remove(entry)
+                self.spans.append(span)
+            for listener in self.listeners:
+                listener(span)
+
+    def _origin(self, spans):
+        return self.release_monotonic if self.release_monotonic is not None else min(span[3] for span in spans)
+
+    def summary(self):
+        """Return {phase: {count, errors, p50_ms, p95_ms, max_ms}} across all users."""
+        with self.lock:
+            spans = list(self.spans)
+        durations = {}
+        for phase, _, _, start, end, ok in spans:
+            durations.setdefault(phase, []).append(((end - start) * 1000, ok))
+        summary = {}
+        for phase, values in durations.items():
+            ms = sorted(value for value, _ in values)
+            summary[phase] = {
+                "count": len(ms),
+                "errors": sum(1 for _, ok in values if not ok),
+                "p50_ms": ms[int(0.5 * (len(ms) - 1))],
+                "p95_ms": ms[int(0.95 * (len(ms) - 1))],
+                "max_ms": ms[-1],
+            }
+        return summary
+
+    def phase_durations(self, username, since):
+        """Total ms per phase of one user's spans that started at or after the monotonic time since."""
+        with self.lock:
+            spans = [span for span in self.spans if span[1] == username and span[3] >= since]
+        durations = {}
+        for phase, _, _, start, end, _ in spans:
+            durations[phase] = durations.get(phase, 0.0) + round((end - start) * 1000, 3)
+        return durations
+
+    def report(self):
+        lines = ["Phase timings:"]
+        for phase, stats in sorted(self.summary().items()):
+            lines.append(f"  {phase}: n={stats['count']} errors={stats['errors']} p50={stats['p50_ms']:.0f}ms p95={stats['p95_ms']:.0f}ms max={stats['max_ms']:.0f}ms")
+        return "\n".join(lines)
+
+    def export_chrome_trace(self, path):
+        """
+        Write the run as a Chrome trace JSON file. Every span carries its start relative to the release
+        instant (t_release_ms); the timeline starts at the earliest span and marks the release instant.
+        """
+        with self.lock:
+            spans = list(self.spans)
+        if not spans:
+            return None
+        origin = self._origin(spans)
+        first = min(min(span[3] for span in spans), origin)
+        users = sorted({span[1] or "" for span in spans})
+        tids = {user: index + 1 for index, user in enumerate(users)}
+
+        events = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": user or "shared"}}
+                  for user, tid in tids.items()]
+        events.append({"name": "release", "ph": "i", "s": "g", "pid": 1, "tid": 0, "ts": round((origin - first) * 1e6)})
+        for phase, username, slot, start, end, ok in spans:
+            events.append({
+                "name": phase, "cat": "booking", "ph": "X", "pid": 1, "tid": tids[username or ""],
+                "ts": round((start - first) * 1e6), "dur": round((end - start) * 1e6),
+                "args": {"user": username, "slot": slot, "ok": ok, "t_release_ms": round((start - origin) * 1000, 3)},
+            })
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return path
+
+
+TRACE = PhaseTracer()
+
+
+def traced(phase=None):
+    """Decorator: record each call as a span, tagged with its username and start_time arguments if any."""
+    def decorate(fn):
+        signature = inspect.signature(fn)
+        name = phase or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            with TRACE.span(name, arguments.get("username"), arguments.get("start_time")):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,108 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import requests
+from booking_log import log
+from clock import SYSTEM_CLOCK
+from metrics import METRICS
+from phase_trace import TRACE
+
+PROBE_TIMEOUT = 5  # seconds
+
+
+def probe_server_time(session, url):
+    """
+    Send one request and return (local_sent, local_received, server_date).
+    Times are epoch seconds; server_date comes from the 1-second resolution HTTP Date header.
+    """
+    local_sent = time.time()
+    response = session.get(url, timeout=PROBE_TIMEOUT, stream=True)
+    local_received = time.time()
+    response.close()
+    server_date = parsedate_to_datetime(response.headers["Date"]).timestamp()
+    return local_sent, local_received, server_date
+
+
+def estimate_server_offset(url, samples=16, session=None):
+    """
+    Estimate server_clock - local_clock from HTTP Date headers, compensating for round-trip time.
+
+    Each probe proves the server clock read [date, date + 1) at some local instant in [sent, received],
+    so the offset lies in [date - received, date + 1 - sent]. Probes are spread over a second so their
+    intervals cut different second boundaries, and the intersection narrows to about one RTT.
+    Returns (offset_seconds, uncertainty_seconds, min_rtt_seconds).
+    """
+    session = session or requests.Session()
+    low, high = float("-inf"), float("inf")
+    best = None
+    for i in range(samples):
+        sent, received, server_date = probe_server_time(session, url)
+        rtt = received - sent
+        low = max(low, server_date - received)
+        high = min(high, server_date + 1 - sent)
+        if best is None or rtt < best[0]:
+            best = (rtt, server_date + 0.5 - (sent + received) / 2)
+        if i < samples - 1:
+            time.sleep(1.0 / samples + 0.003)  # Slight detune so probes don't alias with the second ticks
+    if low <= high:
+        return (low + high) / 2, (high - low) / 2, best[0]
+    # Inconsistent intervals (e.g. the server clock stepped); fall back to the fastest probe
+    return best[1], 0.5 + best[0] / 2, best[0]
+
+
+class ReleaseScheduler:
+    """
+    Wakes every worker at one shared fire instant, anchored to the server clock.
+
+    The fire instant is computed once as a local wall-clock time (release - server offset + fire offset)
+    and converted to the monotonic clock, so waits are immune to wall-clock adjustments afterwards.
+    """
+
+    def __init__(self, release_time, fire_offset_ms=-30, offset=0.0, clock=SYSTEM_CLOCK):
+        self.release_time = release_time
+        self.clock = clock
+        self.fire_offset_ms = fire_offset_ms
+        self.offset = 0.0
+        self.uncertainty = None
+        self.jitters = {}
+        self.lock = threading.Lock()
+        self._anchor(offset)
+        METRICS.track_scheduler(self)
+
+    def _anchor(self, offset):
+        self.offset = offset
+        fire_epoch = self.release_time.timestamp() - offset + self.fire_offset_ms / 1000.0
+        self.fire_monotonic = self.clock.monotonic() + (fire_epoch - self.clock.time())
+
+    def sync(self, url, samples=16):
+        """Measure the skew to the server clock at url and re-anchor the fire instant."""
+        offset, uncertainty, rtt = estimate_server_offset(url, samples)
+        self.uncertainty = uncertainty
+        self._anchor(offset)
+        log(None, f"Server clock skew: {offset * 1000:+.1f}ms (+/-{uncertainty * 1000:.1f}ms, min RTT {rtt * 1000:.1f}ms).")
+        return offset
+
+    def trace_release(self):
+        """Point the phase tracer's T0 at this release; wait_for_fire repeats it to follow a simulated clock's jumps."""
+        TRACE.set_release(self.fire_monotonic - self.fire_offset_ms / 1000.0, self.clock)
+
+    def seconds_until_fire(self):
+        return self.fire_monotonic - self.clock.monotonic()
+
+    def wait_until(self, seconds_before_fire, check_interval=1.0):
+        """Sleep until the fire instant is at most seconds_before_fire away."""
+        while True:
+            remaining = self.seconds_until_fire() - seconds_before_fire
+            if remaining <= 0:
+                return
+            self.clock.sleep(min(remaining, check_interval))
+
+    def wait_for_fire(self, worker):
+        """Block until the fire instant and return this worker's wake jitter in seconds."""
+        self.clock.sleep_until(self.fire_monotonic)
+        jitter = self.clock.monotonic() - self.fire_monotonic
+        with self.lock:
+            self.jitters[worker] = jitter
+        self.trace_release()
+        log(worker, f"Woke at fire instant with {jitter * 1000:.3f}ms jitter.")
+        return jitter
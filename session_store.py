@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import requests
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.support.ui import WebDriverWait
+import booking_http
+import booking_utils
+from booking_log import log
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:  # In requirements.txt; only needed once BOOKING_SESSION_KEY is set
+    Fernet = None
+    InvalidToken = ValueError
+
+SESSION_DIR = "sessions"
+SESSION_KEY_ENV = "BOOKING_SESSION_KEY"  # Fernet key; when set, cookie files are encrypted
+CHECK_TIMEOUT = 5  # seconds
+LOGIN_REDIRECT_TIMEOUT = 20  # seconds
+
+_warned_unencrypted = False
+
+
+def _cipher():
+    key = os.environ.get(SESSION_KEY_ENV)
+    if not key:
+        return None
+    if Fernet is None:
+        raise RuntimeError(f"{SESSION_KEY_ENV} is set but the 'cryptography' package is not installed.")
+    return Fernet(key.encode())
+
+
+def _warn_unencrypted(username):
+    global _warned_unencrypted
+    if not _warned_unencrypted:
+        _warned_unencrypted = True
+        log(username, f"Saving session cookies unencrypted (owner-only file permissions); set {SESSION_KEY_ENV} to a Fernet key to encrypt them.", logging.WARNING)
+
+
+def session_path(username):
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", username)
+    return os.path.join(SESSION_DIR, f"{safe_name}.json")
+
+
+def save_session(username, cookies):
+    """Save a user's cookies to a file only the current user can read, encrypted if a key is configured."""
+    os.makedirs(SESSION_DIR, mode=0o700, exist_ok=True)
+    payload = json.dumps({"saved_at": time.time(), "cookies": cookies}).encode()
+    cipher = _cipher()
+    if cipher:
+        payload = cipher.encrypt(payload)
+    else:
+        _warn_unencrypted(username)
+    path = session_path(username)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(payload)
+    os.chmod(path, 0o600)
+
+
+def load_session(username):
+    """Return the saved cookies for a user, or None if there are none (or they have expired locally)."""
+    try:
+        with open(session_path(username), "rb") as f:
+            payload = f.read()
+        cipher = _cipher()
+        if cipher:
+            payload = cipher.decrypt(payload)
+        cookies = json.loads(payload)["cookies"]
+    except (OSError, ValueError, KeyError, InvalidToken) as e:
+        log(username, f"No usable saved session: {e!r}")
+        return None
+    now = time.time()
+    if any(cookie.get("expiry") and cookie["expiry"] < now for cookie in cookies):
+        log(username, "Saved session cookies have expired.")
+        return None
+    return cookies
+
+
+def cookie_session(cookies):
+    """Build a pooled HTTP session carrying the given Selenium-format cookies."""
+    session = booking_http.create_session()
+    for cookie in cookies:
+        session.cookies.set(cookie["name"], cookie["value"], domain=cookie.get("domain"), path=cookie.get("path", "/"),
+                            secure=cookie.get("secure", False), expires=cookie.get("expiry"),
+                            rest={"HttpOnly": None} if cookie.get("httpOnly") else {})
+    return session
+
+
+def selenium_cookie(cookie):
+    """A requests cookie in the Selenium format the session files and inject_cookies use."""
+    converted = {"name": cookie.name, "value": cookie.value, "domain": cookie.domain, "path": cookie.path,
+                 "secure": bool(cookie.secure), "httpOnly": cookie.has_nonstandard_attr("HttpOnly")}
+    if cookie.expires:
+        converted["expiry"] = cookie.expires
+    return converted
+
+
+def sync_cookies(driver, cookies):
+    """
+    Set Selenium-format cookies in a running browser over CDP, which unlike add_cookie doesn't need a
+    page of the cookie's domain loaded.
+    """
+    for cookie in cookies:
+        params = {key: cookie[key] for key in ("name", "value", "path", "secure", "httpOnly") if key in cookie}
+        domain = cookie.get("domain") or ""
+        if domain.startswith("."):
+            params["domain"] = domain
+        else:
+            # Host-only cookie: a domain would widen it to subdomains, a URL keeps it on the host
+            params["url"] = f"{'https' if cookie.get('secure') else 'http'}://{domain}{cookie.get('path', '/')}"
+        if "expiry" in cookie:
+            params["expires"] = cookie["expiry"]
+        driver.execute_cdp_cmd("Network.setCookie", params)
+
+
+def is_session_valid(cookies, check_url):
+    """Cheap check: the page is served directly instead of redirecting to the login page."""
+    try:
+        response = cookie_session(cookies).get(check_url, timeout=CHECK_TIMEOUT, allow_redirects=False, stream=True)
+        response.close()
+    except requests.RequestException:
+        return False
+    return response.status_code == 200
+
+
+def inject_cookies(driver, cookies):
+    """Add saved cookies to a fresh browser, visiting each cookie domain first as WebDriver requires."""
+    by_domain = {}
+    for cookie in cookies:
+        by_domain.setdefault(cookie.get("domain", "").lstrip("."), []).append(cookie)
+    for domain, domain_cookies in by_domain.items():
+        base = booking_utils.BASE_URL if domain in booking_utils.BASE_URL else booking_utils.AUTH_URL
+        driver.get(f"{base}/robots.txt")  # Any cheap page on the cookie's domain
+        for cookie in domain_cookies:
+            driver.add_cookie({key: cookie[key] for key in ("name", "value", "path", "domain", "secure", "httpOnly", "expiry") if key in cookie})
+
+
+def ensure_logged_in(driver, username, password, login_date, check_url):
+    """Reuse the saved session when it's still valid; only do a full login when it has expired."""
+    cookies = load_session(username)
+    if cookies and is_session_valid(cookies, check_url):
+        inject_cookies(driver, cookies)
+        log(username, "Restored saved session, skipping login.")
+        return False
+    booking_utils.login(driver, username, password, login_date)
+    WebDriverWait(driver, LOGIN_REDIRECT_TIMEOUT).until(lambda d: not d.current_url.lower().startswith(booking_utils.AUTH_URL.lower()))
+    save_session(username, driver.get_cookies())
+    log(username, "Logged in and saved session.")
+    return True
+
+
+class KeepAlive:
+    """
+    Background thread that keeps a user's server session alive with a lightweight HTTP ping. Cookies
+    the server refreshes are saved and held for the thread that drives the user's browser, which sets
+    them there with apply_refreshed (WebDriver isn't thread-safe), so the browser doesn't go to the
+    release with the ones it logged in with.
+    """
+
+    def __init__(self, username, cookies, ping_url, interval):
+        self.username = username
+        self.lock = threading.Lock()
+        self.refreshed = {}  # (name, domain, path) -> latest Selenium-format cookie not yet in the browser
+        self.session = cookie_session(cookies)
+        self.ping_url = ping_url
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                response = self.session.get(self.ping_url, timeout=CHECK_TIMEOUT, allow_redirects=False, stream=True)
+                response.close()
+                if response.status_code != 200:
+                    log(self.username, f"Keep-alive ping got HTTP {response.status_code}; session may have expired.")
+                    continue
+                # Persist any cookies the server refreshed (sliding expiration)
+                if response.cookies:
+                    save_session(self.username, [selenium_cookie(c) for c in self.session.cookies])
+                    with self.lock:
+                        for c in response.cookies:
+                            self.refreshed[(c.name, c.domain, c.path)] = selenium_cookie(c)
+            except requests.RequestException as e:
+                log(self.username, f"Keep-alive ping failed: {e}", logging.ERROR)
+
+    def apply_refreshed(self, driver):
+        """Set the cookies refreshed since the last call in the browser; call from the thread driving it."""
+        with self.lock:
+            cookies, self.refreshed = list(self.refreshed.values()), {}
+        if not cookies:
+            return
+        try:
+            sync_cookies(driver, cookies)
+            log(self.username, f"Set {len(cookies)} refreshed cookies in the browser.")
+        except WebDriverException as e:
+            log(self.username, f"Could not set the refreshed cookies in the browser: {e}", logging.ERROR)
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
@@ -0,0 +1,224 @@
+"""
+Sharded runs: a coordinator splits the users across worker processes, on this machine or on others.
+
+With `booking_auto.py --mode sharded` the coordinator starts `shard_local_workers` workers itself. Workers on
+other machines connect to "shard_address" with the authkey the coordinator prints:
+
+    python sharding.py --connect 192.168.1.10:50000 --authkey 3f2a...
+"""
+import argparse
+import datetime
+import multiprocessing
+import os
+import secrets
+import socket
+import threading
+import time
+from multiprocessing.managers import BaseManager
+import booking_auto
+import booking_utils
+from availability import AVAILABILITY
+from booking_log import flush_logging, log
+from metrics import METRICS, METRICS_HOST
+from notifications import stop_notifications
+from page_waits import WAIT_STATS
+from phase_trace import TRACE
+from release_scheduler import ReleaseScheduler
+from slot_claims import create_claim_board
+
+POLL_INTERVAL = 5  # seconds between checks on the workers while waiting for results
+SHARD_TIMEOUT_SECONDS = 900  # Give up on missing shards this long after the fire instant
+
+_shared = {}  # Objects served by the coordinator's manager process
+
+
+class Coordinator:
+    """Hands out shards of (user, time_slots) jobs and collects each shard's results."""
+
+    def __init__(self, run, shards):
+        self.run = run
+        self.total = len(shards)
+        self.unassigned = list(enumerate(shards))
+        self.assigned = {}  # worker name -> shard index
+        self.results = {}  # shard index -> results
+        self.condition = threading.Condition()
+
+    def run_info(self):
+        return self.run
+
+    def next_shard(self, worker):
+        """Assign the next shard to a worker, or return None when all are taken."""
+        with self.condition:
+            if not self.unassigned:
+                return None
+            index, jobs = self.unassigned.pop(0)
+            self.assigned[worker] = index
+            return jobs
+
+    def submit_results(self, worker, results):
+        with self.condition:
+            index = self.assigned.pop(worker, None)
+            if index is not None:
+                self.results[index] = results
+                self.condition.notify_all()
+
+    def abandon(self, worker=None):
+        """Stop waiting for a worker's shard, or for every outstanding shard if no worker is given."""
+        with self.condition:
+            indexes = [self.assigned.pop(worker)] if worker in self.assigned else []
+            if worker is None:
+                indexes = list(self.assigned.values()) + [index for index, _ in self.unassigned]
+                self.assigned.clear()
+                self.unassigned.clear()
+            for index in indexes:
+                self.results.setdefault(index, [])
+            self.condition.notify_all()
+            return len(indexes)
+
+    def wait_done(self, timeout):
+        with self.condition:
+            return self.condition.wait_for(lambda: len(self.results) == self.total, timeout)
+
+    def merged_results(self):
+        with self.condition:
+            return [result for index in sorted(self.results) for result in self.results[index]]
+
+
+def _init_shared(run, shards, run_key):
+    _shared["claim_board"] = create_claim_board(run["config"], run_key, run["config"]["times"],
+                                                   datetime.datetime.fromisoformat(run["release_time"]))
+    _shared["coordinator"] = Coordinator(dict(run, claims=_shared["claim_board"] is not None), shards)
+
+
+def _coordinator():
+    return _shared["coordinator"]
+
+
+def _claim_board():
+    return _shared["claim_board"]
+
+
+class ShardManager(BaseManager):
+    pass
+
+
+ShardManager.register("coordinator", callable=_coordinator)
+ShardManager.register("claim_board", callable=_claim_board)
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    return host, int(port)
+
+
+def run_worker(address, authkey, name, mode="threaded", metrics_port=None):
+    """Connect to the coordinator, run the shards it hands out and send back their results."""
+    manager = ShardManager(address=address, authkey=authkey)
+    manager.connect()
+    coordinator = manager.coordinator()
+    run = coordinator.run_info()
+    config = dict(run["config"])
+    booking_utils.configure_urls(config)
+    claim_board = manager.claim_board() if run["claims"] else None
+
+    # Same fire instant as the coordinator; other hosts measure their own skew to the server
+    scheduler = ReleaseScheduler(datetime.datetime.fromisoformat(run["release_time"]), run["fire_offset_ms"], offset=run["offset"])
+    if config.get("clock_sync", True) and run["host"] != socket.gethostname():
+        try:
+            scheduler.sync(f"{booking_utils.BASE_URL}/", config.get("clock_sync_samples", 16))
+        except Exception as e:
+            log(name, f"Server clock sync failed, using the coordinator's offset: {e}")
+    scheduler.trace_release()
+    availability_watch = booking_auto.start_availability_scan(config, run["target_date"], scheduler)
+    metrics_served = metrics_port is not None and METRICS.serve(metrics_port, config.get("metrics_host", METRICS_HOST))
+
+    while True:
+        jobs = coordinator.next_shard(name)
+        if jobs is None:
+            break
+        config["users"] = [user for user, _ in jobs]
+        log(name, f"Running shard for {', '.join(user['username'] for user in config['users'])}.")
+        browser_pool = None
+        if config.get("browser_pool", False) or config.get("browser_contexts", False):
+            browser_pool = booking_auto.start_browser_pool(config, run["target_date"], scheduler)
+        try:
+            results = booking_auto.run_jobs(config, jobs, run["target_date"], scheduler, claim_board, browser_pool, mode)
+        finally:
+            if browser_pool is not None:
+                browser_pool.close()
+        coordinator.submit_results(name, results)
+        log(name, f"Shard finished with {sum(1 for result in results if result['status'] == 'Success')} successes.")
+
+    AVAILABILITY.stop(availability_watch)
+    if metrics_served:
+        METRICS.stop()
+    stop_notifications()  # Worker processes exit without running atexit handlers
+    flush_logging()
+    print(f"[{name}] {WAIT_STATS.report()}\n[{name}] {TRACE.report()}")
+    if availability_watch is not None:
+        print(f"[{name}] {AVAILABILITY.report()}")
+    TRACE.export_chrome_trace(os.path.join(config.get("log_dir", "logs"), f"trace_{name}_{datetime.datetime.now():%Y%m%d_%H%M%S}.json"))
+
+
+def run_sharded_bookings(config, jobs, target_date_str, scheduler, run_key):
+    """
+    Split the jobs into shard_workers shards, serve them (with the fire instant and slot claims) from a
+    coordinator, start shard_local_workers worker processes here and merge every shard's results.
+    """
+    workers = max(1, min(config.get("shard_workers", 2), len(jobs)))
+    local_workers = min(config.get("shard_local_workers", workers), workers)
+    authkey = bytes.fromhex(config["shard_authkey"]) if "shard_authkey" in config else secrets.token_bytes(16)
+    shards = [jobs[index::workers] for index in range(workers)]
+    run = {
+        "config": config,
+        "target_date": target_date_str,
+        "release_time": scheduler.release_time.isoformat(),
+        "fire_offset_ms": scheduler.fire_offset_ms,
+        "offset": scheduler.offset,
+        "host": socket.gethostname(),
+    }
+
+    context = multiprocessing.get_context("spawn")
+    manager = ShardManager(address=parse_address(config.get("shard_address", "127.0.0.1:0")), authkey=authkey, ctx=context)
+    manager.start(_init_shared, (run, shards, run_key))
+    coordinator = manager.coordinator()
+    host, port = manager.address
+    print(f"Coordinator on {host}:{port} serving {workers} shards, {local_workers} to local workers.")
+    if local_workers < workers:
+        print(f"Start the other workers with: python sharding.py --connect {host}:{port} --authkey {authkey.hex()}")
+
+    processes = {}
+    for index in range(local_workers):
+        name = f"worker-{index + 1}"
+        # Each local worker serves its own metrics on the ports after the coordinator's
+        metrics_port = config["metrics_port"] + index + 1 if config.get("metrics_port") is not None else None
+        processes[name] = context.Process(target=run_worker, args=(manager.address, authkey, name, config.get("shard_worker_mode", "threaded"), metrics_port), name=name)
+        processes[name].start()
+
+    deadline = time.monotonic() + scheduler.seconds_until_fire() + config.get("shard_timeout_seconds", SHARD_TIMEOUT_SECONDS)
+    try:
+        while not coordinator.wait_done(POLL_INTERVAL):
+            for name, process in processes.items():
+                if not process.is_alive() and coordinator.abandon(name):
+                    print(f"[{name}] Exited (code {process.exitcode}) without reporting its shard; its results are lost.")
+            if local_workers == workers and not any(process.is_alive() for process in processes.values()):
+                coordinator.abandon()
+            if time.monotonic() > deadline:
+                print(f"Gave up on {coordinator.abandon()} shards that never reported.")
+        results = coordinator.merged_results()
+    finally:
+        for process in processes.values():
+            process.join(timeout=30)
+        manager.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run booking shards handed out by a coordinator.")
+    parser.add_argument("--connect", required=True, help="Coordinator address, host:port.")
+    parser.add_argument("--authkey", required=True, help="Hex authkey printed by the coordinator.")
+    parser.add_argument("--mode", choices=["threaded", "async"], default="threaded")
+    parser.add_argument("--name", default=f"{socket.gethostname()}-{os.getpid()}")
+    parser.add_argument("--metrics-port", type=int, help="Serve this worker's live metrics on this port.")
+    args = parser.parse_args()
+    run_worker(parse_address(args.connect), bytes.fromhex(args.authkey), args.name, args.mode, args.metrics_port)
@@ -0,0 +1,270 @@
+import datetime
+import os
+import sqlite3
+import threading
+import time
+from booking_log import log
+
+CLAIM_WAIT_SECONDS = 30  # Longest a user waits for another user's attempt on a slot to finish
+
+# (path, run_key) -> SqliteClaimBoards of this process still open on it, e.g. overlapping daemon runs
+_open_runs = {}
+_open_runs_lock = threading.Lock()
+
+
+class ClaimBoard:
+    """
+    In-process board that hands each (time slot, amenity) attempt to one user at a time.
+
+    A user claims the first open attempt in its preferred slot order, primary amenity first. When an
+    attempt fails it is released for users that haven't tried it yet, and a failed primary attempt
+    opens the slot on the fallback amenities right away for idle users. In hedged mode the fallback
+    amenities are open from the start. The first success wins the slot; nobody attempts it again. A
+    hedged attempt that had already submitted when the other amenity won can still succeed: that
+    duplicate booking is logged, not prevented.
+    """
+
+    def __init__(self, slots, amenities=("",), hedged=False):
+        self.condition = threading.Condition()
+        self.amenities = list(amenities)
+        self.won = {}  # slot -> (username, amenity_name)
+        self.claims = {}  # (slot, amenity_name) -> username holding it, or None if open
+        self.attempted = {}  # (slot, amenity_name) -> usernames that already tried it
+        for slot in slots:
+            for index, amenity_name in enumerate(self.amenities):
+                if index == 0 or hedged:
+                    self.claims[(slot, amenity_name)] = None
+
+    def _pick(self, username, preferred_order):
+        """Return (attempt to claim or None, whether a claim may still become possible)."""
+        pending = False
+        for amenity_name in self.amenities:
+            for slot in preferred_order:
+                key = (slot, amenity_name)
+                if slot in self.won or key not in self.claims or username in self.attempted.get(key, ()):
+                    continue
+                if self.claims[key] is None:
+                    return key, True
+                pending = True  # Held by someone else; may be released if their attempt fails
+        return None, pending
+
+    def claim_next(self, username, preferred_order, wait=True):
+        """Claim the next (slot, amenity_name) for a user, waiting for in-flight attempts if nothing is open."""
+        deadline = time.monotonic() + CLAIM_WAIT_SECONDS
+        with self.condition:
+            while True:
+                key, pending = self._pick(username, preferred_order)
+                if key is not None:
+                    self.claims[key] = username
+                    log(username, f"Claimed time slot {key[0]} at {key[1]}.")
+                    return key
+                remaining = deadline - time.monotonic()
+                if not pending or not wait or remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    def complete(self, slot, amenity_name, username, success):
+        """Record the outcome of a user's attempt: win the slot, or release it and open the fallbacks."""
+        with self.condition:
+            key = (slot, amenity_name)
+            self.attempted.setdefault(key, set()).add(username)
+            if self.claims.get(key) == username:
+                self.claims[key] = None
+            if success:
+                winner = self.won.setdefault(slot, (username, amenity_name))
+                if winner != (username, amenity_name):
+                    log(username, f"Duplicate booking: {slot} at {amenity_name} was already won by {winner[0]} at {winner[1]}; cancel one of them.")
+            elif amenity_name == self.amenities[0]:
+                for fallback in self.amenities[1:]:
+                    self.claims.setdefault((slot, fallback), None)
+            self.condition.notify_all()
+
+    def winner(self, slot):
+        """Return (username, amenity_name) that won the slot, or None."""
+        with self.condition:
+            return self.won.get(slot)
+
+    def close(self):
+        """Nothing to release; the board goes with the run."""
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Exists, owned by another user
+    return True
+
+
+class SqliteClaimBoard:
+    """
+    Cross-process claim board with the same interface as ClaimBoard, backed by a local SQLite file.
+
+    A board joins the rows of its run_key while another member of the run (a live process, or an open
+    board in this process) still uses them. Otherwise (a rerun, a retry after a crash, a daemon
+    restart, another release) it starts afresh, but keeps the slots already won for the same release
+    so they aren't booked twice. A claim whose holding process has died is open again.
+    """
+
+    POLL_INTERVAL = 0.05  # seconds
+
+    def __init__(self, path, run_key, slots, amenities=("",), hedged=False, release_time=None):
+        self.path = path
+        self.run_key = run_key
+        self.amenities = list(amenities)
+        self.closed = False
+        with _open_runs_lock, self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS claims (run_key TEXT, slot TEXT, amenity TEXT, status TEXT, username TEXT, pid INTEGER, PRIMARY KEY (run_key, slot, amenity))")
+            conn.execute("CREATE TABLE IF NOT EXISTS attempts (run_key TEXT, slot TEXT, amenity TEXT, username TEXT, PRIMARY KEY (run_key, slot, amenity, username))")
+            conn.execute("CREATE TABLE IF NOT EXISTS runs (run_key TEXT PRIMARY KEY, release TEXT, started TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS members (run_key TEXT, pid INTEGER, PRIMARY KEY (run_key, pid))")
+            if "pid" not in {row[1] for row in conn.execute("PRAGMA table_info(claims)")}:
+                conn.execute("ALTER TABLE claims ADD COLUMN pid INTEGER")  # Files from before claims recorded their process
+            self._start_run(conn, release_time)
+            _open_runs[(path, run_key)] = _open_runs.get((path, run_key), 0) + 1
+            rows = [(run_key, slot, amenity_name) for slot in slots for index, amenity_name in enumerate(self.amenities) if index == 0 or hedged]
+            conn.executemany("INSERT OR IGNORE INTO claims VALUES (?, ?, ?, 'open', NULL, NULL)", rows)
+
+    def _start_run(self, conn, release_time):
+        """
+        Join the run in progress under this run_key, or drop the rows an earlier run left behind; must be
+        called with _open_runs_lock held.
+        """
+        release = (release_time or datetime.datetime.now()).isoformat()
+        now = datetime.datetime.now().isoformat()
+        row = conn.execute("SELECT release FROM runs WHERE run_key = ?", (self.run_key,)).fetchone()
+        members = [pid for (pid,) in conn.execute("SELECT pid FROM members WHERE run_key = ?", (self.run_key,))]
+        in_progress = (_open_runs.get((self.path, self.run_key), 0) > 0
+                       or any(_process_alive(pid) for pid in members if pid != os.getpid()))
+        if not in_progress:
+            same_release = row is not None and row[0] == release
+            # Slots won for this release stay won: a retry after a crash must not book them again
+            if same_release:
+                conn.execute("DELETE FROM claims WHERE run_key = ? AND status != 'won'", (self.run_key,))
+            else:
+                conn.execute("DELETE FROM claims WHERE run_key = ?", (self.run_key,))
+            for table in ("attempts", "members"):
+                conn.execute(f"DELETE FROM {table} WHERE run_key = ?", (self.run_key,))
+            if not same_release:
+                conn.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?)", (self.run_key, release, now))
+        conn.execute("INSERT OR IGNORE INTO members VALUES (?, ?)", (self.run_key, os.getpid()))
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return _Transaction(conn)
+
+    def claim_next(self, username, preferred_order, wait=True):
+        deadline = time.monotonic() + CLAIM_WAIT_SECONDS
+        while True:
+            with self._connect() as conn:
+                rows = {}
+                for slot, amenity_name, status, owner, pid in conn.execute(
+                        "SELECT slot, amenity, status, username, pid FROM claims WHERE run_key = ?", (self.run_key,)):
+                    if status == "claimed" and pid is not None and not _process_alive(pid):
+                        log(username, f"Reopening {slot} at {amenity_name}: {owner}'s process has exited.")
+                        conn.execute("UPDATE claims SET status = 'open', username = NULL, pid = NULL WHERE run_key = ? AND slot = ? AND amenity = ?", (self.run_key, slot, amenity_name))
+                        status = "open"
+                    rows[(slot, amenity_name)] = (status, owner)
+                attempted = set(conn.execute(
+                    "SELECT slot, amenity FROM attempts WHERE run_key = ? AND username = ?", (self.run_key, username)))
+                won = {slot for (slot, _), (status, _) in rows.items() if status == "won"}
+                pending = False
+                for amenity_name in self.amenities:
+                    for slot in preferred_order:
+                        key = (slot, amenity_name)
+                        if slot in won or key not in rows or key in attempted:
+                            continue
+                        if rows[key][0] == "open":
+                            conn.execute("UPDATE claims SET status = 'claimed', username = ?, pid = ? WHERE run_key = ? AND slot = ? AND amenity = ?", (username, os.getpid(), self.run_key, slot, amenity_name))
+                            log(username, f"Claimed time slot {slot} at {amenity_name}.")
+                            return key
+                        pending = True
+            if not pending or not wait or time.monotonic() >= deadline:
+                return None
+            time.sleep(self.POLL_INTERVAL)
+
+    def complete(self, slot, amenity_name, username, success):
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO attempts VALUES (?, ?, ?, ?)", (self.run_key, slot, amenity_name, username))
+            already_won = conn.execute("SELECT username, amenity FROM claims WHERE run_key = ? AND slot = ? AND status = 'won'", (self.run_key, slot)).fetchone()
+            if success and not already_won:
+                conn.execute("UPDATE claims SET status = 'won', username = ? WHERE run_key = ? AND slot = ? AND amenity = ?", (username, self.run_key, slot, amenity_name))
+                return
+            if success and tuple(already_won) != (username, amenity_name):
+                log(username, f"Duplicate booking: {slot} at {amenity_name} was already won by {already_won[0]} at {already_won[1]}; cancel one of them.")
+            conn.execute("UPDATE claims SET status = 'open', username = NULL, pid = NULL WHERE run_key = ? AND slot = ? AND amenity = ? AND status = 'claimed' AND username = ?", (self.run_key, slot, amenity_name, username))
+            if not success and amenity_name == self.amenities[0]:
+                conn.executemany("INSERT OR IGNORE INTO claims VALUES (?, ?, ?, 'open', NULL, NULL)", [(self.run_key, slot, fallback) for fallback in self.amenities[1:]])
+
+    def winner(self, slot):
+        with self._connect() as conn:
+            row = conn.execute("SELECT username, amenity FROM claims WHERE run_key = ? AND slot = ? AND status = 'won'", (self.run_key, slot)).fetchone()
+        return tuple(row) if row else None
+
+    def close(self):
+        """Leave the run; once no board of this process is open on it, the process stops counting as a member."""
+        with _open_runs_lock:
+            if self.closed:
+                return
+            self.closed = True
+            key = (self.path, self.run_key)
+            _open_runs[key] -= 1
+            if _open_runs[key]:
+                return
+            del _open_runs[key]
+            with self._connect() as conn:
+                conn.execute("DELETE FROM members WHERE run_key = ? AND pid = ?", (self.run_key, os.getpid()))
+
+
+class _Transaction:
+    """Run a block inside BEGIN IMMEDIATE so concurrent processes claim atomically."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        self.conn.close()
+
+
+def create_claim_board(config, run_key, slots, release_time=None):
+    """
+    Create the claim board selected by config["slot_claims"], or None for fixed rotation.
+    The alternate-amenity fallback needs a board, so it implies an in-process one.
+    """
+    mode = config.get("slot_claims")
+    amenities = [config["primary_amenity_name"]]
+    if config.get("alternate_fallback", False) and config["alternate_amenity_name"] != config["primary_amenity_name"]:
+        amenities.append(config["alternate_amenity_name"])
+        mode = mode or "memory"
+    hedged = config.get("hedged_alternate", False)
+    if mode == "memory":
+        return ClaimBoard(slots, amenities, hedged)
+    if mode == "sqlite":
+        return SqliteClaimBoard(config.get("slot_claims_db", "slot_claims.db"), run_key, slots, amenities, hedged, release_time)
+    return None
+
+
+def iter_claimed_slots(claim_board, username, time_slots, amenity_name, first_claim=None):
+    """Yield the (slot, amenity_name) attempts for a user: its fixed order, or claims from the board."""
+    if claim_board is None:
+        for slot in time_slots:
+            yield slot, amenity_name
+        return
+    if first_claim is not None:
+        yield first_claim
+    while True:
+        claim = claim_board.claim_next(username, time_slots)
+        if claim is None:
+            return
+        yield claim
@@ -0,0 +1,100 @@
+"""
+Submit retries: a failed attempt is classified as retryable (timeouts, stale DOM, 5xx responses, expired
+view state, an unclear postback result) or terminal (allocation limit, slot taken), and retryable ones
+are tried again with jittered exponential backoff until a deadline measured from the fire instant.
+
+A submit may have gone through even though its response was lost, so before resubmitting a slot whose
+form was already posted the user's reservation list is read; a slot found there is not booked again.
+"""
+import random
+import time
+import requests
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException
+import booking_http
+from booking_log import log
+
+RETRY_SECONDS = 10  # Retries stop this long after the fire instant
+RETRY_LIMIT = 5  # Tries after the first one, at most
+BACKOFF_SECONDS = 0.1  # Upper bound of the first backoff; doubles with every retry
+BACKOFF_MAX_SECONDS = 1.0
+
+RETRYABLE = "retryable"
+TERMINAL = "terminal"
+
+# Checked in order against the lower-cased error text; the first match decides
+TERMINAL_MARKERS = ("no longer available", "allocation", "limit", "already reserved", "already booked")
+RETRYABLE_MARKERS = ("state information is invalid", "viewstate", "end time must be greater than start time",
+                     "currently unavailable on the selected date", "incorrect date page", "timed out", "timeout",
+                     "stale element", "server error", "service unavailable", "booking was not successful")
+
+
+def classify(error):
+    """RETRYABLE or TERMINAL for an exception or an error message; anything unrecognized is terminal."""
+    if isinstance(error, (TimeoutException, StaleElementReferenceException, requests.Timeout, requests.ConnectionError)):
+        return RETRYABLE
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        return RETRYABLE if status is not None and status >= 500 else TERMINAL
+    text = str(error).lower()
+    if any(marker in text for marker in TERMINAL_MARKERS):
+        return TERMINAL
+    if any(marker in text for marker in RETRYABLE_MARKERS):
+        return RETRYABLE
+    return TERMINAL
+
+
+class SubmitRetry:
+    """Retry decisions for one (slot, amenity) attempt of a session."""
+
+    def __init__(self, session, config, scheduler, target_date):
+        self.session = session
+        self.target_date = target_date
+        self.deadline = scheduler.fire_monotonic + config.get("submit_retry_seconds", RETRY_SECONDS)
+        self.retries = 0
+
+    def backoff(self):
+        """Full-jitter backoff before the next try, so users that failed together don't retry in lockstep."""
+        return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_SECONDS * 2 ** self.retries))
+
+    def next_try(self, result, error, slot_logger):
+        """
+        Decide whether a failed try is retried. Waits out the backoff and returns True to retry; returns
+        False to stop, after marking the result successful if the reservation list shows the slot booked.
+        """
+        reason = error if error is not None else result["message"]
+        kind = classify(reason)
+        if kind == TERMINAL:
+            slot_logger.info(f"Not retrying: terminal outcome ({result['message']}).")
+            return False
+        delay = self.backoff()
+        if self.retries >= RETRY_LIMIT or time.monotonic() + delay > self.deadline:
+            slot_logger.info(f"Not retrying: retry budget spent after {self.retries} retries.")
+            return False
+        time.sleep(delay)
+        if "t0_to_submit_ms" in result and self._already_booked(result, slot_logger):
+            return False
+        self.retries += 1
+        result["retries"] = self.retries
+        slot_logger.info(f"Retry {self.retries} after {delay * 1000:.0f}ms backoff: {result['message']}")
+        return True
+
+    def _already_booked(self, result, slot_logger):
+        """
+        Check the reservation list for a slot whose form was already posted. Returns True (no resubmit)
+        if it is booked or the list can't be read, so a lost response never turns into a duplicate.
+        """
+        username = self.session["username"]
+        try:
+            http_session = self.session["http_session"] or self.session.get("list_session")
+            if http_session is None:
+                http_session = self.session["list_session"] = booking_http.create_session(self.session["driver"])
+            rows = booking_http.fetch_reservations(http_session, username)
+        except Exception as e:
+            slot_logger.error(f"Not retrying: reservation list unreadable, a resubmit could duplicate the booking: {e}")
+            return True
+        if not booking_http.has_reservation(rows, result["amenity_id"], self.target_date, result["time"]):
+            return False
+        result["status"] = "Success"
+        result["message"] = "Reservation found in the reservation list after an unclear submit."
+        log(username, f"{result['time']} at {result['amenity_name']} is already booked; not resubmitting.")
+        return True